@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Messages.recent_messages 基准测试
+在临时 SQLite 数据库中逐步扩大 messages 表，记录每个规模下最近上下文查询的延迟，
+用于验证 (agent_id, chat_id, time) 复合索引下查询耗时不随表规模增长
+
+用法:
+    python scripts/benchmark_recent_messages.py --max-rows 20000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="recent_messages 基准测试")
+    parser.add_argument("--max-rows", type=int, default=1_000_000, help="最终表规模")
+    parser.add_argument("--agents", type=int, default=20, help="Agent 数量")
+    parser.add_argument("--chats", type=int, default=2000, help="聊天数量")
+    parser.add_argument("--limit", type=int, default=18, help="每次读取的消息条数")
+    parser.add_argument("--samples", type=int, default=500, help="每个规模的查询次数")
+    parser.add_argument("--db", default=None, help="数据库文件路径，默认使用临时文件")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench_recent_messages.db")
+    # 必须在导入 maim_db 之前指定数据库
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+    from maim_db.core.database import get_database
+    from maim_db.core.models import Messages
+
+    db = get_database()
+    db.connect(reuse_if_open=True)
+    db.create_tables([Messages])
+
+    chats = [
+        (f"agent_{i % args.agents}", f"chat_{i}") for i in range(args.chats)
+    ]
+    checkpoints = []
+    size = 10_000
+    while size < args.max_rows:
+        checkpoints.append(size)
+        size *= 10
+    checkpoints.append(args.max_rows)
+
+    print(f"📊 数据库: {db_path}")
+    print(f"{'rows':>12} {'p50(ms)':>10} {'p99(ms)':>10} {'insert(s)':>10}")
+
+    inserted = 0
+    clock = 1_700_000_000.0
+    for target in checkpoints:
+        start = time.perf_counter()
+        with db.atomic():
+            while inserted < target:
+                batch = []
+                for _ in range(min(500, target - inserted)):
+                    agent_id, chat_id = random.choice(chats)
+                    clock += 0.01
+                    batch.append(
+                        {
+                            "agent_id": agent_id,
+                            "message_id": f"msg_{inserted}",
+                            "time": clock,
+                            "chat_id": chat_id,
+                            "chat_info_user_nickname": "benchmark user",
+                            "chat_info_user_cardname": None,
+                            "chat_info_group_name": "benchmark group",
+                            "chat_info_last_active_time": clock,
+                            "processed_plain_text": "benchmark message",
+                        }
+                    )
+                    inserted += 1
+                Messages.insert_many(batch).execute()
+        insert_seconds = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(args.samples):
+            agent_id, chat_id = random.choice(chats)
+            before = random.uniform(1_700_000_000.0, clock)
+            begin = time.perf_counter()
+            Messages.recent_messages(chat_id, before, args.limit, agent_id=agent_id)
+            latencies.append((time.perf_counter() - begin) * 1000)
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(
+            f"{target:>12} {statistics.median(latencies):>10.3f} {p99:>10.3f} {insert_seconds:>10.1f}"
+        )
+
+    agent_id, chat_id = chats[0]
+    query = Messages.select_unscoped().where(
+        (Messages.agent_id == agent_id) & (Messages.chat_id == chat_id) & (Messages.time < clock)
+    ).order_by(Messages.time.desc()).limit(args.limit)
+    sql, params = query.sql()
+    print("\n🔍 查询计划:")
+    for row in db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params):
+        print(f"  {row[-1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+LLM 用量分析基准测试
+在临时 SQLite 数据库中生成合成的 llm_usage 明细，对比两种方式计算同一份用量报告的耗时：
+
+- 逐行：遍历 LLMUsage 模型实例，在 Python 中分组、排序求分位数
+- 列式：usage_analytics 按列读取后用 NumPy 计算
+
+需要安装 NumPy：pip install maim_db[analytics]
+
+用法:
+    python scripts/benchmark_usage_analytics.py --rows 5000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+MODELS = ["deepseek-chat", "qwen-max", "glm-4", "gpt-4o-mini", "doubao-pro"]
+STATUSES = ["success"] * 18 + ["error", "timeout"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="用量分析基准测试")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="明细行数")
+    parser.add_argument("--agent", default="agent_bench", help="Agent ID")
+    parser.add_argument("--db", default=None, help="数据库文件路径，默认使用临时文件")
+    parser.add_argument("--skip-rowwise", action="store_true", help="跳过逐行计算")
+    return parser.parse_args()
+
+
+def percentile(sorted_values, q):
+    """与 numpy 默认 linear 插值一致的分位数"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+def rowwise_report(LLMUsage, agent_id, percentiles=(50, 90, 99)):
+    """逐个模型实例累加的参考实现"""
+    by_model = {}
+    latencies = []
+    for usage in LLMUsage.select_unscoped().where(LLMUsage.agent_id == agent_id):
+        stats = by_model.setdefault(
+            usage.model_name, {"requests": 0, "cost": 0.0, "total_tokens": 0, "errors": 0, "latency": []}
+        )
+        stats["requests"] += 1
+        stats["cost"] += usage.cost
+        stats["total_tokens"] += usage.total_tokens
+        if usage.status != "success":
+            stats["errors"] += 1
+        if usage.time_cost is not None:
+            stats["latency"].append(usage.time_cost)
+            latencies.append(usage.time_cost)
+    latencies.sort()
+    for stats in by_model.values():
+        values = sorted(stats.pop("latency"))
+        stats["time_cost_percentiles"] = {q: percentile(values, q) for q in percentiles}
+    return {q: percentile(latencies, q) for q in percentiles}, by_model
+
+
+def main():
+    args = parse_args()
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench_usage_analytics.db")
+    # 必须在导入 maim_db 之前指定数据库
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+    from maim_db.core.database import get_database
+    from maim_db.core.models import LLMUsage
+    from maim_db.core.usage_analytics import (
+        NUMPY_AVAILABLE,
+        load_usage_columns,
+        usage_report,
+    )
+
+    if not NUMPY_AVAILABLE:
+        print("❌ 未安装 NumPy，请执行: pip install maim_db[analytics]")
+        sys.exit(1)
+
+    db = get_database()
+    db.connect(reuse_if_open=True)
+    db.create_tables([LLMUsage])
+
+    print(f"📊 数据库: {db_path}")
+    existing = LLMUsage.select_unscoped().where(LLMUsage.agent_id == args.agent).count()
+    start = time.perf_counter()
+    clock = datetime(2026, 1, 1)
+    with db.atomic():
+        for offset in range(existing, args.rows, 1000):
+            batch = []
+            for _ in range(min(1000, args.rows - offset)):
+                prompt = random.randint(50, 4000)
+                completion = random.randint(10, 1500)
+                clock += timedelta(milliseconds=500)
+                batch.append(
+                    {
+                        "agent_id": args.agent,
+                        "model_name": random.choice(MODELS),
+                        "user_id": "bench",
+                        "request_type": "chat",
+                        "endpoint": "/chat/completions",
+                        "prompt_tokens": prompt,
+                        "completion_tokens": completion,
+                        "total_tokens": prompt + completion,
+                        "cost": (prompt * 2 + completion * 8) / 1_000_000,
+                        "time_cost": random.lognormvariate(0.5, 0.6) if random.random() > 0.01 else None,
+                        "status": random.choice(STATUSES),
+                        "timestamp": clock,
+                    }
+                )
+            LLMUsage.insert_many(batch).execute()
+    print(f"✅ 生成 {max(args.rows - existing, 0)} 行，用时 {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    columns = load_usage_columns(agent_id=args.agent)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    report = usage_report(columns)
+    compute_seconds = time.perf_counter() - start
+    nbytes = sum(
+        getattr(columns, name).nbytes
+        for name in ("model", "status", "prompt_tokens", "completion_tokens", "total_tokens", "cost", "time_cost")
+    )
+    print(f"\n{'方式':<8} {'读取(s)':>10} {'计算(s)':>10} {'合计(s)':>10}")
+    print(f"{'列式':<8} {load_seconds:>10.2f} {compute_seconds:>10.3f} {load_seconds + compute_seconds:>10.2f}")
+    print(f"   列数组内存: {nbytes / 1024 / 1024:.1f} MB，共 {len(columns)} 行")
+
+    if not args.skip_rowwise:
+        start = time.perf_counter()
+        overall, by_model = rowwise_report(LLMUsage, args.agent)
+        rowwise_seconds = time.perf_counter() - start
+        print(f"{'逐行':<8} {'-':>10} {'-':>10} {rowwise_seconds:>10.2f}")
+        # 两种方式结果应一致
+        for name, stats in by_model.items():
+            fast = report["by_model"][name]
+            assert fast["requests"] == stats["requests"]
+            assert fast["total_tokens"] == stats["total_tokens"]
+            assert abs(fast["cost"] - stats["cost"]) < 1e-6 * max(1.0, stats["cost"])
+            for q, value in stats["time_cost_percentiles"].items():
+                assert abs(fast["time_cost_percentiles"][q] - value) < 1e-9
+        for q, value in overall.items():
+            assert abs(report["time_cost_percentiles"][q] - value) < 1e-9
+        print("✅ 两种方式结果一致")
+
+    print("\n📈 各模型:")
+    for name, stats in sorted(report["by_model"].items()):
+        p = stats["time_cost_percentiles"]
+        print(
+            f"  {name:<14} 请求 {stats['requests']:>9}  成本 {stats['cost']:>10.2f}  "
+            f"错误率 {stats['error_rate']:.2%}  p50 {p[50]:.2f}s  p99 {p[99]:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
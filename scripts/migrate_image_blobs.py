@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+内容寻址图片存储迁移脚本
+创建 image_blobs 表，为 images 表添加 blob_hash 列，并把 path 的全局唯一索引
+替换为 (agent_id, path) 唯一索引，使多个 Agent 可以引用同一个文件。
+已有记录仍指向原文件，不会被移动；新图片通过 image_store.add_image() 登记。
+"""
+
+import os
+import sys
+
+# 添加 src 目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from peewee import CharField
+from playhouse.migrate import SchemaMigrator, migrate
+
+from maim_db.core.database import db_manager
+from maim_db.core.models import ImageBlob
+
+OLD_INDEX_NAME = "images_path"
+NEW_INDEX_NAME = "images_agent_id_path"
+
+
+def migrate_schema(db):
+    """创建 image_blobs 并调整 images 的列与索引"""
+    print("📦 创建 image_blobs 表...")
+    db.create_tables([ImageBlob], safe=True)
+
+    print("📦 检查 images 表结构...")
+    migrator = SchemaMigrator.from_database(db)
+    operations = []
+    columns = {column.name for column in db.get_columns("images")}
+    if "blob_hash" not in columns:
+        operations.append(migrator.add_column("images", "blob_hash", CharField(max_length=64, null=True)))
+        operations.append(migrator.add_index("images", ("blob_hash",), False))
+    else:
+        print("ℹ️  images.blob_hash 已存在")
+    indexes = {index.name for index in db.get_indexes("images")}
+    if OLD_INDEX_NAME in indexes:
+        operations.append(migrator.drop_index("images", OLD_INDEX_NAME))
+    if NEW_INDEX_NAME not in indexes:
+        operations.append(migrator.add_index("images", ("agent_id", "path"), True))
+    else:
+        print("ℹ️  (agent_id, path) 唯一索引已存在")
+    if operations:
+        with db.atomic():
+            migrate(*operations)
+    print("✅ 表结构迁移完成")
+
+
+def main():
+    """主迁移函数"""
+    print("🚀 开始内容寻址图片存储迁移")
+    print("=" * 60)
+    try:
+        db_manager.connect()
+        db = db_manager.get_database()
+        migrate_schema(db)
+        print("=" * 60)
+        print("✅ 迁移完成！")
+        print("\n📝 说明:")
+        print("  • 文件存放在 IMAGE_STORE_DIR 下，按内容 SHA-256 去重")
+        print("  • 引用计数由计数器缓冲批量写入，需运行 CounterFlushWorker")
+        print("  • ImageStoreGCWorker 定期删除超过宽限期仍无引用的文件")
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        sys.exit(1)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
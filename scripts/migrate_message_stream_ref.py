@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+messages 表 stream_ref 迁移脚本
+为已有数据库添加 stream_ref 列及索引，并按 chat_id 回填所属聊天流的主键
+"""
+
+import os
+import sys
+
+# 添加 src 目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from peewee import IntegerField
+from playhouse.migrate import SchemaMigrator, migrate
+
+from maim_db.core.database import db_manager
+from maim_db.core.models import ChatStreams, Messages
+
+
+def migrate_schema(db):
+    """添加 stream_ref 列及索引"""
+    print("📦 检查 messages 表结构...")
+    columns = {column.name for column in db.get_columns("messages")}
+    if "stream_ref" in columns:
+        print("✅ stream_ref 列已存在，跳过")
+        return
+
+    migrator = SchemaMigrator.from_database(db)
+    with db.atomic():
+        migrate(
+            migrator.add_column("messages", "stream_ref", IntegerField(null=True)),
+            migrator.add_index("messages", ("stream_ref",), False),
+        )
+    print("✅ 表结构迁移完成")
+
+
+def backfill_stream_ref():
+    """按聊天流回填 stream_ref"""
+    print("🔗 开始回填历史消息的 stream_ref...")
+    db = Messages._meta.database
+    stream_count = 0
+    updated = 0
+    for stream in ChatStreams.select_unscoped().iterator():
+        with db.atomic():
+            updated += Messages.update(stream_ref=stream.id).where(
+                (Messages.chat_id == stream.stream_id)
+                & (Messages.agent_id == stream.agent_id)
+                & Messages.stream_ref.is_null()
+            ).execute()
+        stream_count += 1
+    print(f"✅ 已处理 {stream_count} 个聊天流，回填 {updated} 条消息")
+
+
+def main():
+    """主迁移函数"""
+    print("🚀 开始 messages 表 stream_ref 迁移")
+    print("=" * 60)
+    try:
+        db_manager.connect()
+        db = db_manager.get_database()
+        migrate_schema(db)
+        backfill_stream_ref()
+        print("=" * 60)
+        print("✅ 迁移完成！")
+        print("\n📝 说明:")
+        print("  • 迁移可重复执行，已回填的行不会被重复处理")
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        sys.exit(1)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+感知哈希列迁移脚本
+为已有数据库的 emoji、images 表添加 perceptual_hash 列。
+历史记录的 pHash 需由上层按图片文件计算后回填，未回填的记录不参与近似去重。
+"""
+
+import os
+import sys
+
+# 添加 src 目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from peewee import CharField
+from playhouse.migrate import SchemaMigrator, migrate
+
+from maim_db.core.database import db_manager
+from maim_db.core.models import Emoji, Images
+
+
+def migrate_schema(db):
+    """为 emoji、images 添加 perceptual_hash 列"""
+    migrator = SchemaMigrator.from_database(db)
+    operations = []
+    for model in (Emoji, Images):
+        table = model._meta.table_name
+        print(f"📦 检查 {table} 表结构...")
+        columns = {column.name for column in db.get_columns(table)}
+        if "perceptual_hash" in columns:
+            print(f"ℹ️  {table}.perceptual_hash 已存在")
+            continue
+        operations.append(
+            migrator.add_column(table, "perceptual_hash", CharField(max_length=16, null=True))
+        )
+    if operations:
+        with db.atomic():
+            migrate(*operations)
+    print("✅ 表结构迁移完成")
+
+
+def main():
+    """主迁移函数"""
+    print("🚀 开始感知哈希列迁移")
+    print("=" * 60)
+    try:
+        db_manager.connect()
+        db = db_manager.get_database()
+        migrate_schema(db)
+        print("=" * 60)
+        print("✅ 迁移完成！")
+        print("\n📝 说明:")
+        print("  • perceptual_hash 存储 64 位 pHash 的 16 位十六进制字符串")
+        print("  • 回填历史数据后需调用 forget_agent() 或 clear() 使内存索引重新加载")
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        sys.exit(1)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+person_info 复合索引迁移脚本
+为已有数据库的 person_info 表创建 (agent_id, platform, user_id) 索引，
+收到消息时按平台用户查找人物信息不再经 user_id 索引后逐行过滤。
+"""
+
+import os
+import sys
+
+# 添加 src 目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from maim_db.core.database import db_manager
+from maim_db.core.models import PersonInfo
+
+INDEX_NAME = "personinfo_agent_id_platform_user_id"
+
+
+def create_index(db):
+    """创建 (agent_id, platform, user_id) 索引"""
+    existing = {index.name for index in db.get_indexes("person_info")}
+    if INDEX_NAME in existing:
+        print("ℹ️  复合索引已存在")
+        return
+    PersonInfo._schema.create_indexes(safe=True)
+    print("✅ 复合索引创建完成")
+
+
+def main():
+    """主迁移函数"""
+    print("🚀 开始 person_info 复合索引迁移")
+    print("=" * 60)
+    try:
+        db_manager.connect()
+        db = db_manager.get_database()
+        create_index(db)
+        print("=" * 60)
+        print("✅ 迁移完成！")
+        print("\n📝 说明:")
+        print("  • 查找人物信息请使用 resolve_person()，结果缓存在进程内")
+        print("  • know_times/last_know 由计数器缓冲批量写入，需运行 CounterFlushWorker")
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        sys.exit(1)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+messages 唯一索引迁移脚本
+删除同一 Agent 下 message_id 重复的消息（保留最早写入的一条），
+然后创建 (agent_id, message_id) 唯一索引。存在重复消息时服务启动建表会报错退出，
+需先在维护窗口内运行本脚本。
+"""
+
+import os
+import sys
+
+# 添加 src 目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from maim_db.core.database import db_manager
+from maim_db.core.models import Messages
+
+INDEX_NAME = "messages_agent_id_message_id"
+
+
+def remove_duplicates(batch_size: int = 1000) -> int:
+    """分批删除重复消息，返回删除条数"""
+    print("🔍 查找重复消息...")
+    removed = Messages.remove_duplicate_messages(batch_size)
+    print(f"✅ 已删除 {removed} 条重复消息")
+    return removed
+
+
+def create_index(db):
+    """创建 (agent_id, message_id) 唯一索引"""
+    if Messages.partitioner.enabled:
+        print("ℹ️  已启用按月分区，各分区表创建时已带有唯一索引")
+        return
+    existing = {index.name for index in db.get_indexes("messages")}
+    if INDEX_NAME in existing:
+        print("ℹ️  唯一索引已存在")
+        return
+    Messages._schema.create_indexes(safe=True)
+    print("✅ 唯一索引创建完成")
+
+
+def main():
+    """主迁移函数"""
+    print("🚀 开始 messages 唯一索引迁移")
+    print("=" * 60)
+    try:
+        db_manager.connect()
+        db = db_manager.get_database()
+        remove_duplicates()
+        create_index(db)
+        print("=" * 60)
+        print("✅ 迁移完成！")
+        print("\n📝 说明:")
+        print("  • 重复消息保留 id 最小（最早写入）的一条")
+        print("  • 启用按月分区时各分区表在创建时已带有唯一索引，本脚本只处理原表")
+        print("  • 已启用全文检索时，迁移后需调用 enable_fulltext_search(rebuild=True) 重建索引")
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        sys.exit(1)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
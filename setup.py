@@ -52,6 +52,9 @@ setup(
         "mysql": [
             "PyMySQL>=1.0.0",
         ],
+        "analytics": [
+            "numpy>=1.21.0",
+        ],
     },
     include_package_data=True,
     zip_safe=False,
@@ -35,6 +35,109 @@ from .async_models import (
     AsyncAgentActiveState,
 )
 
+# 导入分页工具
+from .pagination import KeysetPage, keyset_paginate
+
+# 导入时间分区
+from .partitioning import MonthlyPartitioner
+
+# 导入全文检索
+from .fulltext import (
+    FullTextIndex,
+    SearchHit,
+    enable_fulltext_search,
+    search_messages,
+    search_summaries,
+)
+
+# 导入消息归档
+from .archive import MessageArchive, MessageArchiveWorker
+
+# 导入流式导出
+from .export import (
+    agent_export_query,
+    aiter_export,
+    aiter_rows,
+    iter_export,
+    iter_rows,
+    write_export,
+)
+
+# 导入最近消息缓存
+from .message_cache import RecentMessageCache, recent_message_cache
+
+# 导入消息去重写入
+from .dedup import MessageIngestor, message_ingestor
+
+# 导入聊天时间线
+from .timeline import TimelineEntry, chat_timeline
+
+# 导入 LLM 用量汇总
+from .usage_rollup import UsageRollup, UsageRollupWorker, usage_rollup, usage_summary
+
+# 导入 LLM 用量分析（需要可选依赖 NumPy）
+from .usage_analytics import (
+    NUMPY_AVAILABLE,
+    UsageColumns,
+    agent_usage_report,
+    load_usage_columns,
+    usage_report,
+)
+
+# 导入配额管理
+from .quota import (
+    QuotaExceededError,
+    QuotaFlushWorker,
+    QuotaLimit,
+    QuotaManager,
+    Reservation,
+    quota_manager,
+)
+
+# 导入模型计价
+from .pricing import ModelPrice, PricingResolver, areprice_usage, pricing_resolver, reprice_usage
+
+# 导入感知哈希近似去重索引
+from .phash_index import (
+    PerceptualHashIndex,
+    SimilarMatch,
+    emoji_phash_index,
+    enable_phash_indexes,
+    image_phash_index,
+)
+
+# 导入表情包情感标签索引
+from .emoji_index import EmojiTagIndex, emoji_tag_index, parse_emotion_tags
+
+# 导入计数器缓冲
+from .counters import CounterBuffer, CounterFlushWorker, counter_buffer, record_emoji_usage
+
+# 导入描述缓存
+from .description_cache import (
+    CachedDescription,
+    DescriptionCache,
+    emoji_description_cache,
+    enable_description_caches,
+    image_description_cache,
+)
+
+# 导入内容寻址图片存储
+from .image_store import ImageStore, ImageStoreGCWorker, StoredImage, image_store
+
+# 导入人物信息缓存
+from .person_resolver import PersonResolver, person_resolver, resolve_person
+
+# 导入后台任务与活跃状态组件
+from .background import PeriodicWorker
+from .agent_activity import (
+    ActiveAgentChanges,
+    ActiveStateRetention,
+    ActiveAgentFeed,
+    AgentExpiryScheduler,
+    HeartbeatAggregator,
+    heartbeat_aggregator,
+)
+
 # 导入所有模型
 from .models import (
     # 模型集合
@@ -53,6 +156,8 @@ from .models import (
     Agent,
     ApiKey,
     AgentActiveState,
+    QuotaCounter,
+    ImageBlob,
     # 基础模型
     BusinessBaseModel,
     # 业务模型
@@ -101,6 +206,98 @@ __all__ = [
     "AsyncAgent",
     "AsyncApiKey",
     "AsyncAgentActiveState",
+    # 分页工具
+    "KeysetPage",
+    "keyset_paginate",
+    # 时间分区
+    "MonthlyPartitioner",
+    # 全文检索
+    "FullTextIndex",
+    "SearchHit",
+    "enable_fulltext_search",
+    "search_messages",
+    "search_summaries",
+    # 消息归档
+    "MessageArchive",
+    "MessageArchiveWorker",
+    # 流式导出
+    "agent_export_query",
+    "iter_rows",
+    "iter_export",
+    "write_export",
+    "aiter_rows",
+    "aiter_export",
+    # 最近消息缓存
+    "RecentMessageCache",
+    "recent_message_cache",
+    # 消息去重写入
+    "MessageIngestor",
+    "message_ingestor",
+    # 聊天时间线
+    "TimelineEntry",
+    "chat_timeline",
+    # LLM 用量汇总
+    "UsageRollup",
+    "UsageRollupWorker",
+    "usage_rollup",
+    "usage_summary",
+    # LLM 用量分析
+    "NUMPY_AVAILABLE",
+    "UsageColumns",
+    "load_usage_columns",
+    "usage_report",
+    "agent_usage_report",
+    # 配额管理
+    "QuotaLimit",
+    "Reservation",
+    "QuotaExceededError",
+    "QuotaManager",
+    "QuotaFlushWorker",
+    "quota_manager",
+    # 模型计价
+    "ModelPrice",
+    "PricingResolver",
+    "pricing_resolver",
+    "reprice_usage",
+    "areprice_usage",
+    # 感知哈希近似去重索引
+    "PerceptualHashIndex",
+    "SimilarMatch",
+    "emoji_phash_index",
+    "image_phash_index",
+    "enable_phash_indexes",
+    # 表情包情感标签索引
+    "EmojiTagIndex",
+    "emoji_tag_index",
+    "parse_emotion_tags",
+    # 计数器缓冲
+    "CounterBuffer",
+    "CounterFlushWorker",
+    "counter_buffer",
+    "record_emoji_usage",
+    # 描述缓存
+    "CachedDescription",
+    "DescriptionCache",
+    "image_description_cache",
+    "emoji_description_cache",
+    "enable_description_caches",
+    # 内容寻址图片存储
+    "ImageStore",
+    "ImageStoreGCWorker",
+    "StoredImage",
+    "image_store",
+    # 人物信息缓存
+    "PersonResolver",
+    "person_resolver",
+    "resolve_person",
+    # 后台任务与活跃状态组件
+    "PeriodicWorker",
+    "HeartbeatAggregator",
+    "heartbeat_aggregator",
+    "ActiveAgentFeed",
+    "ActiveAgentChanges",
+    "AgentExpiryScheduler",
+    "ActiveStateRetention",
     # 枚举类
     "TenantType",
     "TenantStatus",
@@ -112,6 +309,8 @@ __all__ = [
     "Agent",
     "ApiKey",
     "AgentActiveState",
+    "QuotaCounter",
+    "ImageBlob",
     # 基础模型
     "BusinessBaseModel",
     # 业务模型
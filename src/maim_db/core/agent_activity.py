@@ -0,0 +1,401 @@
+"""
+Agent 活跃状态的运行时组件
+在 agent_active_states 表之上提供心跳聚合、增量变更流、过期调度与过期记录清理等
+进程内能力，降低数据库的读写压力
+"""
+
+import asyncio
+import heapq
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from .background import PeriodicWorker, run_sync
+from .models.system_v2 import AgentActiveState
+from .settings import settings
+
+
+class HeartbeatAggregator(PeriodicWorker):
+    """心跳聚合器
+
+    在内存中记录每个 (tenant_id, agent_id) 的最新心跳，每个刷写周期用一条批量
+    upsert 写入 agent_active_states。写入的 expires_at 按心跳发生时间计算，
+    因此数据库中的 expires_at 相比真实值最多滞后一个刷写周期。
+    """
+
+    def __init__(self, flush_interval: float = 5.0):
+        super().__init__(flush_interval)
+        self._pending: Dict[Tuple[str, str], Tuple[int, datetime]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pending_count(self) -> int:
+        """尚未刷写的心跳数量"""
+        return len(self._pending)
+
+    def record(
+        self,
+        tenant_id: str,
+        agent_id: str,
+        ttl_seconds: int,
+        *,
+        current_time: datetime = None,
+    ) -> datetime:
+        """记录一次心跳，只保留每个 Agent 的最新一次，返回记录的心跳时间"""
+        if ttl_seconds <= 0:
+            raise ValueError("ttl_seconds 必须为正数")
+        if ttl_seconds <= self.interval:
+            raise ValueError("ttl_seconds 必须大于刷写周期，否则记录可能在刷写前过期")
+
+        now = current_time or datetime.utcnow()
+        with self._lock:
+            self._pending[(tenant_id, agent_id)] = (ttl_seconds, now)
+        return now
+
+    def flush_sync(self) -> int:
+        """同步刷写所有待写心跳，返回写入的记录数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        heartbeats = [
+            (tenant_id, agent_id, ttl_seconds, seen_at)
+            for (tenant_id, agent_id), (ttl_seconds, seen_at) in pending.items()
+        ]
+        try:
+            return AgentActiveState.touch_many(heartbeats)
+        except Exception:
+            # 写入失败时放回队列，保留期间到达的更新心跳
+            with self._lock:
+                for key, value in pending.items():
+                    newer = self._pending.get(key)
+                    if newer is None or newer[1] < value[1]:
+                        self._pending[key] = value
+            raise
+
+    async def flush(self) -> int:
+        """异步刷写所有待写心跳"""
+        return await run_sync(self.flush_sync)
+
+    async def run_once(self):
+        await self.flush()
+
+    async def on_stop(self):
+        await self.flush()
+
+
+# 全局心跳聚合器，start() 后 AsyncAgentActiveState.upsert 的心跳经由它批量写入
+heartbeat_aggregator = HeartbeatAggregator()
+
+
+class ExpiryHeap:
+    """按 key 维护最新过期时间的最小堆
+
+    更新同一 key 时直接压入新条目，旧条目在弹出时按惰性删除丢弃。
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, Hashable]] = []
+        self._deadlines: Dict[Hashable, datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key) -> bool:
+        return key in self._deadlines
+
+    def keys(self):
+        """当前跟踪的所有 key"""
+        return self._deadlines.keys()
+
+    def get(self, key) -> Optional[datetime]:
+        """获取 key 的过期时间"""
+        return self._deadlines.get(key)
+
+    def set(self, key, expires_at: datetime):
+        """设置 key 的过期时间"""
+        if self._deadlines.get(key) == expires_at:
+            return
+        self._deadlines[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+        # 过期条目堆积过多时重建堆，避免频繁续期导致内存膨胀
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, k) for k, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, key):
+        """移除 key"""
+        self._deadlines.pop(key, None)
+
+    def peek(self) -> Optional[datetime]:
+        """最早的过期时间，没有记录时返回 None"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: datetime) -> List[Hashable]:
+        """弹出所有在 now 之前（含）过期的 key"""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) == expires_at:
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+    def _drop_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+
+class ActiveAgentChanges(NamedTuple):
+    """一次增量轮询的结果"""
+
+    became_active: List[Tuple[str, str]]
+    became_inactive: List[Tuple[str, str]]
+    cursor: datetime
+
+
+class ActiveAgentFeed:
+    """活跃 Agent 增量变更流
+
+    首次轮询（或未传入游标）时通过 list_active() 做一次全量同步，之后只按
+    last_seen_at 索引读取游标之后有心跳的记录，并用进程内过期堆判定下线，
+    使每次轮询的开销与变更数量成正比，而不是与 Agent 总数成正比。
+
+    lookback_seconds 用于覆盖写入方的时钟偏差与心跳聚合的刷写延迟，
+    应不小于 HeartbeatAggregator 的刷写周期。
+    """
+
+    def __init__(self, *, lookback_seconds: float = 10.0):
+        if lookback_seconds < 0:
+            raise ValueError("lookback_seconds 不能为负数")
+        self.lookback = timedelta(seconds=lookback_seconds)
+        self._expiry = ExpiryHeap()
+        self._synced = False
+
+    def active_agents(self) -> List[Tuple[str, str]]:
+        """当前视图中的活跃 Agent"""
+        return list(self._expiry.keys())
+
+    def poll(
+        self, cursor: Optional[datetime] = None, *, current_time: datetime = None
+    ) -> ActiveAgentChanges:
+        """返回自 cursor 以来变为活跃/不活跃的 (tenant_id, agent_id)
+
+        返回值中的 cursor 应在下次轮询时传回。
+        """
+        now = current_time or datetime.utcnow()
+        if cursor is None or not self._synced:
+            return self._resync(now)
+
+        became_active = []
+        query = AgentActiveState.list_touched_since(
+            cursor - self.lookback, current_time=now
+        ).select(
+            AgentActiveState.tenant_id,
+            AgentActiveState.agent_id,
+            AgentActiveState.expires_at,
+        )
+        for tenant_id, agent_id, expires_at in query.tuples():
+            key = (tenant_id, agent_id)
+            if key not in self._expiry:
+                became_active.append(key)
+            self._expiry.set(key, expires_at)
+
+        became_inactive = self._expiry.pop_expired(now)
+        return ActiveAgentChanges(became_active, became_inactive, now)
+
+    async def poll_async(
+        self, cursor: Optional[datetime] = None, *, current_time: datetime = None
+    ) -> ActiveAgentChanges:
+        """poll() 的异步版本"""
+        return await run_sync(self.poll, cursor, current_time=current_time)
+
+    def _resync(self, now: datetime) -> ActiveAgentChanges:
+        query = AgentActiveState.list_active(current_time=now).select(
+            AgentActiveState.tenant_id,
+            AgentActiveState.agent_id,
+            AgentActiveState.expires_at,
+        )
+        current = {
+            (tenant_id, agent_id): expires_at
+            for tenant_id, agent_id, expires_at in query.tuples()
+        }
+
+        became_inactive = [key for key in self._expiry.keys() if key not in current]
+        for key in became_inactive:
+            self._expiry.discard(key)
+        became_active = [key for key in current if key not in self._expiry]
+        for key, expires_at in current.items():
+            self._expiry.set(key, expires_at)
+
+        self._synced = True
+        return ActiveAgentChanges(became_active, became_inactive, now)
+
+
+class AgentExpiryScheduler:
+    """Agent 过期调度器
+
+    以过期堆维护每个 Agent 的 expires_at，在 TTL 到期时立即触发 on_expire
+    回调（支持普通函数与协程函数）。启动时从 list_active() 载入现状，运行中
+    通过 AgentActiveState 的心跳监听器感知本进程内的 touch，只有 reconcile()
+    才会再次读取数据库（例如重启后，或需要纳入其他进程写入的心跳时）。
+    """
+
+    def __init__(self, on_expire: Callable[[str, str], Any]):
+        self.on_expire = on_expire
+        self._expiry = ExpiryHeap()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        """调度器是否在运行"""
+        return self._task is not None and not self._task.done()
+
+    def expires_at(self, tenant_id: str, agent_id: str) -> Optional[datetime]:
+        """当前记录的过期时间"""
+        return self._expiry.get((tenant_id, agent_id))
+
+    async def start(self):
+        """载入当前活跃记录并启动调度"""
+        if self.running:
+            return
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._wakeup = asyncio.Event()
+        await self.reconcile()
+        AgentActiveState.add_touch_listener(self.schedule)
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        """停止调度，未触发的过期不会再回调"""
+        AgentActiveState.remove_touch_listener(self.schedule)
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def reconcile(self, *, current_time: datetime = None) -> int:
+        """按数据库中的未过期记录校正本地状态，返回载入的记录数"""
+
+        def _load():
+            query = AgentActiveState.list_active(current_time=current_time).select(
+                AgentActiveState.tenant_id,
+                AgentActiveState.agent_id,
+                AgentActiveState.expires_at,
+            )
+            return list(query.tuples())
+
+        rows = await run_sync(_load)
+        for tenant_id, agent_id, expires_at in rows:
+            current = self._expiry.get((tenant_id, agent_id))
+            if current is None or current < expires_at:
+                self._schedule(tenant_id, agent_id, expires_at)
+        return len(rows)
+
+    def schedule(self, tenant_id: str, agent_id: str, expires_at: datetime):
+        """设置 Agent 的过期时间，可在任意线程调用"""
+        if self._loop is None:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._schedule(tenant_id, agent_id, expires_at)
+        else:
+            self._loop.call_soon_threadsafe(
+                self._schedule, tenant_id, agent_id, expires_at
+            )
+
+    def _schedule(self, tenant_id: str, agent_id: str, expires_at: datetime):
+        earliest = self._expiry.peek()
+        self._expiry.set((tenant_id, agent_id), expires_at)
+        if earliest is None or expires_at < earliest:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            deadline = self._expiry.peek()
+            if deadline is None:
+                await self._wakeup.wait()
+            else:
+                delay = (deadline - datetime.utcnow()).total_seconds()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            self._wakeup.clear()
+
+            for tenant_id, agent_id in self._expiry.pop_expired(datetime.utcnow()):
+                self._fire(tenant_id, agent_id)
+
+    def _fire(self, tenant_id: str, agent_id: str):
+        try:
+            result = self.on_expire(tenant_id, agent_id)
+            if asyncio.iscoroutine(result):
+                self._loop.create_task(result)
+        except Exception as e:
+            print(f"⚠️ Agent 过期回调执行失败 ({tenant_id}/{agent_id}): {e}")
+
+
+class ActiveStateRetention(PeriodicWorker):
+    """过期心跳记录清理任务
+
+    周期性删除过期超过 grace_seconds 的 agent_active_states 记录。每批删除都在
+    线程池中独立执行并在批次之间让出事件循环，不会长时间占用写锁阻塞心跳写入。
+    """
+
+    def __init__(
+        self,
+        *,
+        grace_seconds: int = None,
+        interval: float = 3600.0,
+        batch_size: int = 1000,
+    ):
+        super().__init__(interval)
+        if grace_seconds is None:
+            grace_seconds = settings.agent_state_retention_seconds
+        if grace_seconds < 0:
+            raise ValueError("grace_seconds 不能为负数")
+        if batch_size <= 0:
+            raise ValueError("batch_size 必须为正数")
+        self.grace = timedelta(seconds=grace_seconds)
+        self.batch_size = batch_size
+        self.last_reclaimed = 0
+        self.total_reclaimed = 0
+
+    async def purge(self, *, current_time: datetime = None) -> int:
+        """执行一轮清理，返回本轮删除的行数"""
+        cutoff = (current_time or datetime.utcnow()) - self.grace
+        reclaimed = 0
+        while True:
+            deleted = await run_sync(
+                AgentActiveState.purge_expired_batch, cutoff, batch_size=self.batch_size
+            )
+            reclaimed += deleted
+            if deleted < self.batch_size:
+                break
+            await asyncio.sleep(0)
+
+        self.last_reclaimed = reclaimed
+        self.total_reclaimed += reclaimed
+        return reclaimed
+
+    async def run_once(self):
+        await self.purge()
+
+
+__all__ = [
+    "HeartbeatAggregator",
+    "heartbeat_aggregator",
+    "ExpiryHeap",
+    "ActiveAgentChanges",
+    "ActiveAgentFeed",
+    "AgentExpiryScheduler",
+    "ActiveStateRetention",
+]
@@ -27,6 +27,8 @@ from .models import (
     ModelInfoModel,
     ModelConfigOverrides,
 )
+from .message_cache import recent_message_cache
+from .pricing import pricing_resolver
 
 
 class AgentConfigManager:
@@ -136,6 +138,8 @@ class AgentConfigManager:
 
     def _create_chat_config_overrides(self, config_data: Dict[str, Any]) -> ChatConfigOverrides:
         """创建聊天配置覆盖"""
+        # 上下文长度可能变化，丢弃按旧长度缓存的最近消息
+        recent_message_cache.forget_agent(self.agent_id)
         return ChatConfigOverrides.create(
             id=generate_config_id(),
             agent_id=self.agent_id,
@@ -575,6 +579,7 @@ class AgentConfigManager:
                         price_out=m_data.get("price_out", 0.0),
                         extra_params=serialize_json_field(m_data.get("extra_params", {}))
                     )
+            pricing_resolver.invalidate(self.agent_id)
 
         # 3. 更新 Task Config (存入 ModelConfigOverrides)
         if "model_task_config" in model_data:
@@ -591,6 +596,8 @@ class AgentConfigManager:
 
     def delete_all_configs(self):
         """删除Agent的所有配置"""
+        recent_message_cache.forget_agent(self.agent_id)
+        pricing_resolver.invalidate(self.agent_id)
         try:
             # 删除人格配置
             personality = self.get_personality_config()
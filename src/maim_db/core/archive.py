@@ -0,0 +1,277 @@
+"""
+消息冷存储归档
+把超过保留期的消息移出数据库，按 Agent、按月写入只追加的 gzip 分段文件：
+
+    {root}/{agent_id}/{YYYYMM}.jsonl.gz   每次归档追加一个 gzip 成员，每行一条消息
+    {root}/{agent_id}/index.json          各分段的时间范围、条数与包含的聊天
+
+先写分段文件再分批删除数据库中的记录，中途失败时重复归档的记录在读取时按
+(id, time) 去重。读取接口先查数据库，不足部分从归档中补齐。
+SQLite 删除记录后文件不会自动变小，需要执行 VACUUM 或开启 auto_vacuum。
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time as time_module
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List
+
+from .background import PeriodicWorker, run_sync
+from .context_manager import get_current_agent_id
+from .fulltext import message_index
+from .models.maimbot_models import Messages
+from .settings import settings
+
+
+def _period(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y%m")
+
+
+class MessageArchive:
+    """消息归档存储
+
+    Args:
+        root: 归档根目录，默认 settings.message_archive_dir
+        retention_seconds: 默认保留期，早于 now - retention_seconds 的消息会被归档
+        agent_retention: 按 Agent 覆盖的保留期（秒）
+        batch_size: 每批读取与删除的记录数
+    """
+
+    def __init__(
+        self,
+        root: str = None,
+        *,
+        retention_seconds: float = None,
+        agent_retention: Dict[str, float] = None,
+        batch_size: int = 1000,
+    ):
+        if batch_size <= 0:
+            raise ValueError("batch_size 必须为正数")
+        self.root = root or settings.message_archive_dir
+        if retention_seconds is None:
+            retention_seconds = settings.message_archive_after_seconds
+        self.retention_seconds = retention_seconds
+        self.agent_retention = dict(agent_retention or {})
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+
+    # ---- 归档 ----
+
+    def cutoff_for(self, agent_id: str, current_time: float = None) -> float:
+        """Agent 的归档截止时间，早于该时间的消息会被归档"""
+        retention = self.agent_retention.get(agent_id, self.retention_seconds)
+        return (current_time or time_module.time()) - retention
+
+    def archive_agent(self, agent_id: str, *, current_time: float = None) -> int:
+        """归档一个 Agent 的过期消息，返回归档条数"""
+        cutoff = self.cutoff_for(agent_id, current_time)
+        archived = 0
+        for model in Messages.partitioner.models_for_range(end=cutoff):
+            while True:
+                count = self.archive_batch(model, agent_id, cutoff)
+                archived += count
+                if count < self.batch_size:
+                    break
+        return archived
+
+    def expired_agents(self, current_time: float = None) -> List[str]:
+        """可能存在过期消息的 Agent"""
+        shortest = min([self.retention_seconds, *self.agent_retention.values()])
+        cutoff = (current_time or time_module.time()) - shortest
+        query = Messages.partitioner.select_range(
+            end=cutoff, build=lambda model: model.select_unscoped(model.agent_id).distinct()
+        )
+        return sorted({row[0] for row in query.tuples()})
+
+    def archive_all(self, *, current_time: float = None) -> Dict[str, int]:
+        """归档所有 Agent 的过期消息，返回各 Agent 的归档条数"""
+        results = {}
+        for agent_id in self.expired_agents(current_time):
+            count = self.archive_agent(agent_id, current_time=current_time)
+            if count:
+                results[agent_id] = count
+        return results
+
+    def archive_batch(self, model, agent_id: str, cutoff: float) -> int:
+        """把一批早于 cutoff 的消息写入归档并从数据库删除，返回条数"""
+        rows = list(
+            model.select_unscoped()
+            .where((model.agent_id == agent_id) & (model.time < cutoff))
+            .order_by(model.id)
+            .limit(self.batch_size)
+            .dicts()
+        )
+        if not rows:
+            return 0
+
+        by_period: Dict[str, List[dict]] = {}
+        for row in rows:
+            by_period.setdefault(_period(row["time"]), []).append(row)
+        for period, period_rows in by_period.items():
+            self._append(agent_id, period, period_rows)
+
+        ids = [row["id"] for row in rows]
+        with model._meta.database.atomic():
+            message_index.remove_rows(ids)
+            model.delete().where(model.id.in_(ids)).execute()
+        return len(rows)
+
+    def _agent_dir(self, agent_id: str) -> str:
+        return os.path.join(self.root, agent_id)
+
+    def _append(self, agent_id: str, period: str, rows: List[dict]):
+        directory = self._agent_dir(agent_id)
+        os.makedirs(directory, exist_ok=True)
+        payload = "".join(
+            json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows
+        ).encode("utf-8")
+        with self._lock:
+            path = os.path.join(directory, f"{period}.jsonl.gz")
+            with open(path, "ab") as segment:
+                segment.write(gzip.compress(payload))
+                segment.flush()
+                os.fsync(segment.fileno())
+
+            index = self.load_index(agent_id)
+            entry = index.setdefault(
+                period, {"min_time": None, "max_time": None, "count": 0, "chats": []}
+            )
+            times = [row["time"] for row in rows]
+            if entry["count"]:
+                times += [entry["min_time"], entry["max_time"]]
+            entry["min_time"] = min(times)
+            entry["max_time"] = max(times)
+            entry["count"] += len(rows)
+            entry["chats"] = sorted(set(entry["chats"]) | {row["chat_id"] for row in rows})
+            self._write_index(agent_id, index)
+
+    def load_index(self, agent_id: str) -> Dict[str, dict]:
+        """读取 Agent 的归档索引，没有归档时返回空字典"""
+        path = os.path.join(self._agent_dir(agent_id), "index.json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_index(self, agent_id: str, index: Dict[str, dict]):
+        path = os.path.join(self._agent_dir(agent_id), "index.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # ---- 读取 ----
+
+    def iter_archived(
+        self,
+        agent_id: str,
+        chat_id: str = None,
+        start: float = None,
+        end: float = None,
+        *,
+        newest_first: bool = False,
+    ) -> Iterator[dict]:
+        """按分段顺序读取归档消息 [start, end)，只打开时间范围与聊天匹配的分段
+
+        同一分段内的记录按时间排序并按 (id, time) 去重。
+        """
+        index = self.load_index(agent_id)
+        periods = sorted(index, reverse=newest_first)
+        for period in periods:
+            entry = index[period]
+            if start is not None and entry["max_time"] < start:
+                continue
+            if end is not None and entry["min_time"] >= end:
+                continue
+            if chat_id is not None and chat_id not in entry["chats"]:
+                continue
+            rows = {}
+            path = os.path.join(self._agent_dir(agent_id), f"{period}.jsonl.gz")
+            with gzip.open(path, "rt", encoding="utf-8") as segment:
+                for line in segment:
+                    row = json.loads(line)
+                    if chat_id is not None and row["chat_id"] != chat_id:
+                        continue
+                    if start is not None and row["time"] < start:
+                        continue
+                    if end is not None and row["time"] >= end:
+                        continue
+                    rows[(row["id"], row["time"])] = row
+            yield from sorted(rows.values(), key=lambda r: r["time"], reverse=newest_first)
+
+    def recent_messages(
+        self, chat_id: str, before: float = None, limit: int = 18, *, agent_id: str = None
+    ) -> List[Messages]:
+        """与 Messages.recent_messages 相同，数据库中不足 limit 条时从归档补齐"""
+        agent_id = agent_id or get_current_agent_id()
+        messages = Messages.recent_messages(chat_id, before, limit, agent_id=agent_id)
+        if len(messages) >= limit:
+            return messages
+
+        boundary = messages[0].time if messages else before
+        older = []
+        for row in self.iter_archived(agent_id, chat_id, end=boundary, newest_first=True):
+            older.append(Messages(**row))
+            if len(older) + len(messages) >= limit:
+                break
+        older.reverse()
+        return older + messages
+
+    def history(
+        self, chat_id: str, start: float = None, end: float = None, *, agent_id: str = None
+    ) -> List[Messages]:
+        """读取聊天在 [start, end) 内的全部消息，合并数据库与归档，按时间正序"""
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("查询历史消息时必须设置 agent_id")
+        merged = {}
+        for row in self.iter_archived(agent_id, chat_id, start, end):
+            merged[(row["id"], row["time"])] = Messages(**row)
+
+        query = Messages.partitioner.select_range(
+            start,
+            end,
+            build=lambda model: model.select_unscoped().where(
+                (model.agent_id == agent_id) & (model.chat_id == chat_id)
+            ),
+        )
+        for message in query:
+            merged[(message.id, message.time)] = message
+        return sorted(merged.values(), key=lambda message: message.time)
+
+
+class MessageArchiveWorker(PeriodicWorker):
+    """定期归档过期消息的后台任务，每批在线程池中执行并在批次之间让出事件循环"""
+
+    def __init__(self, archive: MessageArchive = None, *, interval: float = 86400.0):
+        super().__init__(interval)
+        self.archive = archive or MessageArchive()
+        self.last_archived: Dict[str, int] = {}
+
+    async def run_once(self):
+        archived = {}
+        now = time_module.time()
+        agent_ids = await run_sync(self.archive.expired_agents, now)
+        for agent_id in agent_ids:
+            cutoff = self.archive.cutoff_for(agent_id, now)
+            for model in Messages.partitioner.models_for_range(end=cutoff):
+                while True:
+                    count = await run_sync(self.archive.archive_batch, model, agent_id, cutoff)
+                    if count:
+                        archived[agent_id] = archived.get(agent_id, 0) + count
+                    if count < self.archive.batch_size:
+                        break
+                    await asyncio.sleep(0)
+        self.last_archived = archived
+
+
+__all__ = [
+    "MessageArchive",
+    "MessageArchiveWorker",
+]
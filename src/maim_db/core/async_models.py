@@ -6,14 +6,16 @@
 import asyncio
 import json
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 
+from .agent_activity import heartbeat_aggregator
 from .models.system_v2 import Agent as MaimDbAgent
 from .models.system_v2 import AgentActiveState as MaimDbAgentActiveState
 from .models.system_v2 import AgentStatus, ApiKeyStatus, TenantStatus, TenantType
 from .models.system_v2 import ApiKey as MaimDbApiKey
 from .models.system_v2 import Tenant as MaimDbTenant
+from .pagination import KeysetPage, keyset_paginate
 
 
 class AsyncTenant:
@@ -117,6 +119,24 @@ class AsyncTenant:
         tenants = await asyncio.get_event_loop().run_in_executor(None, _get_all)
         return [cls(tenant) for tenant in tenants]
 
+    @classmethod
+    async def get_page(
+        cls, cursor: str = None, limit: int = 50, *, descending: bool = False
+    ) -> KeysetPage:
+        """按 (created_at, id) 键集分页获取租户，返回 (items, next_cursor)"""
+
+        def _get_page():
+            return keyset_paginate(
+                MaimDbTenant.select(),
+                (MaimDbTenant.created_at, MaimDbTenant.id),
+                cursor,
+                limit,
+                descending=descending,
+            )
+
+        page = await asyncio.get_event_loop().run_in_executor(None, _get_page)
+        return KeysetPage([cls(tenant) for tenant in page.items], page.next_cursor)
+
     @classmethod
     async def count(cls) -> int:
         """获取租户总数"""
@@ -247,6 +267,29 @@ class AsyncAgent:
         agents = await asyncio.get_event_loop().run_in_executor(None, _get_by_tenant)
         return [cls(agent) for agent in agents]
 
+    @classmethod
+    async def get_page_by_tenant(
+        cls,
+        tenant_id: str,
+        cursor: str = None,
+        limit: int = 50,
+        *,
+        descending: bool = False,
+    ) -> KeysetPage:
+        """按 (created_at, id) 键集分页获取租户下的Agent，返回 (items, next_cursor)"""
+
+        def _get_page():
+            return keyset_paginate(
+                MaimDbAgent.select().where(MaimDbAgent.tenant_id == tenant_id),
+                (MaimDbAgent.created_at, MaimDbAgent.id),
+                cursor,
+                limit,
+                descending=descending,
+            )
+
+        page = await asyncio.get_event_loop().run_in_executor(None, _get_page)
+        return KeysetPage([cls(agent) for agent in page.items], page.next_cursor)
+
     async def update(self, **kwargs) -> "AsyncAgent":
         """更新Agent"""
         if not self._agent:
@@ -421,7 +464,20 @@ class AsyncAgentActiveState:
     async def upsert(
         cls, tenant_id: str, agent_id: str, ttl_seconds: int
     ) -> "AsyncAgentActiveState":
-        """更新心跳并刷新 TTL"""
+        """更新心跳并刷新 TTL
+
+        heartbeat_aggregator 运行时心跳只记录在内存中，由其按刷写周期批量写入，
+        返回的状态不对应数据库记录；未启动聚合器或 TTL 不大于刷写周期时直接写库。
+        """
+        if heartbeat_aggregator.running and ttl_seconds > heartbeat_aggregator.interval:
+            seen_at = heartbeat_aggregator.record(tenant_id, agent_id, ttl_seconds)
+            state = cls()
+            state.tenant_id = tenant_id
+            state.agent_id = agent_id
+            state.last_seen_at = seen_at
+            state.ttl_seconds = ttl_seconds
+            state.expires_at = seen_at + timedelta(seconds=ttl_seconds)
+            return state
 
         def _touch():
             return MaimDbAgentActiveState.touch(
@@ -431,6 +487,16 @@ class AsyncAgentActiveState:
         record = await asyncio.get_event_loop().run_in_executor(None, _touch)
         return cls(record)
 
+    @classmethod
+    async def upsert_many(cls, heartbeats) -> int:
+        """批量更新心跳，heartbeats 格式同 AgentActiveState.touch_many"""
+        heartbeats = list(heartbeats)
+
+        def _touch_many():
+            return MaimDbAgentActiveState.touch_many(heartbeats)
+
+        return await asyncio.get_event_loop().run_in_executor(None, _touch_many)
+
     @classmethod
     async def list_active(cls) -> List["AsyncAgentActiveState"]:
         """获取所有未过期的活跃记录"""
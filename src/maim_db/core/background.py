@@ -0,0 +1,73 @@
+"""
+后台周期任务
+为心跳聚合、计数器刷写等需要定期落库的组件提供统一的 asyncio 运行框架
+"""
+
+import asyncio
+import functools
+from typing import Any, Callable, Optional
+
+
+class PeriodicWorker:
+    """周期性后台任务基类
+
+    子类实现 run_once()，start() 后在当前事件循环中按 interval 秒执行一次。
+    单次执行失败不会终止循环，异常记录在 last_error 中。
+    """
+
+    def __init__(self, interval: float):
+        if interval <= 0:
+            raise ValueError("interval 必须为正数")
+        self.interval = interval
+        self.last_error: Optional[BaseException] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        """后台任务是否在运行"""
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """在当前事件循环中启动后台任务，需在协程内调用"""
+        if self.running:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并执行一次收尾"""
+        if self.running:
+            self._stopping.set()
+            await self._task
+        self._task = None
+        await self.on_stop()
+
+    async def run_once(self):
+        """执行一次周期任务，由子类实现"""
+        raise NotImplementedError
+
+    async def on_stop(self):
+        """停止时的收尾动作，默认不做任何事"""
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping.is_set():
+                break
+            try:
+                await self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                print(f"⚠️ {self.__class__.__name__} 执行失败: {e}")
+
+
+async def run_sync(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在默认线程池中执行同步的数据库操作"""
+    return await asyncio.get_event_loop().run_in_executor(
+        None, functools.partial(func, *args, **kwargs)
+    )
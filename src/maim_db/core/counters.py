@@ -0,0 +1,174 @@
+"""
+计数器缓冲
+使用次数等热点计数不再对同一行做读-改-写 save()：增量先在内存中累加，
+由 CounterFlushWorker 定期在一个事务内以 UPDATE ... SET x = x + ? 批量写入，
+并发写入不会丢失增量，也不会因行锁互相串行。
+
+任意模型的数值字段注册后即可作为计数器；同一批中增量相同的行合并为一条
+WHERE id IN (...) 语句。可同时记录"最近时间"类字段，写入时取该批次中的最大值。
+"""
+
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from peewee import Case, Field, FloatField, IntegerField, fn
+
+from .background import PeriodicWorker, run_sync
+from .emoji_index import emoji_tag_index
+from .models.maimbot_models import Emoji, Expression, Images, Jargon
+
+_IN_BATCH = 500
+
+
+class CounterBuffer:
+    """按 (模型, 主键) 累加计数增量的内存缓冲"""
+
+    def __init__(self):
+        self._counters = set()
+        # {(model, pk): {field_name: delta}}
+        self._deltas: Dict[Tuple[type, object], Dict[str, float]] = defaultdict(dict)
+        # {(model, pk): {field_name: value}}，写入时取 MAX(原值, value)
+        self._touches: Dict[Tuple[type, object], Dict[str, float]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    # ---- 注册 ----
+
+    def register(self, *fields: Field):
+        """把模型的数值字段注册为计数器"""
+        for field in fields:
+            if not isinstance(field, (IntegerField, FloatField)):
+                raise ValueError(f"计数器必须是数值字段: {field}")
+            self._counters.add(field)
+
+    def is_counter(self, field: Field) -> bool:
+        return field in self._counters
+
+    # ---- 累加 ----
+
+    def increment(self, field: Field, pk, delta: float = 1, *, touch: Dict[Field, float] = None):
+        """为 pk 对应行的计数器累加 delta
+
+        Args:
+            field: 已注册的计数器字段
+            pk: 行主键
+            delta: 增量
+            touch: 同时更新的时间类字段及取值，写入时保留较大者
+        """
+        if field not in self._counters:
+            raise ValueError(f"字段未注册为计数器: {field}")
+        key = (field.model, pk)
+        with self._lock:
+            deltas = self._deltas[key]
+            deltas[field.name] = deltas.get(field.name, 0) + delta
+            if touch:
+                touches = self._touches[key]
+                for touch_field, value in touch.items():
+                    current = touches.get(touch_field.name)
+                    touches[touch_field.name] = value if current is None else max(current, value)
+
+    def pending(self, field: Field, pk) -> float:
+        """尚未写入数据库的增量，用于读取时叠加到库中的值"""
+        with self._lock:
+            deltas = self._deltas.get((field.model, pk))
+            return deltas.get(field.name, 0) if deltas else 0
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    # ---- 写入 ----
+
+    def flush(self) -> int:
+        """在一个事务内写入全部增量，返回更新的行数；失败时增量保留到下次"""
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(dict)
+            touches, self._touches = self._touches, defaultdict(dict)
+        if not deltas:
+            return 0
+        # 增量与时间字段集合都相同的行合并为一条语句
+        groups: Dict[tuple, List] = defaultdict(list)
+        for (model, pk), row_deltas in deltas.items():
+            row_touches = touches.get((model, pk), {})
+            signature = (model, tuple(sorted(row_deltas.items())), tuple(sorted(row_touches)))
+            groups[signature].append((pk, row_touches))
+        try:
+            updated = 0
+            database = next(iter(groups))[0]._meta.database
+            with database.atomic():
+                for (model, row_deltas, touch_names), rows in groups.items():
+                    for offset in range(0, len(rows), _IN_BATCH):
+                        updated += self._update(model, row_deltas, touch_names, rows[offset:offset + _IN_BATCH])
+        except Exception:
+            self._restore(deltas, touches)
+            raise
+        return updated
+
+    @staticmethod
+    def _update(model, row_deltas, touch_names, rows) -> int:
+        pk_field = model._meta.primary_key
+        values = {}
+        for name, delta in row_deltas:
+            field = getattr(model, name)
+            # 可为空的计数器从 0 起算，NULL + delta 仍为 NULL
+            values[field] = (fn.COALESCE(field, 0) if field.null else field) + delta
+        for name in touch_names:
+            field = getattr(model, name)
+            latest = Case(pk_field, [(pk, row_touches[name]) for pk, row_touches in rows])
+            # 原值为空时直接取新值，否则保留较大者
+            values[field] = Case(
+                None,
+                [(field.is_null() | (field < latest), latest)],
+                field,
+            )
+        return model.update(values).where(pk_field.in_([pk for pk, _ in rows])).execute()
+
+    def _restore(self, deltas, touches):
+        with self._lock:
+            for key, row_deltas in deltas.items():
+                current = self._deltas[key]
+                for name, delta in row_deltas.items():
+                    current[name] = current.get(name, 0) + delta
+            for key, row_touches in touches.items():
+                current = self._touches[key]
+                for name, value in row_touches.items():
+                    current[name] = value if name not in current else max(current[name], value)
+
+
+class CounterFlushWorker(PeriodicWorker):
+    """定期写入计数器增量的后台任务，停止时再写一次"""
+
+    def __init__(self, buffer: "CounterBuffer" = None, *, interval: float = 5.0):
+        super().__init__(interval)
+        self.buffer = counter_buffer if buffer is None else buffer
+        self.last_flushed = 0
+
+    async def run_once(self):
+        self.last_flushed = await run_sync(self.buffer.flush)
+
+    async def on_stop(self):
+        self.last_flushed = await run_sync(self.buffer.flush)
+
+
+# 全局计数器缓冲，预先注册 MaiMBot 的热点计数
+counter_buffer = CounterBuffer()
+counter_buffer.register(
+    Emoji.usage_count,
+    Emoji.query_count,
+    Images.count,
+    Expression.count,
+    Jargon.count,
+)
+
+
+def record_emoji_usage(emoji: Emoji, used_at: float):
+    """记录一次表情包使用：累加 usage_count、更新 last_used_time 并同步标签索引"""
+    counter_buffer.increment(Emoji.usage_count, emoji.id, touch={Emoji.last_used_time: used_at})
+    emoji_tag_index.note_usage(emoji.id, agent_id=emoji.agent_id, used_at=used_at)
+
+
+__all__ = [
+    "CounterBuffer",
+    "CounterFlushWorker",
+    "counter_buffer",
+    "record_emoji_usage",
+]
@@ -6,7 +6,7 @@
 import os
 from playhouse.pool import PooledPostgresqlDatabase
 from playhouse.pool import PooledMySQLDatabase
-from peewee import SqliteDatabase
+from peewee import EXCLUDED, MySQLDatabase, SqliteDatabase, fn
 
 from .config import DatabaseConfig
 
@@ -176,6 +176,7 @@ class DatabaseManager:
     def create_tables(self, models):
         """创建表"""
         db = self.get_database()
+        # 启用时间分区的模型由 PartitionRoutingMixin.create_table 建立分区结构
         db.create_tables(models, safe=True)
 
     def drop_tables(self, models):
@@ -204,3 +205,25 @@ def init_database():
 def close_database():
     """关闭数据库连接"""
     db_manager.close()
+
+
+def conflict_target(db, *fields):
+    """返回 upsert 的冲突目标列
+
+    SQLite/PostgreSQL 的 ON CONFLICT 需要显式指定冲突列，
+    MySQL 的 ON DUPLICATE KEY UPDATE 则不允许指定，返回 None 由唯一索引决定。
+    """
+    if isinstance(db, MySQLDatabase):
+        return None
+    return fields
+
+
+def excluded(db, field):
+    """返回 upsert 更新子句中引用"本次待插入值"的表达式
+
+    SQLite/PostgreSQL 使用 EXCLUDED.列名，MySQL 使用 VALUES(列名)，
+    用于 {field: field + excluded(db, field)} 这类累加式 upsert。
+    """
+    if isinstance(db, MySQLDatabase):
+        return fn.VALUES(field)
+    return getattr(EXCLUDED, field.column_name)
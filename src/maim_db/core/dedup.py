@@ -0,0 +1,64 @@
+"""
+消息去重写入
+适配器重试与重复投递会产生相同 message_id 的消息。写入以 (agent_id, message_id)
+唯一索引为准做 insert-or-ignore（create_if_absent），新消息只需一条 INSERT，
+不做写入前查询；只有插入被忽略时才查询已有记录返回给调用方。
+"""
+
+import threading
+from typing import Optional, Tuple
+
+from .context_manager import get_current_agent_id
+from .models.maimbot_models import Messages
+
+
+class MessageIngestor:
+    """幂等的消息写入，统计写入与重复投递次数"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def ingest(self, **data) -> Tuple[Messages, bool]:
+        """写入消息，重复时返回已存在的记录
+
+        Returns:
+            (message, created)：created 为 False 时 message 为库中已有的记录
+        """
+        agent_id = data.get("agent_id") or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("业务模型必须设置 agent_id")
+        data["agent_id"] = agent_id
+
+        message = Messages.create_if_absent(**data)
+        if message is not None:
+            with self._lock:
+                self.inserted += 1
+            return message, True
+        with self._lock:
+            self.duplicates += 1
+        return self.find(agent_id, data["message_id"]), False
+
+    @staticmethod
+    def find(agent_id: str, message_id: str) -> Optional[Messages]:
+        """按 (agent_id, message_id) 查找消息，启用分区时从新到旧逐个分区查找"""
+        for model in Messages.partitioner.models_for_range():
+            message = (
+                model.select_unscoped()
+                .where((model.agent_id == agent_id) & (model.message_id == message_id))
+                .first()
+            )
+            if message is not None:
+                return message
+        return None
+
+
+# 全局消息写入器
+message_ingestor = MessageIngestor()
+
+
+__all__ = [
+    "MessageIngestor",
+    "message_ingestor",
+]
@@ -0,0 +1,269 @@
+"""
+图片与表情包描述缓存
+image_descriptions、emoji_description_cache 用于避免重复调用 VLM，但每次查找仍要按哈希查库，
+未命中也不会被记住。本模块在其上提供按 (agent_id, 哈希, 类型) 的读穿透缓存：
+
+- 命中时直接从内存返回，不访问数据库
+- 未命中同样缓存（负缓存），在 negative_ttl 秒内不重复查询
+- put() 写入数据库并同步更新缓存；经 save()/delete_instance() 的写入通过写入回调维护
+- 开启跨 Agent 共享时，本 Agent 没有描述则复用其他 Agent 对同一哈希的描述
+
+任一 Agent 写入某个哈希后，所有 Agent 对该哈希的缓存条目（包括负缓存与共享来的描述）都会在
+下次读取时重新加载。insert_many、update() 等批量语句不经过写入回调，之后需调用 clear()。
+"""
+
+import itertools
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from peewee import Case, Field, IntegrityError
+
+from .context_manager import get_current_agent_id
+from .lru import LRUCache
+from .models.maimbot_models import EmojiDescriptionCache, ImageDescriptions
+from .settings import settings
+
+
+class CachedDescription(NamedTuple):
+    """缓存的描述，agent_id 为描述所属的 Agent（共享命中时不同于查询方）"""
+
+    description: str
+    emotion_tags: Optional[str]
+    agent_id: str
+    timestamp: float
+
+
+class _Entry:
+    __slots__ = ("value", "seq", "expires_at")
+
+    def __init__(self, value: Optional[CachedDescription], seq: int, expires_at: float = None):
+        self.value = value
+        self.seq = seq
+        # 仅负缓存条目有过期时间
+        self.expires_at = expires_at
+
+
+class DescriptionCache:
+    """描述表的读穿透缓存
+
+    Args:
+        model: 描述表模型
+        hash_field: 哈希字段
+        type_field: 类型字段，没有类型区分的表为 None
+        tags_field: 情感标签字段，没有时为 None
+        max_entries: 缓存条目上限（含负缓存），默认 settings.description_cache_max_entries
+        negative_ttl: 未命中结果的缓存秒数，默认 settings.description_cache_negative_ttl
+        shared: 是否回退到其他 Agent 的描述，默认 settings.description_cache_shared
+    """
+
+    def __init__(
+        self,
+        model,
+        hash_field: Field,
+        *,
+        type_field: Field = None,
+        tags_field: Field = None,
+        max_entries: int = None,
+        negative_ttl: float = None,
+        shared: bool = None,
+    ):
+        self.model = model
+        self.hash_field = hash_field
+        self.type_field = type_field
+        self.tags_field = tags_field
+        if max_entries is None:
+            max_entries = settings.description_cache_max_entries
+        self.negative_ttl = settings.description_cache_negative_ttl if negative_ttl is None else negative_ttl
+        self.shared = settings.description_cache_shared if shared is None else shared
+        self._entries = LRUCache(max_entries)
+        # (哈希, 类型) → 最近一次写入的序号，早于该序号加载的条目视为过期
+        self._written = LRUCache(max_entries)
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._enabled = False
+
+    def enable(self):
+        """开始随模型写入维护缓存，可重复调用"""
+        if self._enabled:
+            return
+        self.model.add_listener("post_save", self._on_post_save)
+        self.model.add_listener("pre_delete", self._on_pre_delete)
+        self._enabled = True
+
+    def disable(self):
+        self.model.remove_listener("post_save", self._on_post_save)
+        self.model.remove_listener("pre_delete", self._on_pre_delete)
+        self._enabled = False
+        self.clear()
+
+    def clear(self):
+        self._entries.clear()
+        self._written.clear()
+
+    # ---- 读取 ----
+
+    def get(
+        self,
+        hash_value: str,
+        type: str = None,
+        *,
+        agent_id: str = None,
+        shared: bool = None,
+    ) -> Optional[CachedDescription]:
+        """返回哈希对应的描述，没有时返回 None
+
+        Args:
+            hash_value: 图片哈希
+            type: 描述类型，表没有类型字段时忽略
+            agent_id: 未指定时使用当前上下文中的 agent_id
+            shared: 覆盖实例的跨 Agent 共享设置
+        """
+        agent_id = self._require_agent(agent_id)
+        shared = self.shared if shared is None else shared
+        type = type if self.type_field is not None else None
+        key = (agent_id, hash_value, type, shared)
+        entry = self._entries.get(key)
+        if entry is not None and self._valid(entry, hash_value, type):
+            return entry.value
+        with self._lock:
+            seq = next(self._seq)
+        value = self._load(hash_value, type, agent_id, shared)
+        expires_at = None if value is not None else time.monotonic() + self.negative_ttl
+        self._entries.put(key, _Entry(value, seq, expires_at))
+        return value
+
+    def _valid(self, entry: _Entry, hash_value: str, type) -> bool:
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            return False
+        return entry.seq > self._written.get((hash_value, type), 0)
+
+    def _load(self, hash_value: str, type, agent_id: str, shared: bool) -> Optional[CachedDescription]:
+        model = self.model
+        condition = self.hash_field == hash_value
+        if self.type_field is not None:
+            condition &= self.type_field == type
+        if shared:
+            # 优先本 Agent 的描述，其次其他 Agent 最新的描述
+            order = (Case(None, [(model.agent_id == agent_id, 0)], 1), model.timestamp.desc())
+        else:
+            condition &= model.agent_id == agent_id
+            order = (model.timestamp.desc(),)
+        row = model.select_unscoped().where(condition).order_by(*order).first()
+        return self._to_value(row) if row is not None else None
+
+    def _to_value(self, row) -> CachedDescription:
+        tags = getattr(row, self.tags_field.name) if self.tags_field is not None else None
+        return CachedDescription(row.description, tags, row.agent_id, row.timestamp)
+
+    # ---- 写入 ----
+
+    def put(
+        self,
+        hash_value: str,
+        description: str,
+        type: str = None,
+        *,
+        emotion_tags: str = None,
+        agent_id: str = None,
+        timestamp: float = None,
+    ) -> Optional[CachedDescription]:
+        """写入 Agent 对该哈希的描述（已存在时覆盖）并更新缓存
+
+        哈希全局唯一的表（emoji_description_cache）中该哈希已属于其他 Agent 时不写入：
+        开启跨 Agent 共享时返回已有的描述，否则返回 None，不会把其他 Agent 的描述交给调用方。
+        """
+        agent_id = self._require_agent(agent_id)
+        if self.type_field is not None and type is None:
+            raise ValueError(f"{self.model.__name__} 的描述必须指定类型")
+        type = type if self.type_field is not None else None
+        model = self.model
+        values = {
+            self.hash_field.name: hash_value,
+            "description": description,
+            "timestamp": time.time() if timestamp is None else timestamp,
+        }
+        if self.type_field is not None:
+            values[self.type_field.name] = type
+        if self.tags_field is not None:
+            values[self.tags_field.name] = emotion_tags
+        condition = (model.agent_id == agent_id) & (self.hash_field == hash_value)
+        if self.type_field is not None:
+            condition &= self.type_field == type
+        try:
+            with model._meta.database.atomic():
+                row = model.select_unscoped().where(condition).first()
+                if row is None:
+                    row = model(agent_id=agent_id, **values)
+                else:
+                    for name, value in values.items():
+                        setattr(row, name, value)
+                row.save()
+        except IntegrityError:
+            # 哈希全局唯一的表中该哈希已属于其他 Agent，无法另存一份；仅共享时返回已有的描述
+            self.invalidate(hash_value, type)
+            if not self.shared:
+                return None
+            return self.get(hash_value, type, agent_id=agent_id, shared=True)
+        self._store(row)
+        return self._to_value(row)
+
+    def invalidate(self, hash_value: str, type: str = None):
+        """使所有 Agent 对该哈希的缓存条目失效"""
+        with self._lock:
+            self._written.put((hash_value, type if self.type_field is not None else None), next(self._seq))
+
+    def _store(self, row):
+        hash_value = getattr(row, self.hash_field.name)
+        type = getattr(row, self.type_field.name) if self.type_field is not None else None
+        value = self._to_value(row)
+        with self._lock:
+            self._written.put((hash_value, type), next(self._seq))
+            seq = next(self._seq)
+        # 写入方自己的条目直接更新，其他 Agent 的条目在下次读取时重新加载
+        for shared in (False, True):
+            self._entries.put((row.agent_id, hash_value, type, shared), _Entry(value, seq))
+
+    @staticmethod
+    def _require_agent(agent_id):
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("读取描述缓存时必须设置 agent_id")
+        return agent_id
+
+    def _on_post_save(self, row, created):
+        self._store(row)
+
+    def _on_pre_delete(self, row):
+        self.invalidate(
+            getattr(row, self.hash_field.name),
+            getattr(row, self.type_field.name) if self.type_field is not None else None,
+        )
+
+
+# 全局描述缓存
+image_description_cache = DescriptionCache(
+    ImageDescriptions,
+    ImageDescriptions.image_description_hash,
+    type_field=ImageDescriptions.type,
+)
+emoji_description_cache = DescriptionCache(
+    EmojiDescriptionCache,
+    EmojiDescriptionCache.emoji_hash,
+    tags_field=EmojiDescriptionCache.emotion_tags,
+)
+
+
+def enable_description_caches():
+    """启用图片与表情包描述缓存的写入维护"""
+    image_description_cache.enable()
+    emoji_description_cache.enable()
+
+
+__all__ = [
+    "CachedDescription",
+    "DescriptionCache",
+    "image_description_cache",
+    "emoji_description_cache",
+    "enable_description_caches",
+]
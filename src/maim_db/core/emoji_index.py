@@ -0,0 +1,324 @@
+"""
+表情包情感标签倒排索引
+回复时按情感标签选表情包不再扫描 emoji 表：每个 Agent 在内存中维护
+标签 → 可用表情包ID 的倒排表，以及按槽位存放的 usage_count / last_used_time 数组，
+在命中标签的 k 个候选上做加权随机抽样。
+
+- 只索引已注册（is_registered）且未被封禁（is_banned）的表情包
+- 首次选择某个 Agent 的表情包时加载，之后随 save()/delete_instance() 增量维护
+- 其他进程（如管理后台）的封禁、删除不会触发本进程的写入回调，索引每隔 ttl 秒重新加载；
+  select() 取回记录时再次过滤，已失效的表情包不会被返回
+- 使用次数通过计数器等不经过 save() 的方式更新时，调用 note_usage() 同步
+
+emotion 字段按逗号、顿号或空白分隔为多个标签。
+"""
+
+import heapq
+import random
+import re
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from .context_manager import get_current_agent_id
+from .lru import LRUCache
+from .models.maimbot_models import Emoji
+from .settings import settings
+
+_TAG_SEPARATORS = re.compile(r"[,，、;；\s]+")
+
+
+def parse_emotion_tags(emotion: Optional[str]) -> Tuple[str, ...]:
+    """把 emotion 字段拆分为去重后的标签"""
+    if not emotion:
+        return ()
+    return tuple(dict.fromkeys(tag for tag in _TAG_SEPARATORS.split(emotion.strip()) if tag))
+
+
+def usage_weight(usage_count: float, last_used_time: float, now: float) -> float:
+    """默认抽样权重：使用次数越少越容易被选中，刚用过的表情包降权"""
+    weight = 1.0 / (1.0 + usage_count)
+    if last_used_time and now - last_used_time < 60:
+        weight *= 0.1
+    return weight
+
+
+class _AgentEmojis:
+    """一个 Agent 的可用表情包，数组按槽位存放，删除时用末尾元素填补空位"""
+
+    __slots__ = ("ids", "usage", "last_used", "slots", "tags", "emoji_tags", "expires_at")
+
+    def __init__(self, expires_at: float = 0.0):
+        self.expires_at = expires_at
+        self.ids: List[int] = []
+        self.usage = array("d")
+        self.last_used = array("d")
+        self.slots: Dict[int, int] = {}
+        self.tags: Dict[str, Set[int]] = {}
+        self.emoji_tags: Dict[int, Tuple[str, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def upsert(self, emoji_id: int, tags: Tuple[str, ...], usage_count, last_used_time):
+        slot = self.slots.get(emoji_id)
+        if slot is None:
+            self.slots[emoji_id] = len(self.ids)
+            self.ids.append(emoji_id)
+            self.usage.append(float(usage_count or 0))
+            self.last_used.append(float(last_used_time or 0))
+        else:
+            self.usage[slot] = float(usage_count or 0)
+            self.last_used[slot] = float(last_used_time or 0)
+        previous = self.emoji_tags.get(emoji_id, ())
+        if previous != tags:
+            self._untag(emoji_id, previous)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(emoji_id)
+            self.emoji_tags[emoji_id] = tags
+
+    def remove(self, emoji_id: int):
+        slot = self.slots.pop(emoji_id, None)
+        if slot is None:
+            return
+        last = len(self.ids) - 1
+        if slot != last:
+            moved = self.ids[last]
+            self.ids[slot] = moved
+            self.usage[slot] = self.usage[last]
+            self.last_used[slot] = self.last_used[last]
+            self.slots[moved] = slot
+        self.ids.pop()
+        self.usage.pop()
+        self.last_used.pop()
+        self._untag(emoji_id, self.emoji_tags.pop(emoji_id, ()))
+
+    def touch(self, emoji_id: int, usage_delta: int, last_used_time: float):
+        slot = self.slots.get(emoji_id)
+        if slot is None:
+            return
+        self.usage[slot] += usage_delta
+        if last_used_time is not None:
+            self.last_used[slot] = max(self.last_used[slot], last_used_time)
+
+    def _untag(self, emoji_id: int, tags: Iterable[str]):
+        for tag in tags:
+            members = self.tags.get(tag)
+            if members is None:
+                continue
+            members.discard(emoji_id)
+            if not members:
+                del self.tags[tag]
+
+
+class EmojiTagIndex:
+    """按情感标签选取表情包
+
+    Args:
+        max_agents: 同时保留索引的 Agent 数，按最近使用淘汰
+        weight: 抽样权重函数 (usage_count, last_used_time, now) -> float，默认 usage_weight
+        ttl: 索引重新加载的间隔秒数，默认 settings.emoji_index_ttl
+    """
+
+    def __init__(
+        self,
+        *,
+        max_agents: int = 256,
+        weight: Callable[[float, float, float], float] = usage_weight,
+        ttl: float = None,
+    ):
+        self.weight = weight
+        self.ttl = settings.emoji_index_ttl if ttl is None else ttl
+        self._agents = LRUCache(max_agents)
+        # 正在加载的 Agent，值表示加载期间是否有写入
+        self._loading: Dict[str, bool] = {}
+        self._lock = threading.RLock()
+        self._enabled = False
+
+    def enable(self):
+        """开始随 Emoji 写入维护索引，可重复调用；查询时会自动启用"""
+        if self._enabled:
+            return
+        Emoji.add_listener("post_save", self._on_post_save)
+        Emoji.add_listener("pre_delete", self._on_pre_delete)
+        self._enabled = True
+
+    def disable(self):
+        Emoji.remove_listener("post_save", self._on_post_save)
+        Emoji.remove_listener("pre_delete", self._on_pre_delete)
+        self._enabled = False
+        self.clear()
+
+    def forget_agent(self, agent_id: str):
+        with self._lock:
+            self._agents.pop(agent_id)
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+
+    # ---- 查询 ----
+
+    def tags(self, *, agent_id: str = None) -> Dict[str, int]:
+        """Agent 可用的情感标签及每个标签下的表情包数"""
+        emojis = self._index(self._require_agent(agent_id))
+        with self._lock:
+            return {tag: len(members) for tag, members in emojis.tags.items()}
+
+    def select_ids(
+        self,
+        emotions: Union[str, Iterable[str]],
+        k: int = 1,
+        *,
+        agent_id: str = None,
+        now: float = None,
+    ) -> List[int]:
+        """在带有任一给定标签的可用表情包中按权重无放回抽取 k 个ID
+
+        耗时与候选数成正比，不访问数据库（首次加载除外）。没有候选时返回空列表。
+        """
+        if k <= 0:
+            return []
+        if isinstance(emotions, str):
+            emotions = parse_emotion_tags(emotions)
+        emojis = self._index(self._require_agent(agent_id))
+        now = time.time() if now is None else now
+        with self._lock:
+            candidates: Set[int] = set()
+            for tag in emotions:
+                candidates |= emojis.tags.get(tag, set())
+            weighted = []
+            for emoji_id in candidates:
+                slot = emojis.slots[emoji_id]
+                weight = self.weight(emojis.usage[slot], emojis.last_used[slot], now)
+                if weight > 0:
+                    weighted.append((emoji_id, weight))
+        if not weighted:
+            return []
+        if k == 1:
+            ids, weights = zip(*weighted)
+            return random.choices(ids, weights)
+        # Efraimidis–Spirakis 加权无放回抽样：key = u^(1/w)，取最大的 k 个
+        return [
+            emoji_id
+            for _, emoji_id in heapq.nlargest(
+                k, ((random.random() ** (1.0 / weight), emoji_id) for emoji_id, weight in weighted)
+            )
+        ]
+
+    def select(
+        self,
+        emotions: Union[str, Iterable[str]],
+        k: int = 1,
+        *,
+        agent_id: str = None,
+        now: float = None,
+    ) -> List[Emoji]:
+        """同 select_ids，按主键取回表情包记录
+
+        取回时再次过滤已取消注册或被封禁的表情包，并把它们移出索引。
+        """
+        agent_id = self._require_agent(agent_id)
+        ids = self.select_ids(emotions, k, agent_id=agent_id, now=now)
+        if not ids:
+            return []
+        rows = {
+            emoji.id: emoji
+            for emoji in Emoji.select_unscoped().where(
+                (Emoji.agent_id == agent_id)
+                & Emoji.id.in_(ids)
+                & (Emoji.is_registered == True)  # noqa: E712
+                & (Emoji.is_banned == False)  # noqa: E712
+            )
+        }
+        stale = [emoji_id for emoji_id in ids if emoji_id not in rows]
+        if stale:
+            with self._lock:
+                emojis = self._agents.get(agent_id)
+                if emojis is not None:
+                    for emoji_id in stale:
+                        emojis.remove(emoji_id)
+        return [rows[emoji_id] for emoji_id in ids if emoji_id in rows]
+
+    def note_usage(self, emoji_id: int, *, agent_id: str = None, delta: int = 1, used_at: float = None):
+        """同步一次未经过 save() 的使用记录"""
+        agent_id = self._require_agent(agent_id)
+        with self._lock:
+            emojis = self._agents.get(agent_id)
+            if emojis is not None:
+                emojis.touch(emoji_id, delta, time.time() if used_at is None else used_at)
+
+    # ---- 加载与维护 ----
+
+    @staticmethod
+    def _require_agent(agent_id):
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("选择表情包时必须设置 agent_id")
+        return agent_id
+
+    def _index(self, agent_id: str) -> _AgentEmojis:
+        self.enable()
+        now = time.monotonic()
+        with self._lock:
+            emojis = self._agents.get(agent_id)
+            if emojis is not None and emojis.expires_at > now:
+                return emojis
+            self._loading[agent_id] = False
+        emojis = _AgentEmojis(now + self.ttl)
+        try:
+            rows = (
+                Emoji.select_unscoped(Emoji.id, Emoji.emotion, Emoji.usage_count, Emoji.last_used_time)
+                .where(
+                    (Emoji.agent_id == agent_id)
+                    & (Emoji.is_registered == True)  # noqa: E712
+                    & (Emoji.is_banned == False)  # noqa: E712
+                )
+                .tuples()
+            )
+            for emoji_id, emotion, usage_count, last_used_time in rows.iterator():
+                emojis.upsert(emoji_id, parse_emotion_tags(emotion), usage_count, last_used_time)
+        except BaseException:
+            with self._lock:
+                self._loading.pop(agent_id, None)
+            raise
+        with self._lock:
+            # 加载期间有写入时结果可能已过期，本次不缓存
+            if not self._loading.pop(agent_id, True):
+                self._agents.put(agent_id, emojis)
+        return emojis
+
+    def _on_post_save(self, emoji, created):
+        with self._lock:
+            if emoji.agent_id in self._loading:
+                self._loading[emoji.agent_id] = True
+            emojis = self._agents.get(emoji.agent_id)
+            if emojis is None:
+                return
+            if emoji.is_registered and not emoji.is_banned:
+                emojis.upsert(
+                    emoji.id, parse_emotion_tags(emoji.emotion), emoji.usage_count, emoji.last_used_time
+                )
+            else:
+                emojis.remove(emoji.id)
+
+    def _on_pre_delete(self, emoji):
+        with self._lock:
+            if emoji.agent_id in self._loading:
+                self._loading[emoji.agent_id] = True
+            emojis = self._agents.get(emoji.agent_id)
+            if emojis is not None:
+                emojis.remove(emoji.id)
+
+
+# 全局表情包标签索引
+emoji_tag_index = EmojiTagIndex()
+
+
+__all__ = [
+    "EmojiTagIndex",
+    "emoji_tag_index",
+    "parse_emotion_tags",
+    "usage_weight",
+]
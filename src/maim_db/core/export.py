@@ -0,0 +1,194 @@
+"""
+流式数据导出
+逐行读取查询结果并增量写出 JSONL / CSV，内存占用与导出规模无关：
+普通数据库使用 .iterator() 不缓存结果集，PostgreSQL 使用命名（服务端）游标分批拉取。
+异步接口在独立线程中读取，经有界队列交给事件循环，消费慢时读取端自动等待。
+"""
+
+import asyncio
+import csv
+import io
+import json
+import threading
+import uuid
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from peewee import PostgresqlDatabase
+
+from .database import get_database
+from .models.maimbot_models import Messages
+
+ROW_TYPES = ("dict", "tuple")
+EXPORT_FORMATS = ("jsonl", "csv")
+
+
+def agent_export_query(model, agent_id: str):
+    """构造导出某个 Agent 全部数据的查询
+
+    消息表启用按月分区时合并所有分区。
+    """
+    if model is Messages:
+        return Messages.partitioner.select_range(
+            build=lambda m: m.select_unscoped()
+            .where(m.agent_id == agent_id)
+            .order_by(m.id)
+        )
+    return (
+        model.select_unscoped()
+        .where(model.agent_id == agent_id)
+        .order_by(model._meta.primary_key)
+    )
+
+
+def iter_rows(query, *, row_type: str = "dict", chunk_size: int = 1000) -> Iterator:
+    """逐行迭代查询结果，不在内存中保留结果集
+
+    Args:
+        query: peewee 查询
+        row_type: "dict" 或 "tuple"
+        chunk_size: PostgreSQL 服务端游标每次拉取的行数
+    """
+    if row_type not in ROW_TYPES:
+        raise ValueError(f"不支持的行类型: {row_type}")
+    database = query.model._meta.database
+    if isinstance(database, PostgresqlDatabase):
+        yield from _iter_server_side(database, query, row_type, chunk_size)
+        return
+    rows = query.dicts() if row_type == "dict" else query.tuples()
+    yield from rows.iterator()
+
+
+def _iter_server_side(database, query, row_type: str, chunk_size: int) -> Iterator:
+    sql, params = query.sql()
+    # 命名游标只能在事务中使用
+    with database.atomic():
+        cursor = database.connection().cursor(name=f"maim_export_{uuid.uuid4().hex}")
+        try:
+            cursor.itersize = chunk_size
+            cursor.execute(sql, params)
+            columns = None
+            for row in cursor:
+                if row_type == "tuple":
+                    yield row
+                    continue
+                if columns is None:
+                    columns = [column[0] for column in cursor.description]
+                yield dict(zip(columns, row))
+        finally:
+            cursor.close()
+
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def iter_jsonl(rows) -> Iterator[str]:
+    """把字典行编码为 JSONL 文本行"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, default=_json_default) + "\n"
+
+
+def iter_csv(rows) -> Iterator[str]:
+    """把字典行编码为 CSV 文本行，表头随第一行一起输出"""
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def iter_export(query, fmt: str = "jsonl", *, chunk_size: int = 1000) -> Iterator[str]:
+    """逐行生成导出文本"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    rows = iter_rows(query, row_type="dict", chunk_size=chunk_size)
+    return iter_jsonl(rows) if fmt == "jsonl" else iter_csv(rows)
+
+
+def write_export(query, fp, fmt: str = "jsonl", *, chunk_size: int = 1000) -> int:
+    """把查询结果增量写入文本文件对象，返回导出行数"""
+    count = 0
+    for line in iter_export(query, fmt, chunk_size=chunk_size):
+        fp.write(line)
+        count += 1
+    return count
+
+
+async def _aiter_in_thread(factory: Callable[[], Iterator], max_pending: int) -> AsyncIterator:
+    """在独立线程中运行同步迭代器，经有界队列转为异步迭代器
+
+    读取线程持有自己的数据库连接，结束时关闭；消费端提前退出时读取线程随之停止。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+    stopping = threading.Event()
+    done = object()
+
+    def produce():
+        database = get_database()
+        try:
+            for item in factory():
+                if stopping.is_set():
+                    return
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+        except BaseException as e:  # 交给消费端抛出
+            if not stopping.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(e), loop).result()
+        finally:
+            if not database.is_closed():
+                database.close()
+
+    thread = threading.Thread(target=produce, name="maim-db-export", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopping.set()
+        # 腾出队列空间，让阻塞在 put 上的读取线程看到停止信号
+        while not queue.empty():
+            queue.get_nowait()
+
+
+def aiter_rows(
+    query, *, row_type: str = "dict", chunk_size: int = 1000, max_pending: int = 1000
+) -> AsyncIterator:
+    """iter_rows 的异步版本，最多缓冲 max_pending 行"""
+    return _aiter_in_thread(
+        lambda: iter_rows(query, row_type=row_type, chunk_size=chunk_size), max_pending
+    )
+
+
+def aiter_export(
+    query, fmt: str = "jsonl", *, chunk_size: int = 1000, max_pending: int = 1000
+) -> AsyncIterator[str]:
+    """iter_export 的异步版本，可直接作为流式 HTTP 响应体"""
+    return _aiter_in_thread(lambda: iter_export(query, fmt, chunk_size=chunk_size), max_pending)
+
+
+__all__ = [
+    "agent_export_query",
+    "iter_rows",
+    "iter_jsonl",
+    "iter_csv",
+    "iter_export",
+    "write_export",
+    "aiter_rows",
+    "aiter_export",
+]
@@ -0,0 +1,316 @@
+"""
+全文检索
+为消息正文、聊天概括等文本列维护全文索引，替代 LIKE '%...%' 全表扫描：
+SQLite 使用 FTS5 外部内容表，PostgreSQL 使用带 GIN 索引的 tsvector 表，
+其他数据库退化为 LIKE 查询。
+
+中文没有空格分词，写入索引前先把连续的中日韩字符切分为相邻二元组，并在末尾补上
+最后一个字（"今天天气" -> "今天 天天 天气 气"），查询词按同样规则切分后做短语匹配，
+单个汉字按前缀匹配，因此两个数据库都只需要按空白切词的通用分词器。
+切分规则变化后需调用 rebuild() 重建已有索引。
+
+使用限制：
+- SQLite 的外部内容视图 {table}_fts_content 调用 Python 函数 maim_fts_segment，
+  该函数只注册在调用过 enable() 的数据库对象的连接上。sqlite3 命令行、其他进程
+  或未调用 enable() 的程序查询该视图、更新或删除已索引的记录会报
+  "no such function"，对原表的维护操作应在调用 enable() 后进行。
+- 索引只随模型实例的 save()/delete_instance() 同步（经 pre_save/post_save/pre_delete
+  回调）。insert_many()、Model.update()、Model.delete() 与原生 SQL 绕过回调，
+  索引会与原表不一致：批量删除前需调用 remove_rows()，批量写入后调用 index_rows()，
+  批量修改正文后调用 rebuild()。
+"""
+
+import re
+from typing import List, NamedTuple, Optional
+
+from peewee import PostgresqlDatabase, SqliteDatabase
+
+from .context_manager import get_current_agent_id
+from .models.maimbot_models import ChatHistorySummary, Messages
+
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_CJK_RUN = re.compile(f"[{_CJK_RANGES}]+")
+_TOKEN = re.compile(f"[{_CJK_RANGES}]+|[^\\W{_CJK_RANGES}]+")
+
+# SQLite 中注册的切词函数名，供外部内容视图重建索引时调用
+SEGMENT_FUNCTION = "maim_fts_segment"
+
+
+def _bigrams(run: str) -> List[str]:
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def segment(text: Optional[str]) -> str:
+    """把文本切分为空格分隔的索引词，中日韩字符切为二元组
+
+    每段连续中日韩字符的最后一个字另作为单字词写入，使单字查询的前缀匹配
+    也能命中位于段末的字（"我喜欢猫" 中的 "猫"）。
+    """
+    if not text:
+        return ""
+    words = []
+    for token in _TOKEN.findall(text):
+        if _CJK_RUN.fullmatch(token):
+            words.extend(_bigrams(token))
+            if len(token) > 1:
+                words.append(token[-1])
+        else:
+            words.append(token.lower())
+    return " ".join(words)
+
+
+def _query_terms(query: str):
+    """把查询串拆成 (类型, 词) 列表：phrase 为二元组短语，prefix 为单字前缀，word 为普通词"""
+    terms = []
+    for token in _TOKEN.findall(query or ""):
+        if not _CJK_RUN.fullmatch(token):
+            terms.append(("word", [token.lower()]))
+        elif len(token) == 1:
+            terms.append(("prefix", [token]))
+        else:
+            terms.append(("phrase", _bigrams(token)))
+    return terms
+
+
+class SearchHit(NamedTuple):
+    """一条检索结果，score 越大越相关；LIKE 回退时为 None"""
+
+    item: object
+    score: Optional[float]
+
+
+class FullTextIndex:
+    """单个模型文本列的全文索引
+
+    通过模型写入回调在同一事务中同步索引，insert_many 等批量写入需调用
+    rebuild() 或 index_rows() 补齐。启用按月分区时各分区的 id 全表唯一，
+    分区中的记录同样纳入索引；直接删除分区后需调用 rebuild() 清除其索引。
+    """
+
+    def __init__(self, model, field_name: str):
+        self.model = model
+        self.field = model._meta.fields[field_name]
+        self.table = f"{model._meta.table_name}_fts"
+        self._enabled = False
+
+    @property
+    def database(self):
+        return self.model._meta.database
+
+    @property
+    def backend(self) -> str:
+        if isinstance(self.database, SqliteDatabase):
+            return "sqlite"
+        if isinstance(self.database, PostgresqlDatabase):
+            return "postgresql"
+        return "like"
+
+    # ---- 建表与同步 ----
+
+    def enable(self):
+        """创建索引结构并开始随写入同步，可重复调用"""
+        if self._enabled:
+            return
+        backend = self.backend
+        if backend == "sqlite":
+            self.database.register_function(segment, SEGMENT_FUNCTION, 1)
+            source = self.model._meta.table_name
+            self.database.execute_sql(
+                f'CREATE VIEW IF NOT EXISTS "{self.table}_content" AS '
+                f'SELECT "id", {SEGMENT_FUNCTION}("{self.field.column_name}") AS "document" '
+                f'FROM "{source}"'
+            )
+            self.database.execute_sql(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS "{self.table}" USING fts5('
+                f"document, content='{self.table}_content', content_rowid='id', "
+                f"tokenize='unicode61')"
+            )
+        elif backend == "postgresql":
+            self.database.execute_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.table}" ('
+                f'"id" INTEGER PRIMARY KEY, "agent_id" VARCHAR(255) NOT NULL, '
+                f'"document" TSVECTOR NOT NULL)'
+            )
+            self.database.execute_sql(
+                f'CREATE INDEX IF NOT EXISTS "{self.table}_document" '
+                f'ON "{self.table}" USING GIN ("document")'
+            )
+            self.database.execute_sql(
+                f'CREATE INDEX IF NOT EXISTS "{self.table}_agent_id" ON "{self.table}" ("agent_id")'
+            )
+        if backend != "like":
+            self.model.add_listener("pre_save", self._on_pre_save)
+            self.model.add_listener("post_save", self._on_post_save)
+            self.model.add_listener("pre_delete", self._on_pre_delete)
+        self._enabled = True
+
+    def disable(self):
+        """停止随写入同步，已建立的索引保留"""
+        self.model.remove_listener("pre_save", self._on_pre_save)
+        self.model.remove_listener("post_save", self._on_post_save)
+        self.model.remove_listener("pre_delete", self._on_pre_delete)
+        self._enabled = False
+
+    def rebuild(self):
+        """按原表内容全量重建索引"""
+        if self.backend == "sqlite":
+            self.database.execute_sql(f'INSERT INTO "{self.table}"("{self.table}") VALUES (\'rebuild\')')
+        elif self.backend == "postgresql":
+            with self.database.atomic():
+                self.database.execute_sql(f'TRUNCATE "{self.table}"')
+                self.index_rows(self.model.select_unscoped().iterator())
+
+    def index_rows(self, rows):
+        """为新写入的记录建立索引，rows 为模型实例"""
+        for row in rows:
+            self._insert(row)
+
+    def remove_rows(self, pks):
+        """在批量删除原表记录之前移除其索引"""
+        if not self._enabled or self.backend == "like":
+            return
+        for pk in pks:
+            self._delete(pk)
+
+    def _on_pre_save(self, instance, created):
+        if created or self.field.name not in instance._dirty:
+            return
+        self._delete(instance._pk)
+        self._insert(instance)
+
+    def _on_post_save(self, instance, created):
+        if created:
+            self._insert(instance)
+
+    def _on_pre_delete(self, instance):
+        self._delete(instance._pk)
+
+    def _insert(self, instance):
+        document = segment(getattr(instance, self.field.name))
+        if self.backend == "sqlite":
+            self.database.execute_sql(
+                f'INSERT INTO "{self.table}"(rowid, document) VALUES (?, ?)',
+                (instance._pk, document),
+            )
+        else:
+            self.database.execute_sql(
+                f'INSERT INTO "{self.table}" ("id", "agent_id", "document") '
+                f"VALUES (%s, %s, to_tsvector('simple', %s)) "
+                f'ON CONFLICT ("id") DO UPDATE SET "agent_id" = EXCLUDED."agent_id", '
+                f'"document" = EXCLUDED."document"',
+                (instance._pk, instance.agent_id, document),
+            )
+
+    def _delete(self, pk):
+        if self.backend == "sqlite":
+            # 外部内容表删除时需提供原先索引的词，从当前库中的旧值重新切分
+            self.database.execute_sql(
+                f'INSERT INTO "{self.table}"("{self.table}", rowid, document) '
+                f'SELECT \'delete\', "id", "document" FROM "{self.table}_content" WHERE "id" = ?',
+                (pk,),
+            )
+        else:
+            self.database.execute_sql(f'DELETE FROM "{self.table}" WHERE "id" = %s', (pk,))
+
+    # ---- 检索 ----
+
+    def search(
+        self, query: str, *, agent_id: str = None, limit: int = 20, offset: int = 0
+    ) -> List[SearchHit]:
+        """在指定 Agent 的数据中检索，按相关度降序返回
+
+        所有查询词都需命中；中文词按短语匹配，单个汉字按前缀匹配。
+        未指定 agent_id 时使用当前上下文中的 agent_id。
+        """
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("全文检索时必须设置 agent_id")
+        terms = _query_terms(query)
+        if not terms:
+            return []
+
+        backend = self.backend if self._enabled else "like"
+        if backend == "like":
+            return self._search_like(terms, agent_id, limit, offset)
+
+        source = self.model._meta.table_name
+        if backend == "sqlite":
+            sql = (
+                f'SELECT t1.*, -bm25("{self.table}") AS "fts_score" FROM "{self.table}" '
+                f'JOIN "{source}" AS t1 ON t1."id" = "{self.table}".rowid '
+                f'WHERE "{self.table}" MATCH ? AND t1."agent_id" = ? '
+                f'ORDER BY "fts_score" DESC LIMIT ? OFFSET ?'
+            )
+            params = (self._fts5_query(terms), agent_id, limit, offset)
+        else:
+            sql = (
+                f'SELECT t1.*, ts_rank(f."document", q) AS "fts_score" '
+                f'FROM "{self.table}" AS f, to_tsquery(\'simple\', %s) AS q, "{source}" AS t1 '
+                f'WHERE t1."id" = f."id" AND f."agent_id" = %s AND f."document" @@ q '
+                f'ORDER BY "fts_score" DESC LIMIT %s OFFSET %s'
+            )
+            params = (self._tsquery(terms), agent_id, limit, offset)
+        return [SearchHit(row, row.fts_score) for row in self.model.raw(sql, *params)]
+
+    def _search_like(self, terms, agent_id, limit, offset) -> List[SearchHit]:
+        query = self.model.select_unscoped().where(self.model.agent_id == agent_id)
+        for kind, words in terms:
+            needle = words[0] if kind != "phrase" else words[0] + "".join(w[1] for w in words[1:])
+            query = query.where(self.field.contains(needle))
+        query = query.order_by(self.model._meta.primary_key.desc()).limit(limit).offset(offset)
+        return [SearchHit(row, None) for row in query]
+
+    @staticmethod
+    def _fts5_query(terms) -> str:
+        parts = []
+        for kind, words in terms:
+            phrase = '"' + " ".join(words) + '"'
+            parts.append(phrase + "*" if kind == "prefix" else phrase)
+        return " AND ".join(parts)
+
+    @staticmethod
+    def _tsquery(terms) -> str:
+        parts = []
+        for kind, words in terms:
+            if kind == "prefix":
+                parts.append(f"'{words[0]}':*")
+            else:
+                parts.append("(" + " <-> ".join(f"'{word}'" for word in words) + ")")
+        return " & ".join(parts)
+
+
+# 消息正文与聊天概括的全文索引
+message_index = FullTextIndex(Messages, "processed_plain_text")
+summary_index = FullTextIndex(ChatHistorySummary, "summary")
+
+
+def enable_fulltext_search(rebuild: bool = False):
+    """启用消息与聊天概括的全文索引；首次启用或批量导入后传 rebuild=True 回填"""
+    for index in (message_index, summary_index):
+        index.enable()
+        if rebuild:
+            index.rebuild()
+
+
+def search_messages(query: str, *, agent_id: str = None, limit: int = 20, offset: int = 0):
+    """检索消息正文"""
+    return message_index.search(query, agent_id=agent_id, limit=limit, offset=offset)
+
+
+def search_summaries(query: str, *, agent_id: str = None, limit: int = 20, offset: int = 0):
+    """检索聊天概括"""
+    return summary_index.search(query, agent_id=agent_id, limit=limit, offset=offset)
+
+
+__all__ = [
+    "FullTextIndex",
+    "SearchHit",
+    "segment",
+    "message_index",
+    "summary_index",
+    "enable_fulltext_search",
+    "search_messages",
+    "search_summaries",
+]
@@ -0,0 +1,299 @@
+"""
+内容寻址图片存储
+同一张图片被多个 Agent 收到时只保存一份文件：文件按内容 SHA-256 存放在
+<root>/<哈希前两位>/<哈希次两位>/<哈希>.<格式>，image_blobs 每个哈希一行，
+各 Agent 的 images 记录以 blob_hash 引用同一文件。
+
+- 引用计数随 images 记录的创建与删除通过计数器缓冲批量写入
+- 同一 Agent 重复收到同一图片时只累加 images.count
+- 其他 Agent 已识别过的图片可直接复用描述，不再调用 VLM
+- collect_garbage() 删除超过宽限期仍无引用的文件；是否被引用以 images 表为准，
+  引用计数只用于筛选候选，不会因计数偏差误删
+
+images 记录的 blob_hash 创建后不应再修改；insert_many、delete() 等批量语句不经过写入回调，
+之后需调用 reconcile_refcounts() 重算引用计数。
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+from peewee import IntegrityError, fn
+
+from .background import PeriodicWorker, run_sync
+from .context_manager import get_current_agent_id
+from .counters import CounterBuffer, counter_buffer
+from .models.maimbot_models import Images
+from .models.system_v2 import ImageBlob
+from .settings import settings
+
+_GC_BATCH = 500
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class StoredImage(NamedTuple):
+    """add_image 的结果"""
+
+    image: Images
+    blob: ImageBlob
+    created: bool  # 是否为该 Agent 新建了 images 记录
+
+
+class ImageStore:
+    """内容寻址图片存储
+
+    Args:
+        root: 存储根目录，默认 settings.image_store_dir
+        grace_seconds: 文件失去全部引用后保留的秒数，默认 settings.image_store_gc_grace_seconds
+        counters: 引用计数所用的计数器缓冲，默认全局 counter_buffer
+    """
+
+    def __init__(self, root: str = None, *, grace_seconds: float = None, counters: CounterBuffer = None):
+        self.root = os.path.abspath(root or settings.image_store_dir)
+        self.grace_seconds = (
+            settings.image_store_gc_grace_seconds if grace_seconds is None else grace_seconds
+        )
+        self.counters = counter_buffer if counters is None else counters
+        self.counters.register(ImageBlob.ref_count, Images.count)
+        self._enabled = False
+
+    def enable(self):
+        """开始随 images 写入维护引用计数，可重复调用；add_image 会自动启用"""
+        if self._enabled:
+            return
+        Images.add_listener("post_save", self._on_post_save)
+        Images.add_listener("pre_delete", self._on_pre_delete)
+        self._enabled = True
+
+    def disable(self):
+        Images.remove_listener("post_save", self._on_post_save)
+        Images.remove_listener("pre_delete", self._on_pre_delete)
+        self._enabled = False
+
+    # ---- 文件 ----
+
+    def blob_path(self, blob: ImageBlob) -> str:
+        """文件的绝对路径"""
+        return os.path.join(self.root, blob.path)
+
+    @staticmethod
+    def _relative_path(digest: str, format: str) -> str:
+        return os.path.join(digest[:2], digest[2:4], f"{digest}.{format.lower()}")
+
+    def _write_file(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def put_blob(self, data: bytes, format: str) -> Tuple[ImageBlob, bool]:
+        """保存图片内容，返回 (文件记录, 是否新建)；内容已存在时不重复写入"""
+        digest = content_hash(data)
+        now = time.time()
+        blob = ImageBlob.get_or_none(ImageBlob.content_hash == digest)
+        if blob is not None:
+            if blob.ref_count <= 0:
+                # 推迟垃圾回收：回收只删除最近引用时间早于宽限期的文件
+                ImageBlob.update(last_referenced_at=now).where(ImageBlob.content_hash == digest).execute()
+            path = self.blob_path(blob)
+            if not os.path.exists(path):
+                self._write_file(path, data)
+            return blob, False
+        blob = ImageBlob(
+            content_hash=digest,
+            path=self._relative_path(digest, format),
+            format=format.lower(),
+            size=len(data),
+            ref_count=0,
+            created_at=now,
+            last_referenced_at=now,
+        )
+        self._write_file(self.blob_path(blob), data)
+        try:
+            blob.save(force_insert=True)
+        except IntegrityError:
+            # 并发写入了同一内容
+            return ImageBlob.get(ImageBlob.content_hash == digest), False
+        return blob, True
+
+    # ---- 图片记录 ----
+
+    def add_image(
+        self,
+        data: bytes,
+        *,
+        type: str,
+        format: str,
+        agent_id: str = None,
+        image_id: str = "",
+        emoji_hash: str = None,
+        description: str = None,
+        timestamp: float = None,
+        reuse_description: bool = True,
+    ) -> StoredImage:
+        """为 Agent 登记一张图片
+
+        内容首次出现时写入文件；Agent 已登记过同一内容时累加 images.count 并返回已有记录。
+
+        Args:
+            data: 图片内容
+            type: 图片类型（如 emoji、image）
+            format: 文件格式（如 png、gif）
+            agent_id: 未指定时使用当前上下文中的 agent_id
+            image_id: 上层使用的图片ID
+            emoji_hash: 默认为内容的 MD5，与 MaiMBot 的计算方式一致
+            description: 已有的描述
+            timestamp: 默认为当前时间
+            reuse_description: 没有描述时复用其他记录对同一内容的描述
+        """
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("登记图片时必须设置 agent_id")
+        self.enable()
+        blob, _ = self.put_blob(data, format)
+        path = self.blob_path(blob)
+        existing = Images.select_unscoped().where(
+            (Images.agent_id == agent_id) & (Images.path == path)
+        ).first()
+        if existing is not None:
+            self.counters.increment(Images.count, existing.id)
+            return StoredImage(existing, blob, False)
+        if description is None and reuse_description:
+            description = self.shared_description(blob.content_hash)
+        image = Images(
+            agent_id=agent_id,
+            image_id=image_id,
+            emoji_hash=emoji_hash or hashlib.md5(data).hexdigest(),
+            description=description,
+            path=path,
+            blob_hash=blob.content_hash,
+            count=1,
+            timestamp=time.time() if timestamp is None else timestamp,
+            type=type,
+            vlm_processed=description is not None,
+        )
+        try:
+            image.save(force_insert=True)
+        except IntegrityError:
+            # 同一 Agent 并发登记了同一内容
+            existing = Images.select_unscoped().where(
+                (Images.agent_id == agent_id) & (Images.path == path)
+            ).get()
+            self.counters.increment(Images.count, existing.id)
+            return StoredImage(existing, blob, False)
+        return StoredImage(image, blob, True)
+
+    def shared_description(self, blob_hash: str) -> Optional[str]:
+        """任一 Agent 对该内容已有的 VLM 描述"""
+        return (
+            Images.select_unscoped(Images.description)
+            .where(
+                (Images.blob_hash == blob_hash)
+                & (Images.vlm_processed == True)  # noqa: E712
+                & Images.description.is_null(False)
+            )
+            .order_by(Images.timestamp.desc())
+            .scalar()
+        )
+
+    def _on_post_save(self, image, created):
+        if created and image.blob_hash:
+            self.counters.increment(
+                ImageBlob.ref_count, image.blob_hash, 1, touch={ImageBlob.last_referenced_at: time.time()}
+            )
+
+    def _on_pre_delete(self, image):
+        if image.blob_hash:
+            self.counters.increment(
+                ImageBlob.ref_count, image.blob_hash, -1, touch={ImageBlob.last_referenced_at: time.time()}
+            )
+
+    # ---- 回收 ----
+
+    def collect_garbage(self, *, now: float = None) -> int:
+        """删除无引用且超过宽限期的文件，返回删除的文件数"""
+        self.counters.flush()
+        cutoff = (time.time() if now is None else now) - self.grace_seconds
+        referenced = Images.select_unscoped(Images.id).where(Images.blob_hash == ImageBlob.content_hash)
+        removable = (
+            (ImageBlob.ref_count <= 0)
+            & (ImageBlob.last_referenced_at.is_null() | (ImageBlob.last_referenced_at < cutoff))
+            & ~fn.EXISTS(referenced)
+        )
+        removed = 0
+        while True:
+            candidates = list(
+                ImageBlob.select(ImageBlob.content_hash, ImageBlob.path).where(removable).limit(_GC_BATCH)
+            )
+            if not candidates:
+                return removed
+            hashes = [blob.content_hash for blob in candidates]
+            with ImageBlob._meta.database.atomic():
+                # 删除语句再次检查条件，期间新增的引用不会被删除
+                ImageBlob.delete().where(ImageBlob.content_hash.in_(hashes) & removable).execute()
+                survivors = {
+                    digest
+                    for digest, in ImageBlob.select(ImageBlob.content_hash)
+                    .where(ImageBlob.content_hash.in_(hashes))
+                    .tuples()
+                }
+            # 未删除的候选在删除前获得了引用，下一轮不会再选中
+            deleted = [blob for blob in candidates if blob.content_hash not in survivors]
+            for blob in deleted:
+                self._remove_file(blob)
+            removed += len(deleted)
+
+    def _remove_file(self, blob: ImageBlob):
+        # 删除文件前再确认没有被重新登记；重新登记时文件缺失会由 put_blob 补写
+        if ImageBlob.get_or_none(ImageBlob.content_hash == blob.content_hash) is not None:
+            return
+        try:
+            os.remove(self.blob_path(blob))
+        except FileNotFoundError:
+            pass
+
+    def reconcile_refcounts(self) -> int:
+        """按 images 表重算全部引用计数，返回修正的行数；宜在低峰期执行"""
+        self.counters.flush()
+        actual = (
+            Images.select_unscoped(fn.COUNT(Images.id))
+            .where(Images.blob_hash == ImageBlob.content_hash)
+        )
+        return (
+            ImageBlob.update(ref_count=actual)
+            .where(ImageBlob.ref_count != actual)
+            .execute()
+        )
+
+
+class ImageStoreGCWorker(PeriodicWorker):
+    """定期回收无引用图片文件的后台任务"""
+
+    def __init__(self, store: "ImageStore" = None, *, interval: float = 3600):
+        super().__init__(interval)
+        self.store = store or image_store
+        self.last_removed = 0
+
+    async def run_once(self):
+        self.last_removed = await run_sync(self.store.collect_garbage)
+
+
+# 全局图片存储
+image_store = ImageStore()
+
+
+__all__ = [
+    "ImageStore",
+    "ImageStoreGCWorker",
+    "StoredImage",
+    "content_hash",
+    "image_store",
+]
@@ -0,0 +1,57 @@
+"""
+线程安全的 LRU 缓存
+供聊天流、描述、人物信息等进程内读缓存复用
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """按最近使用淘汰的定长缓存"""
+
+    def __init__(self, maxsize: int = 1024):
+        if maxsize <= 0:
+            raise ValueError("maxsize 必须为正数")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def get(self, key, default: Optional[Any] = None) -> Any:
+        """读取缓存，命中时刷新使用顺序"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default: Optional[Any] = None) -> Any:
+        """移除并返回缓存条目"""
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,282 @@
+"""
+聊天最近消息缓存
+为每个聊天维护最近 max_context_size 条消息的环形缓冲区，回复决策读取上下文时
+直接从内存返回，不再每次查询 messages 表。
+
+- 写入事务中先移出聊天的缓冲区，事务提交后（post_commit 回调）再放回并追加新消息；
+  写入回滚或处于调用方开启的事务中时不会放回，下次读取时从数据库回填
+- 未缓存的聊天在首次读取时从数据库回填，事务中的读取不写入缓存
+- 读取返回缓冲区中消息的副本，调用方修改返回的实例不影响缓存
+- 所有聊天共享一个内存上限，超出时按最久未读取淘汰整个聊天
+
+insert_many 等批量写入不经过写入回调，批量导入后需调用 clear() 或 forget_agent()。
+"""
+
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Tuple
+
+from .context_manager import get_current_agent_id
+from .models.agent_config import ChatConfigOverrides
+from .models.maimbot_models import Messages
+from .settings import settings
+
+DEFAULT_CONTEXT_SIZE = 18
+# 单条消息的固定开销估算（实例、字典与字段对象）
+_MESSAGE_OVERHEAD = 1024
+
+
+def _copy(message):
+    """复制消息实例，缓冲区与调用方不共享可变对象"""
+    copy = type(message)()
+    copy.__data__ = dict(message.__data__)
+    copy._dirty.clear()
+    return copy
+
+
+def _estimate_size(message) -> int:
+    size = _MESSAGE_OVERHEAD
+    for value in message.__data__.values():
+        if isinstance(value, str):
+            size += len(value) * 2
+    return size
+
+
+class _ChatBuffer:
+    __slots__ = ("messages", "sizes", "nbytes", "exhaustive")
+
+    def __init__(self, capacity: int):
+        self.messages = deque(maxlen=capacity)
+        self.sizes = deque(maxlen=capacity)
+        self.nbytes = 0
+        # 聊天的全部消息都在缓冲区内，不足 limit 时无需回源
+        self.exhaustive = False
+
+    def append(self, message):
+        if len(self.messages) == self.messages.maxlen:
+            self.nbytes -= self.sizes[0]
+            self.exhaustive = False
+        size = _estimate_size(message)
+        self.messages.append(message)
+        self.sizes.append(size)
+        self.nbytes += size
+
+
+class RecentMessageCache:
+    """按聊天缓存最近消息
+
+    Args:
+        max_bytes: 所有聊天缓冲区的估算内存上限，默认 settings.message_cache_max_bytes
+    """
+
+    def __init__(self, max_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = settings.message_cache_max_bytes
+        if max_bytes <= 0:
+            raise ValueError("max_bytes 必须为正数")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._buffers: OrderedDict[Tuple[str, str], _ChatBuffer] = OrderedDict()
+        self._capacities: Dict[str, int] = {}
+        # 正在回填的聊天，值表示回填期间是否有新写入
+        self._filling: Dict[Tuple[str, str], bool] = {}
+        self._nbytes = 0
+        # 每次写入递增；提交时序号未变才能放回写入前移出的缓冲区
+        self._write_seq = 0
+        # 当前线程未提交写入移出的缓冲区：(消息, 聊天键, 缓冲区, 写入序号)
+        self._pending = threading.local()
+        self._lock = threading.RLock()
+        self._enabled = False
+
+    @property
+    def nbytes(self) -> int:
+        """当前缓存的估算内存占用"""
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    # ---- 启用与容量 ----
+
+    def enable(self):
+        """开始随 Messages 写入同步缓存，可重复调用"""
+        if self._enabled:
+            return
+        Messages.add_listener("post_save", self._on_post_save)
+        Messages.add_listener("post_commit", self._on_post_commit)
+        Messages.add_listener("pre_delete", self._on_pre_delete)
+        self._enabled = True
+
+    def disable(self):
+        """停止同步并清空缓存"""
+        Messages.remove_listener("post_save", self._on_post_save)
+        Messages.remove_listener("post_commit", self._on_post_commit)
+        Messages.remove_listener("pre_delete", self._on_pre_delete)
+        self._enabled = False
+        self.clear()
+
+    def capacity_for(self, agent_id: str) -> int:
+        """Agent 的上下文长度，取自聊天配置覆盖的 max_context_size"""
+        capacity = self._capacities.get(agent_id)
+        if capacity is None:
+            row = (
+                ChatConfigOverrides.select(ChatConfigOverrides.max_context_size)
+                .where(ChatConfigOverrides.agent_id == agent_id)
+                .first()
+            )
+            capacity = row.max_context_size if row and row.max_context_size else DEFAULT_CONTEXT_SIZE
+            self._capacities[agent_id] = capacity
+        return capacity
+
+    def forget_agent(self, agent_id: str):
+        """Agent 的聊天配置变化后调用，丢弃其容量与缓冲区"""
+        with self._lock:
+            self._capacities.pop(agent_id, None)
+            for key in [key for key in self._buffers if key[0] == agent_id]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._nbytes = 0
+
+    # ---- 读取 ----
+
+    def get_recent(
+        self,
+        chat_id: str,
+        limit: int = None,
+        *,
+        before: float = None,
+        agent_id: str = None,
+    ) -> List[Messages]:
+        """读取聊天最近的 limit 条消息（按时间正序），语义与 Messages.recent_messages 一致
+
+        limit 默认为 Agent 的上下文长度；超过上下文长度或缓冲区无法覆盖时查询数据库。
+        返回的消息是缓存的副本，可以自由修改。
+        """
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("查询最近消息时必须设置 agent_id")
+        capacity = self.capacity_for(agent_id)
+        if limit is None:
+            limit = capacity
+        if limit <= 0:
+            return []
+        if limit > capacity:
+            return Messages.recent_messages(chat_id, before, limit, agent_id=agent_id)
+
+        key = (agent_id, chat_id)
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is not None:
+                self._buffers.move_to_end(key)
+                messages = list(buffer.messages)
+                exhaustive = buffer.exhaustive
+            else:
+                self._filling[key] = False
+        if buffer is None:
+            self.misses += 1
+            messages = self._backfill(key, capacity)
+            exhaustive = len(messages) < capacity
+        else:
+            self.hits += 1
+
+        if before is not None:
+            messages = [message for message in messages if message.time < before]
+        if len(messages) < limit and not exhaustive:
+            # 缓冲区之前可能还有更早的消息
+            return Messages.recent_messages(chat_id, before, limit, agent_id=agent_id)
+        return [_copy(message) for message in messages[-limit:]]
+
+    def _backfill(self, key, capacity: int) -> List[Messages]:
+        agent_id, chat_id = key
+        try:
+            messages = Messages.recent_messages(chat_id, None, capacity, agent_id=agent_id)
+        except BaseException:
+            with self._lock:
+                self._filling.pop(key, None)
+            raise
+        buffer = _ChatBuffer(capacity)
+        for message in messages:
+            buffer.append(message)
+        buffer.exhaustive = len(messages) < capacity
+        # 事务中读到的可能是尚未提交的写入，不缓存
+        in_transaction = Messages._meta.database.in_transaction()
+        with self._lock:
+            # 回填期间有新消息写入时结果可能已过期，本次不缓存
+            if self._filling.pop(key, True) or in_transaction:
+                return messages
+            self._drop(key)
+            self._buffers[key] = buffer
+            self._nbytes += buffer.nbytes
+            self._evict()
+        return messages
+
+    # ---- 写入同步 ----
+
+    def _on_post_save(self, message, created):
+        # 写入尚未提交，先移出缓冲区，避免其他读取看到未提交或随后回滚的消息
+        key = (message.agent_id, message.chat_id)
+        with self._lock:
+            if key in self._filling:
+                self._filling[key] = True
+            self._write_seq += 1
+            buffer = self._buffers.get(key)
+            self._drop(key)
+            self._pending.entry = None
+            if buffer is None or not created:
+                return
+            newest = buffer.messages[-1].time if buffer.messages else None
+            if newest is not None and message.time < newest:
+                # 乱序写入，下次读取时重新回填
+                return
+            self._pending.entry = (message, key, buffer, self._write_seq)
+
+    def _on_post_commit(self, message, created):
+        entry = getattr(self._pending, "entry", None)
+        self._pending.entry = None
+        if not created:
+            # 提交前其他线程可能回填了修改前的内容，再丢弃一次
+            self._on_pre_delete(message)
+            return
+        if entry is None or entry[0] is not message:
+            return
+        _, key, buffer, seq = entry
+        with self._lock:
+            # 提交前有其他写入或回填时放弃，下次读取时重新回填
+            if seq != self._write_seq or key in self._buffers or key in self._filling:
+                return
+            buffer.append(_copy(message))
+            self._buffers[key] = buffer
+            self._nbytes += buffer.nbytes
+            self._evict()
+
+    def _on_pre_delete(self, message):
+        key = (message.agent_id, message.chat_id)
+        with self._lock:
+            if key in self._filling:
+                self._filling[key] = True
+            self._write_seq += 1
+            self._drop(key)
+
+    def _drop(self, key):
+        buffer = self._buffers.pop(key, None)
+        if buffer is not None:
+            self._nbytes -= buffer.nbytes
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and len(self._buffers) > 1:
+            _, buffer = self._buffers.popitem(last=False)
+            self._nbytes -= buffer.nbytes
+
+
+# 全局最近消息缓存
+recent_message_cache = RecentMessageCache()
+
+
+__all__ = [
+    "RecentMessageCache",
+    "recent_message_cache",
+]
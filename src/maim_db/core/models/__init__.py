@@ -17,6 +17,8 @@ from .system_v2 import (
     Agent,
     ApiKey,
     AgentActiveState,
+    QuotaCounter,
+    ImageBlob,
     User as UserV2,
 )
 
@@ -69,8 +71,11 @@ from .system import (
 from .maimbot_models import (
     ChatStreams,
     LLMUsage,
+    LLMUsageHourly,
+    LLMUsageDaily,
     Emoji,
     Messages,
+    ActionRecords,
     Images,
     ImageDescriptions,
     EmojiDescriptionCache,
@@ -95,6 +100,8 @@ V2_MODELS = [
     ApiKey,
     ApiKey,
     AgentActiveState,
+    QuotaCounter,
+    ImageBlob,
     UserV2,
 ]
 
@@ -152,6 +159,8 @@ __all__ = [
     "Agent",
     "ApiKey",
     "AgentActiveState",
+    "QuotaCounter",
+    "ImageBlob",
     # Agent配置模型
     "PersonalityConfig",
     "BotConfigOverrides",
@@ -179,8 +188,11 @@ __all__ = [
     # MaiMBot Models
     "ChatStreams",
     "LLMUsage",
+    "LLMUsageHourly",
+    "LLMUsageDaily",
     "Emoji",
     "Messages",
+    "ActionRecords",
     "Images",
     "ImageDescriptions",
     "EmojiDescriptionCache",
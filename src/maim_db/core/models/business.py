@@ -18,6 +18,10 @@ from peewee import (
 
 from ..context_manager import get_current_agent_id
 from ..database import get_database
+from ..pagination import keyset_paginate
+
+# 写入事件
+WRITE_EVENTS = ("pre_save", "post_save", "pre_delete", "post_commit")
 
 
 class BusinessBaseModel(Model):
@@ -38,7 +42,63 @@ class BusinessBaseModel(Model):
                 self.agent_id = current_id
             else:
                 raise ValueError("业务模型必须设置 agent_id")
-        return super().save(*args, **kwargs)
+
+        if not self._has_listeners():
+            return super().save(*args, **kwargs)
+        force_insert = args[0] if args else kwargs.get('force_insert', False)
+        created = bool(force_insert) or self._pk is None
+        database = self._meta.database
+        outer = database.in_transaction()
+        with database.atomic():
+            self._dispatch('pre_save', created)
+            result = super().save(*args, **kwargs)
+            self._dispatch('post_save', created)
+        if not outer:
+            self._dispatch('post_commit', created)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        """删除拦截，触发 pre_delete 回调"""
+        if not self._has_listeners():
+            return super().delete_instance(*args, **kwargs)
+        with self._meta.database.atomic():
+            self._dispatch('pre_delete')
+            return super().delete_instance(*args, **kwargs)
+
+    @classmethod
+    def add_listener(cls, event: str, callback):
+        """注册写入回调，对子类（包括分区模型）同样生效
+
+        pre_save / post_save 回调签名为 callback(instance, created)，
+        pre_delete 回调签名为 callback(instance)。回调与写入处于同一事务中。
+        post_commit 回调签名为 callback(instance, created)，在 save() 自己开启的事务
+        提交后调用；save() 处于调用方已开启的事务中或写入回滚时不会调用。
+        insert_many、update()、delete() 等批量语句不会触发回调。
+        """
+        if event not in WRITE_EVENTS:
+            raise ValueError(f"未知的写入事件: {event}")
+        listeners = cls.__dict__.get('_write_listeners')
+        if listeners is None:
+            listeners = {name: [] for name in WRITE_EVENTS}
+            cls._write_listeners = listeners
+        listeners[event].append(callback)
+
+    @classmethod
+    def remove_listener(cls, event: str, callback):
+        """移除写入回调"""
+        listeners = cls.__dict__.get('_write_listeners')
+        if listeners and callback in listeners.get(event, ()):
+            listeners[event].remove(callback)
+
+    def _has_listeners(self) -> bool:
+        return any('_write_listeners' in klass.__dict__ for klass in type(self).__mro__)
+
+    def _dispatch(self, event: str, *args):
+        for klass in type(self).__mro__:
+            listeners = klass.__dict__.get('_write_listeners')
+            if listeners:
+                for callback in list(listeners[event]):
+                    callback(self, *args)
 
     @classmethod
     def select(cls, *fields):
@@ -52,6 +112,44 @@ class BusinessBaseModel(Model):
 
         return query
 
+    @classmethod
+    def select_unscoped(cls, *fields):
+        """不追加 agent_id 过滤的查询，仅供内部缓存与维护任务按全局唯一键读取"""
+        return super().select(*fields)
+
+    @classmethod
+    def keyset_paginate(
+        cls,
+        cursor=None,
+        limit: int = 50,
+        *,
+        order_by=None,
+        descending: bool = False,
+        query=None,
+    ):
+        """键集分页，自动沿用 select() 的 agent_id 过滤
+
+        Args:
+            cursor: 上一页返回的 next_cursor，首页传 None
+            limit: 每页条数
+            order_by: 排序键字段或字段名，组合后必须唯一，例如 ("created_at", "id")；
+                默认按主键
+            descending: 是否按排序键降序，默认升序，与 keyset_paginate 一致
+            query: 额外带过滤条件的查询，需基于 cls.select() 构造
+
+        Returns:
+            KeysetPage: (items, next_cursor)
+        """
+        if order_by is None:
+            order_by = (cls._meta.primary_key,)
+        fields = [
+            cls._meta.fields[field] if isinstance(field, str) else field
+            for field in order_by
+        ]
+        if query is None:
+            query = cls.select()
+        return keyset_paginate(query, fields, cursor, limit, descending=descending)
+
     @classmethod
     def create(cls, **query):
         """拦截 create 方法，自动设置 agent_id"""
@@ -2,8 +2,10 @@
 MaiMBot 核心数据模型
 迁移自 MaiMBot/src/common/database/database_model.py
 """
+import time
 from datetime import datetime
 from peewee import (
+    BigIntegerField,
     BooleanField,
     CharField,
     DateTimeField,
@@ -11,10 +13,20 @@ from peewee import (
     FloatField,
     IntegerField,
     TextField,
+    fn,
 )
+from ..context_manager import get_current_agent_id
+from ..lru import LRUCache
+from ..partitioning import MonthlyPartitioner, PartitionRoutingMixin
+from ..settings import settings
 from .business import BusinessBaseModel
 
 
+# 聊天流缓存，键为 ("id", 主键) 或 ("stream_id", stream_id)，值为 (聊天流, 过期时间)；
+# 经 save()/delete_instance() 的修改立即失效，批量 update() 的修改在过期后重新加载
+_chat_stream_cache = LRUCache(maxsize=4096)
+
+
 class ChatStreams(BusinessBaseModel):
     """
     用于存储流式记录数据的模型
@@ -42,8 +54,47 @@ class ChatStreams(BusinessBaseModel):
     class Meta:
         table_name = "chat_streams"
 
-
-class LLMUsage(BusinessBaseModel):
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        self._invalidate_cache()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        self._invalidate_cache()
+        return super().delete_instance(*args, **kwargs)
+
+    def _invalidate_cache(self):
+        _chat_stream_cache.pop(("id", self.id))
+        _chat_stream_cache.pop(("stream_id", self.stream_id))
+
+    @classmethod
+    def get_cached(cls, stream_pk: int):
+        """按主键读取聊天流，命中进程内缓存时不访问数据库"""
+        return cls._get_cached("id", stream_pk, cls.id == stream_pk)
+
+    @classmethod
+    def get_cached_by_stream_id(cls, stream_id: str):
+        """按 stream_id 读取聊天流，命中进程内缓存时不访问数据库"""
+        return cls._get_cached("stream_id", stream_id, cls.stream_id == stream_id)
+
+    @classmethod
+    def _get_cached(cls, kind, value, condition):
+        if value is None:
+            return None
+        entry = _chat_stream_cache.get((kind, value))
+        now = time.monotonic()
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        # 主键与 stream_id 均全局唯一，无需按当前 agent 过滤
+        stream = cls.select_unscoped().where(condition).first()
+        if stream is not None:
+            entry = (stream, now + settings.chat_stream_cache_ttl)
+            _chat_stream_cache.put(("id", stream.id), entry)
+            _chat_stream_cache.put(("stream_id", stream.stream_id), entry)
+        return stream
+
+
+class LLMUsage(PartitionRoutingMixin, BusinessBaseModel):
     """
     用于存储 API 使用日志数据的模型。
     """
@@ -63,6 +114,43 @@ class LLMUsage(BusinessBaseModel):
 
     class Meta:
         table_name = "llm_usage"
+        indexes = (
+            (("agent_id", "timestamp"), False),  # 按时间分页与统计
+        )
+
+
+class _LLMUsageRollup(BusinessBaseModel):
+    """LLMUsage 汇总表公共字段，每行是一个时间桶内同一 (model_name, request_type, status) 的累计值"""
+    bucket_start = DateTimeField()
+    model_name = CharField(max_length=255)
+    request_type = CharField(max_length=255)
+    status = CharField(max_length=64)
+    request_count = BigIntegerField(default=0)
+    prompt_tokens = BigIntegerField(default=0)
+    completion_tokens = BigIntegerField(default=0)
+    total_tokens = BigIntegerField(default=0)
+    cost = DoubleField(default=0)
+    time_cost = DoubleField(default=0)
+
+    class Meta:
+        indexes = (
+            (("agent_id", "model_name", "request_type", "status", "bucket_start"), True),
+            (("agent_id", "bucket_start"), False),  # 按时间范围汇总
+        )
+
+
+class LLMUsageHourly(_LLMUsageRollup):
+    """LLMUsage 按小时汇总"""
+
+    class Meta:
+        table_name = "llm_usage_hourly"
+
+
+class LLMUsageDaily(_LLMUsageRollup):
+    """LLMUsage 按天汇总"""
+
+    class Meta:
+        table_name = "llm_usage_daily"
 
 
 class Emoji(BusinessBaseModel):
@@ -70,6 +158,7 @@ class Emoji(BusinessBaseModel):
     full_path = TextField(unique=True, index=True)
     format = TextField()
     emoji_hash = TextField(index=True)
+    perceptual_hash = CharField(max_length=16, null=True)  # 64 位 pHash 的十六进制，用于近似去重
     description = TextField()
     query_count = IntegerField(default=0)
     is_registered = BooleanField(default=False)
@@ -84,7 +173,7 @@ class Emoji(BusinessBaseModel):
         table_name = "emoji"
 
 
-class Messages(BusinessBaseModel):
+class Messages(PartitionRoutingMixin, BusinessBaseModel):
     """
     用于存储消息数据的模型。
     """
@@ -102,6 +191,7 @@ class Messages(BusinessBaseModel):
     reply_probability_boost = DoubleField(null=True)
     
     # Flat fields from chat_info
+    stream_ref = IntegerField(null=True, index=True)  # 对应 ChatStreams 主键，写入时按 chat_id 关联
     chat_info_stream_id = TextField()
     chat_info_platform = TextField()
     chat_info_user_platform = TextField()
@@ -137,6 +227,163 @@ class Messages(BusinessBaseModel):
 
     class Meta:
         table_name = "messages"
+        indexes = (
+            # 最近上下文查询：按 agent + 聊天定位后沿 time 逆序扫描
+            (("agent_id", "chat_id", "time"), False),
+            (("agent_id", "time"), False),  # 按时间分页
+            (("agent_id", "message_id"), True),  # 重复投递去重
+        )
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """已有的普通表缺少 (agent_id, message_id) 唯一索引且存在重复消息时拒绝启动
+
+        重复消息需先用 scripts/migrate_unique_message_ids.py 清理，建表时不会删除数据。
+        """
+        if not cls.partitioner.enabled and cls.table_exists():
+            index_name = f"{cls._meta.table_name}_agent_id_message_id"
+            indexes = {index.name for index in cls._meta.database.get_indexes(cls._meta.table_name)}
+            if index_name not in indexes and cls.has_duplicate_messages():
+                raise RuntimeError(
+                    f"{cls._meta.table_name} 表中存在 message_id 重复的消息，无法创建唯一索引 "
+                    f"{index_name}；请先运行 scripts/migrate_unique_message_ids.py 清理重复消息"
+                )
+        super().create_table(safe=safe, **options)
+
+    @classmethod
+    def has_duplicate_messages(cls) -> bool:
+        """同一 Agent 下是否存在 message_id 重复的消息"""
+        query = (
+            cls.select_unscoped(cls.agent_id)
+            .group_by(cls.agent_id, cls.message_id)
+            .having(fn.COUNT(cls.id) > 1)
+        )
+        return query.exists()
+
+    @classmethod
+    def remove_duplicate_messages(cls, batch_size: int = 1000) -> int:
+        """分批删除同一 Agent 下 message_id 重复的消息，保留 id 最小（最早写入）的一条
+
+        Returns:
+            删除条数
+        """
+        duplicates = (
+            cls.select_unscoped(cls.agent_id, cls.message_id, fn.MIN(cls.id))
+            .group_by(cls.agent_id, cls.message_id)
+            .having(fn.COUNT(cls.id) > 1)
+            .tuples()
+        )
+        groups = list(duplicates)
+        removed = 0
+        for offset in range(0, len(groups), batch_size):
+            with cls._meta.database.atomic():
+                for agent_id, message_id, keep_id in groups[offset:offset + batch_size]:
+                    removed += cls.delete().where(
+                        (cls.agent_id == agent_id)
+                        & (cls.message_id == message_id)
+                        & (cls.id != keep_id)
+                    ).execute()
+        return removed
+
+    def save(self, force_insert=False, only=None):
+        """写入前关联所属聊天流
+
+        重复投递的消息（同一 Agent 下 message_id 已存在）违反唯一索引，抛出 IntegrityError；
+        需要幂等写入时使用 create_if_absent() 或 MessageIngestor.ingest()。
+        """
+        self.link_stream()
+        return super().save(force_insert=force_insert, only=only)
+
+    @classmethod
+    def recent_messages(
+        cls, chat_id: str, before: float = None, limit: int = 18, *, agent_id: str = None
+    ):
+        """读取聊天中 before 之前最近的 limit 条消息，按时间正序返回
+
+        走 (agent_id, chat_id, time) 复合索引，开销与表规模无关。
+        启用按月分表时从最新的分区向前逐个读取，凑满 limit 条即停止。
+        未指定 agent_id 时使用当前上下文中的 agent_id。
+        """
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("查询最近消息时必须设置 agent_id")
+
+        messages = []
+        for model in cls.partitioner.models_for_range(end=before):
+            query = model.select_unscoped().where(
+                (model.agent_id == agent_id) & (model.chat_id == chat_id)
+            )
+            if before is not None:
+                query = query.where(model.time < before)
+            messages.extend(query.order_by(model.time.desc()).limit(limit - len(messages)))
+            if len(messages) >= limit:
+                break
+        # 存量原表可能与分区时间重叠，合并后重新排序
+        messages.sort(key=lambda message: message.time)
+        return messages[-limit:]
+
+    @classmethod
+    def create_if_absent(cls, **data):
+        """插入消息，同一 Agent 下 message_id 已存在时忽略
+
+        依赖 (agent_id, message_id) 唯一索引，以 INSERT ... ON CONFLICT DO NOTHING
+        （MySQL 为 INSERT IGNORE）写入，不需要先查询。写入成功时触发 post_save 与 post_commit 回调。
+
+        Returns:
+            新插入的消息；已存在时返回 None
+        """
+        message = cls(**data)
+        if not message.agent_id:
+            message.agent_id = get_current_agent_id()
+            if not message.agent_id:
+                raise ValueError("业务模型必须设置 agent_id")
+        message.link_stream()
+        model = cls
+        if cls.partitioner.enabled and message.time is not None:
+            model = cls.partitioner.route(message.time)
+
+        database = cls._meta.database
+        outer = database.in_transaction()
+        query = model.insert(**message.__data__).on_conflict_ignore()
+        with database.atomic():
+            if database.returning_clause:
+                row = database.execute(query.returning(model.id)).fetchone()
+                pk = row[0] if row else None
+            else:
+                cursor = database.execute(query)
+                pk = cursor.lastrowid if cursor.rowcount else None
+            if pk is None:
+                return None
+            message.__class__ = model
+            message.id = pk
+            message._dirty.clear()
+            message._dispatch("post_save", True)
+        if not outer:
+            message._dispatch("post_commit", True)
+        return message
+
+    @property
+    def chat_stream(self):
+        """所属聊天流，经进程内缓存读取"""
+        return ChatStreams.get_cached(self.stream_ref)
+
+    def link_stream(self):
+        """按 chat_id 关联聊天流，填充 stream_ref"""
+        data = self.__data__
+        if data.get("stream_ref") is not None:
+            return
+        stream = ChatStreams.get_cached_by_stream_id(
+            data.get("chat_info_stream_id") or data.get("chat_id")
+        )
+        if stream is None:
+            return
+        if data.get("agent_id") and stream.agent_id != data["agent_id"]:
+            return
+        self.stream_ref = stream.id
+
+
+LLMUsage.partitioner = MonthlyPartitioner(LLMUsage, "timestamp")
+Messages.partitioner = MonthlyPartitioner(Messages, "time", epoch=True)
 
 
 class ActionRecords(BusinessBaseModel):
@@ -157,6 +404,9 @@ class ActionRecords(BusinessBaseModel):
 
     class Meta:
         table_name = "action_records"
+        indexes = (
+            (("agent_id", "chat_id", "time"), False),  # 聊天时间线查询
+        )
 
 
 class Images(BusinessBaseModel):
@@ -165,8 +415,10 @@ class Images(BusinessBaseModel):
     """
     image_id = TextField(default="")
     emoji_hash = TextField(index=True)
+    perceptual_hash = CharField(max_length=16, null=True)  # 64 位 pHash 的十六进制，用于近似去重
     description = TextField(null=True)
-    path = TextField(unique=True)
+    path = TextField()
+    blob_hash = CharField(max_length=64, null=True, index=True)  # 引用的 image_blobs.content_hash
     count = IntegerField(default=1)
     timestamp = FloatField()
     type = TextField()
@@ -174,6 +426,9 @@ class Images(BusinessBaseModel):
 
     class Meta:
         table_name = "images"
+        indexes = (
+            (("agent_id", "path"), True),  # 同一内容寻址文件可被多个 Agent 引用
+        )
 
 
 class ImageDescriptions(BusinessBaseModel):
@@ -267,6 +522,9 @@ class PersonInfo(BusinessBaseModel):
 
     class Meta:
         table_name = "person_info"
+        indexes = (
+            (("agent_id", "platform", "user_id"), False),  # 收到消息时按平台用户查找
+        )
 
 
 class GroupInfo(BusinessBaseModel):
@@ -366,8 +624,11 @@ class ThinkingBack(BusinessBaseModel):
 MAIMBOT_MODELS = [
     ChatStreams,
     LLMUsage,
+    LLMUsageHourly,
+    LLMUsageDaily,
     Emoji,
     Messages,
+    ActionRecords,
     Images,
     ImageDescriptions,
     EmojiDescriptionCache,
@@ -19,13 +19,15 @@ from peewee import (
     UUIDField,
     IntegerField,
     BigIntegerField,
+    DoubleField,
     FloatField,
     Check,
     DatabaseProxy,
     CompositeKey,
+    chunked,
 )
 
-from ..database import get_database
+from ..database import conflict_target, get_database
 
 
 class TenantType(Enum):
@@ -119,6 +121,7 @@ class Tenant(BaseModel):
     class Meta:
         table_name = "tenants"
         database = get_database()
+        indexes = ((("created_at", "id"), False),)  # 键集分页
 
     def save(self, *args, **kwargs):
         """保存时更新时间戳"""
@@ -168,6 +171,7 @@ class Agent(BaseModel):
     class Meta:
         table_name = "agents"
         database = get_database()
+        indexes = ((("tenant_id", "created_at", "id"), False),)  # 键集分页
 
     def save(self, *args, **kwargs):
         """保存时更新时间戳"""
@@ -268,12 +272,16 @@ class AgentActiveState(BaseModel):
     ttl_seconds = IntegerField(default=300, help_text="活跃 TTL，秒")
     expires_at = DateTimeField(index=True, help_text="到期时间，用于筛选仍然活跃的记录")
 
+    # touch 写入后的进程内回调
+    _touch_listeners = []
+
     class Meta:
         table_name = "agent_active_states"
         database = get_database()
         indexes = (
             (("tenant_id", "agent_id"), True),
             (("expires_at",), False),
+            (("last_seen_at",), False),
         )
 
     def save(self, *args, **kwargs):
@@ -294,30 +302,144 @@ class AgentActiveState(BaseModel):
         *,
         current_time: datetime = None,
     ):
-        """更新或创建活跃状态，并重置 TTL"""
+        """更新或创建活跃状态，并重置 TTL
+
+        通过单条 INSERT ... ON CONFLICT (tenant_id, agent_id) DO UPDATE 完成，
+        不经过 save()，并发心跳不会在唯一索引上竞争。
+
+        Returns:
+            AgentActiveState: 按冲突键重新读取的已存储记录（含主键）
+        """
         if ttl_seconds <= 0:
             raise ValueError("ttl_seconds 必须为正数")
 
         now = current_time or datetime.utcnow()
-        expires_at = now + timedelta(seconds=ttl_seconds)
+        row = {
+            "tenant_id": tenant_id,
+            "agent_id": agent_id,
+            "last_seen_at": now,
+            "ttl_seconds": ttl_seconds,
+            "expires_at": now + timedelta(seconds=ttl_seconds),
+        }
+        cls._upsert_query([row]).execute()
+        cls._notify_touched([row])
+        return cls.get((cls.tenant_id == tenant_id) & (cls.agent_id == agent_id))
 
-        record, created = cls.get_or_create(
-            tenant_id=tenant_id,
-            agent_id=agent_id,
-            defaults={
-                "last_seen_at": now,
+    @classmethod
+    def touch_many(
+        cls,
+        heartbeats,
+        *,
+        current_time: datetime = None,
+        batch_size: int = 100,
+    ) -> int:
+        """批量刷新心跳
+
+        Args:
+            heartbeats: (tenant_id, agent_id, ttl_seconds) 或
+                (tenant_id, agent_id, ttl_seconds, last_seen_at) 元组的可迭代对象，
+                未给出 last_seen_at 时使用 current_time
+            current_time: 默认心跳时间
+            batch_size: 单条语句包含的最大行数，超出时在同一事务内分批执行
+
+        Returns:
+            int: 实际写入的记录数（同一 Agent 重复出现时只保留最新一次心跳）
+        """
+        default_now = current_time or datetime.utcnow()
+        latest = {}
+        for heartbeat in heartbeats:
+            tenant_id, agent_id, ttl_seconds = heartbeat[:3]
+            seen_at = heartbeat[3] if len(heartbeat) > 3 and heartbeat[3] else default_now
+            if ttl_seconds <= 0:
+                raise ValueError("ttl_seconds 必须为正数")
+            key = (tenant_id, agent_id)
+            # 同一语句中重复的冲突键在 PostgreSQL 上会报错，这里先按键去重
+            if key in latest and latest[key]["last_seen_at"] >= seen_at:
+                continue
+            latest[key] = {
+                "tenant_id": tenant_id,
+                "agent_id": agent_id,
+                "last_seen_at": seen_at,
                 "ttl_seconds": ttl_seconds,
-                "expires_at": expires_at,
-            },
+                "expires_at": seen_at + timedelta(seconds=ttl_seconds),
+            }
+
+        rows = list(latest.values())
+        if not rows:
+            return 0
+        with cls._meta.database.atomic():
+            for batch in chunked(rows, batch_size):
+                cls._upsert_query(batch).execute()
+        cls._notify_touched(rows)
+        return len(rows)
+
+    @classmethod
+    def purge_expired(
+        cls,
+        grace_seconds: int,
+        *,
+        batch_size: int = 1000,
+        current_time: datetime = None,
+    ) -> int:
+        """删除过期超过 grace_seconds 的记录，按批执行，返回删除的总行数"""
+        cutoff = (current_time or datetime.utcnow()) - timedelta(seconds=grace_seconds)
+        total = 0
+        while True:
+            deleted = cls.purge_expired_batch(cutoff, batch_size=batch_size)
+            total += deleted
+            if deleted < batch_size:
+                return total
+
+    @classmethod
+    def purge_expired_batch(cls, cutoff: datetime, *, batch_size: int = 1000) -> int:
+        """删除一批 expires_at 早于 cutoff 的记录，返回删除的行数"""
+        if batch_size <= 0:
+            raise ValueError("batch_size 必须为正数")
+        # 先取主键再删除：MySQL 不支持在 IN 子查询中使用 LIMIT
+        ids = [
+            row_id
+            for (row_id,) in cls.select(cls.id)
+            .where(cls.expires_at < cutoff)
+            .order_by(cls.expires_at)
+            .limit(batch_size)
+            .tuples()
+        ]
+        if not ids:
+            return 0
+        # 再次校验 expires_at，避免删除期间刚被 touch 续期的记录
+        return (
+            cls.delete()
+            .where(cls.id.in_(ids) & (cls.expires_at < cutoff))
+            .execute()
         )
 
-        if not created:
-            record.last_seen_at = now
-            record.ttl_seconds = ttl_seconds
-            record.expires_at = expires_at
-            record.save()
+    @classmethod
+    def add_touch_listener(cls, callback):
+        """注册心跳监听器，每次 touch 写入成功后以 (tenant_id, agent_id, expires_at) 调用"""
+        if callback not in cls._touch_listeners:
+            cls._touch_listeners.append(callback)
+
+    @classmethod
+    def remove_touch_listener(cls, callback):
+        """移除心跳监听器"""
+        if callback in cls._touch_listeners:
+            cls._touch_listeners.remove(callback)
+
+    @classmethod
+    def _notify_touched(cls, rows):
+        for callback in list(cls._touch_listeners):
+            for row in rows:
+                callback(row["tenant_id"], row["agent_id"], row["expires_at"])
 
-        return record
+    @classmethod
+    def _upsert_query(cls, rows):
+        """构造按 (tenant_id, agent_id) 冲突更新的批量插入语句"""
+        return cls.insert_many(rows).on_conflict(
+            conflict_target=conflict_target(
+                cls._meta.database, cls.tenant_id, cls.agent_id
+            ),
+            preserve=[cls.last_seen_at, cls.ttl_seconds, cls.expires_at],
+        )
 
     @classmethod
     def list_active(cls, *, current_time: datetime = None):
@@ -325,6 +447,45 @@ class AgentActiveState(BaseModel):
         now = current_time or datetime.utcnow()
         return cls.select().where(cls.expires_at > now)
 
+    @classmethod
+    def list_touched_since(cls, since: datetime, *, current_time: datetime = None):
+        """列出 since 之后有过心跳且仍未过期的记录，走 last_seen_at 索引"""
+        now = current_time or datetime.utcnow()
+        return cls.select().where((cls.last_seen_at > since) & (cls.expires_at > now))
+
+
+class QuotaCounter(BaseModel):
+    """配额计数，每个作用域每小时一行，记录已提交的 token 与成本"""
+
+    scope = CharField(max_length=16, help_text="作用域：tenant 或 agent")
+    scope_id = CharField(max_length=50, help_text="租户ID或Agent ID")
+    bucket_start = DateTimeField(help_text="小时桶起点")
+    tokens = BigIntegerField(default=0, help_text="已提交的 token 数")
+    cost = DoubleField(default=0, help_text="已提交的成本")
+    updated_at = DateTimeField(default=datetime.utcnow, help_text="最近写入时间")
+
+    class Meta:
+        table_name = "quota_counters"
+        database = get_database()
+        indexes = ((("scope", "scope_id", "bucket_start"), True),)
+
+
+class ImageBlob(BaseModel):
+    """内容寻址的图片文件，同一内容只存一份，由各 Agent 的 images 记录通过 blob_hash 引用"""
+
+    content_hash = CharField(primary_key=True, max_length=64, help_text="内容 SHA-256")
+    path = TextField(help_text="相对存储根目录的文件路径")
+    format = CharField(max_length=16, help_text="文件格式")
+    size = BigIntegerField(default=0, help_text="文件字节数")
+    ref_count = IntegerField(default=0, help_text="引用该文件的 images 记录数")
+    created_at = DoubleField(help_text="创建时间戳")
+    last_referenced_at = DoubleField(null=True, help_text="最近一次引用变化的时间戳")
+
+    class Meta:
+        table_name = "image_blobs"
+        database = get_database()
+        indexes = ((("ref_count", "last_referenced_at"), False),)
+
 
 # 导出所有模型
 __all__ = [
@@ -338,4 +499,6 @@ __all__ = [
     "Tenant",
     "Agent",
     "ApiKey",
+    "QuotaCounter",
+    "ImageBlob",
 ]
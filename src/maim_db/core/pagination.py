@@ -0,0 +1,106 @@
+"""
+键集（seek）分页
+以排序键的最后取值作为游标，翻页开销与页码无关，替代 limit/offset 深翻页
+"""
+
+import base64
+import binascii
+import json
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from peewee import Field
+
+
+class KeysetPage(NamedTuple):
+    """一页查询结果"""
+
+    items: List[Any]
+    next_cursor: Optional[str]
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """把排序键取值编码为不透明游标"""
+    payload = [
+        value if value is None or isinstance(value, (bool, int, float, str)) else str(value)
+        for value in values
+    ]
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, fields: Sequence[Field]) -> List[Any]:
+    """解析游标，并按排序字段还原取值类型"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("无效的分页游标") from None
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError("无效的分页游标")
+    return [
+        None if value is None else field.python_value(value)
+        for field, value in zip(fields, values)
+    ]
+
+
+def keyset_paginate(
+    query,
+    order_by: Sequence[Field],
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    *,
+    descending: bool = False,
+) -> KeysetPage:
+    """对查询做键集分页
+
+    Args:
+        query: 模型查询，结果为模型实例或 dicts()
+        order_by: 排序键字段，组合后必须唯一，例如 (created_at, id)
+        cursor: 上一页返回的 next_cursor，首页传 None
+        limit: 每页条数
+        descending: 是否按排序键降序
+
+    Returns:
+        KeysetPage: 当前页数据与下一页游标，没有更多数据时游标为 None
+    """
+    if limit <= 0:
+        raise ValueError("limit 必须为正数")
+    fields = list(order_by)
+    if not fields:
+        raise ValueError("order_by 不能为空")
+
+    if cursor:
+        values = decode_cursor(cursor, fields)
+        # 展开为 (a > x) OR (a = x AND b > y) ...，各数据库都能利用复合索引
+        condition = None
+        for i, field in enumerate(fields):
+            term = field < values[i] if descending else field > values[i]
+            for prev_field, prev_value in zip(fields[:i], values[:i]):
+                term = (prev_field == prev_value) & term
+            condition = term if condition is None else (condition | term)
+        if len(fields) > 1:
+            # 首列的范围条件让数据库直接从游标处开始扫描索引，OR 展开式本身无法据此定位
+            leading = fields[0] <= values[0] if descending else fields[0] >= values[0]
+            condition = leading & condition
+        query = query.where(condition)
+
+    ordering = [field.desc() if descending else field.asc() for field in fields]
+    rows = list(query.order_by(*ordering).limit(limit + 1))
+
+    if len(rows) <= limit:
+        return KeysetPage(rows, None)
+    rows = rows[:limit]
+    last = rows[-1]
+    if isinstance(last, dict):
+        values = [last[field.name] for field in fields]
+    else:
+        values = [getattr(last, field.name) for field in fields]
+    return KeysetPage(rows, encode_cursor(values))
+
+
+__all__ = [
+    "KeysetPage",
+    "encode_cursor",
+    "decode_cursor",
+    "keyset_paginate",
+]
@@ -0,0 +1,565 @@
+"""
+按月时间分区
+messages、llm_usage 等只增不改的大表按月拆分存储：
+SQLite 下每月一张 {table}_{YYYYMM} 分表，PostgreSQL 下使用原生声明式分区。
+新记录按时间写入所属分区，带时间范围的查询只扫描相关分区，
+清理历史数据时直接摘除整个分区，代替大批量 DELETE。
+
+SQLite 下原表改名为 {table}_legacy 保存存量数据，{table} 改为合并存量表与所有分区的
+视图，模型的默认查询、按主键读取与更新删除（经 INSTEAD OF 触发器）因此覆盖全部数据；
+各分区的 id 取自共享序列表 {table}_id_seq，全表唯一。
+"""
+
+import re
+import threading
+import time
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set
+
+from peewee import (
+    SQL,
+    CompositeKey,
+    Field,
+    IntegerField,
+    PostgresqlDatabase,
+    SqliteDatabase,
+)
+
+from .settings import settings
+
+# 其他进程可能新建分区，已知分区列表的缓存秒数
+_RESCAN_SECONDS = 60
+
+
+class MonthlyPartitioner:
+    """单个模型的按月分区路由
+
+    Args:
+        model: 分区的模型类
+        time_field: 分区依据的时间字段名
+        epoch: 时间字段是否为 Unix 时间戳（秒），否则为 datetime
+    """
+
+    def __init__(self, model, time_field: str, *, epoch: bool = False):
+        self.model = model
+        self.time_field = time_field
+        self.epoch = epoch
+        self._models: Dict[int, type] = {}
+        self._legacy_model = None
+        self._known: Optional[Set[int]] = None
+        self._has_legacy = False
+        self._scanned_at = 0.0
+        self._active: Optional[bool] = None
+        self._lock = threading.RLock()
+
+    @property
+    def database(self):
+        return self.model._meta.database
+
+    @property
+    def table_name(self) -> str:
+        return self.model._meta.table_name
+
+    @property
+    def legacy_table(self) -> str:
+        return f"{self.table_name}_legacy"
+
+    @property
+    def sequence_table(self) -> str:
+        return f"{self.table_name}_id_seq"
+
+    @property
+    def native(self) -> bool:
+        """是否使用数据库原生分区（PostgreSQL）"""
+        return isinstance(self.database, PostgresqlDatabase)
+
+    @property
+    def configured(self) -> bool:
+        """配置是否要求分区（TIME_PARTITIONING），仅支持 SQLite 与 PostgreSQL"""
+        return settings.time_partitioning and isinstance(
+            self.database, (SqliteDatabase, PostgresqlDatabase)
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """数据库中是否已建立分区结构
+
+        以库中的实际结构为准：已存在的普通表不会被当作分区表使用，
+        关闭配置后已建立的分区结构仍按分区方式读写。
+        """
+        if self._active is None:
+            self._active = self._detect()
+        return self._active
+
+    def _detect(self) -> bool:
+        if self.native:
+            cursor = self.database.execute_sql(
+                "SELECT 1 FROM pg_class WHERE relname = %s AND relkind = 'p'", (self.table_name,)
+            )
+        elif isinstance(self.database, SqliteDatabase):
+            cursor = self.database.execute_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?", (self.table_name,)
+            )
+        else:
+            return False
+        return cursor.fetchone() is not None
+
+    # ---- 分区键与边界 ----
+
+    def key_for(self, value) -> int:
+        """时间值所属分区的键，形如 202401"""
+        if self.epoch:
+            value = datetime.fromtimestamp(value, timezone.utc)
+        return value.year * 100 + value.month
+
+    def bounds(self, key: int):
+        """分区覆盖的时间范围 [lower, upper)，单位与时间字段一致"""
+        year, month = divmod(key, 100)
+        lower = datetime(year, month, 1)
+        upper = datetime(year + month // 12, month % 12 + 1, 1)
+        if self.epoch:
+            return (
+                lower.replace(tzinfo=timezone.utc).timestamp(),
+                upper.replace(tzinfo=timezone.utc).timestamp(),
+            )
+        return lower, upper
+
+    def partition_table(self, key: int) -> str:
+        return f"{self.table_name}_{key}"
+
+    # ---- 分区表管理 ----
+
+    def partition_model(self, key: int):
+        """绑定到指定分区表的模型子类，字段、索引与行为与原模型一致"""
+        with self._lock:
+            partition = self._models.get(key)
+            if partition is None:
+                partition = self._bound_model(self.partition_table(key), str(key))
+                self._models[key] = partition
+            return partition
+
+    def legacy_model(self):
+        """绑定到 SQLite 存量表 {table}_legacy 的模型子类"""
+        with self._lock:
+            if self._legacy_model is None:
+                self._legacy_model = self._bound_model(self.legacy_table, "legacy")
+            return self._legacy_model
+
+    def _bound_model(self, table_name: str, suffix: str):
+        meta = type("Meta", (), {"table_name": table_name})
+        return type(
+            f"{self.model.__name__}_{suffix}",
+            (self.model,),
+            {"Meta": meta, "__module__": self.model.__module__},
+        )
+
+    def existing_keys(self) -> List[int]:
+        """数据库中已存在的分区键，升序"""
+        with self._lock:
+            if self._known is None or time.monotonic() - self._scanned_at > _RESCAN_SECONDS:
+                self._rescan()
+            return sorted(self._known)
+
+    def _rescan(self):
+        if self.native:
+            cursor = self.database.execute_sql(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = %s",
+                (self.table_name,),
+            )
+            tables = [row[0] for row in cursor.fetchall()]
+        else:
+            tables = self.database.get_tables()
+        pattern = re.compile(rf"^{re.escape(self.table_name)}_(\d{{6}})$")
+        self._known = {int(m.group(1)) for m in map(pattern.match, tables) if m}
+        self._has_legacy = not self.native and self.legacy_table in tables
+        self._scanned_at = time.monotonic()
+
+    def create_parent(self):
+        """建立分区结构，可重复调用
+
+        PostgreSQL 下以 PARTITION BY RANGE 创建父表：分区表的主键与唯一索引必须包含分区列，
+        因此父表主键为 (id, 时间字段)，id 改由序列生成，唯一索引追加时间字段。
+        已存在的普通表不会被转换。
+
+        SQLite 下把已存在的原表改名为 {table}_legacy，创建共享 id 序列表、
+        当月分区与合并视图 {table}。
+        """
+        if self.native:
+            self._create_native_parent()
+        else:
+            self._create_view_layout()
+        with self._lock:
+            self._active = None
+            self._known = None
+
+    def _create_native_parent(self):
+        if self.model.table_exists():
+            if not self.enabled:
+                print(f"⚠️  {self.table_name} 已是普通表，不会转换为分区表")
+            return
+        indexes = tuple(
+            (tuple(columns) + (self.time_field,), True)
+            if unique and self.time_field not in columns
+            else (columns, unique)
+            for columns, unique in self.model._meta.indexes
+        )
+        meta = type(
+            "Meta",
+            (),
+            {
+                "table_name": self.table_name,
+                "primary_key": CompositeKey("id", self.time_field),
+                "indexes": indexes,
+                "table_settings": [f'PARTITION BY RANGE ("{self._column}")'],
+            },
+        )
+        parent = type(
+            f"{self.model.__name__}Parent",
+            (self.model,),
+            {
+                "Meta": meta,
+                "__module__": self.model.__module__,
+                "id": IntegerField(sequence=f"{self.table_name}_id_seq"),
+            },
+        )
+        parent.create_table(safe=True)
+
+    def _create_view_layout(self):
+        database = self.database
+        with database.atomic("IMMEDIATE"):
+            row = database.execute_sql(
+                "SELECT type FROM sqlite_master WHERE name = ?", (self.table_name,)
+            ).fetchone()
+            if row is not None and row[0] == "view":
+                return
+            if row is not None:
+                if database.table_exists(self.legacy_table):
+                    raise RuntimeError(f"{self.legacy_table} 已存在，无法转换 {self.table_name}")
+                # 不改写引用原表名的视图（如全文索引的内容视图），使其改为读取合并视图
+                database.execute_sql("PRAGMA legacy_alter_table = ON")
+                try:
+                    database.execute_sql(
+                        f'ALTER TABLE "{self.table_name}" RENAME TO "{self.legacy_table}"'
+                    )
+                finally:
+                    database.execute_sql("PRAGMA legacy_alter_table = OFF")
+            database.execute_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.sequence_table}" ("value" INTEGER NOT NULL)'
+            )
+            self._rescan()
+            for key in self._known:
+                self._create_sequence_trigger(key)
+            self._create_partition_table(self.key_for(self._now()))
+            self._create_view()
+            database.execute_sql(
+                f'INSERT INTO "{self.sequence_table}" ("value") '
+                f'SELECT COALESCE(MAX("id"), 0) FROM "{self.table_name}" '
+                f'WHERE NOT EXISTS (SELECT 1 FROM "{self.sequence_table}")'
+            )
+
+    def _now(self):
+        return time.time() if self.epoch else datetime.now()
+
+    def _create_partition_table(self, key: int):
+        self.partition_model(key).create_table(safe=True)
+        self._create_sequence_trigger(key)
+
+    def _create_sequence_trigger(self, key: int):
+        # 任何写入分区的 id（含显式指定的）都推进共享序列
+        table = self.partition_table(key)
+        self.database.execute_sql(
+            f'CREATE TRIGGER IF NOT EXISTS "{table}_id_seq" AFTER INSERT ON "{table}" BEGIN '
+            f'UPDATE "{self.sequence_table}" SET "value" = NEW."id" WHERE "value" < NEW."id"; END'
+        )
+
+    def _create_view(self):
+        """按库中现有的存量表与分区重建合并视图及其更新、删除触发器"""
+        self._rescan()
+        if not self._known and not self._has_legacy:
+            self._create_partition_table(self.key_for(self._now()))
+            self._rescan()
+        tables = ([self.legacy_table] if self._has_legacy else []) + [
+            self.partition_table(key) for key in sorted(self._known)
+        ]
+        columns = [field.column_name for field in self.model._meta.sorted_fields]
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        body = " UNION ALL ".join(f'SELECT {column_list} FROM "{table}"' for table in tables)
+        assignments = ", ".join(f'"{column}" = NEW."{column}"' for column in columns)
+        pk = self.model._meta.primary_key.column_name
+        updates = "".join(
+            f'UPDATE "{table}" SET {assignments} WHERE "{pk}" = OLD."{pk}"; ' for table in tables
+        )
+        deletes = "".join(f'DELETE FROM "{table}" WHERE "{pk}" = OLD."{pk}"; ' for table in tables)
+        database = self.database
+        database.execute_sql(f'DROP VIEW IF EXISTS "{self.table_name}"')
+        database.execute_sql(f'CREATE VIEW "{self.table_name}" AS {body}')
+        database.execute_sql(
+            f'CREATE TRIGGER "{self.table_name}_update" INSTEAD OF UPDATE ON "{self.table_name}" '
+            f"BEGIN {updates}END"
+        )
+        database.execute_sql(
+            f'CREATE TRIGGER "{self.table_name}_delete" INSTEAD OF DELETE ON "{self.table_name}" '
+            f"BEGIN {deletes}END"
+        )
+
+    def ensure_partition(self, key: int):
+        """确保分区存在，返回写入该分区应使用的模型"""
+        if key not in self.existing_keys():
+            with self._lock:
+                self._rescan()
+                if key not in self._known:
+                    self._create_partition(key)
+                    self._known.add(key)
+        return self.model if self.native else self.partition_model(key)
+
+    def _create_partition(self, key: int):
+        if self.native:
+            lower, upper = self.bounds(key)
+            self.database.execute_sql(
+                f'CREATE TABLE IF NOT EXISTS "{self.partition_table(key)}" '
+                f'PARTITION OF "{self.table_name}" FOR VALUES FROM (%s) TO (%s)',
+                (lower, upper),
+            )
+        else:
+            with self.database.atomic():
+                self._create_partition_table(key)
+                self._create_view()
+
+    def drop_partition(self, key: int) -> bool:
+        """摘除并删除一个分区，返回分区是否存在"""
+        if key not in self.existing_keys():
+            return False
+        table = self.partition_table(key)
+        with self._lock, self.database.atomic():
+            if self.native:
+                self.database.execute_sql(
+                    f'ALTER TABLE "{self.table_name}" DETACH PARTITION "{table}"'
+                )
+            self.database.execute_sql(f'DROP TABLE IF EXISTS "{table}"')
+            if not self.native:
+                self._create_view()
+            self._known.discard(key)
+            self._models.pop(key, None)
+        return True
+
+    def drop_partitions_before(self, cutoff) -> List[str]:
+        """删除完全早于 cutoff 的分区，返回被删除的分区表名
+
+        SQLite 下存量表中的数据不受影响，需另行清理。
+        """
+        dropped = []
+        for key in self.existing_keys():
+            if self.bounds(key)[1] <= cutoff and self.drop_partition(key):
+                dropped.append(self.partition_table(key))
+        return dropped
+
+    # ---- 路由 ----
+
+    def route(self, value):
+        """写入时间为 value 的记录应使用的模型，按需创建分区"""
+        return self.ensure_partition(self.key_for(value))
+
+    def models_for_range(self, start=None, end=None) -> List[type]:
+        """覆盖 [start, end) 的模型，按时间从新到旧排列
+
+        SQLite 下跳过范围外的分区，存量表总是排在最后；
+        PostgreSQL 下直接返回父表，由查询规划器裁剪分区。
+        """
+        if not self.enabled or self.native:
+            return [self.model]
+        low = self.key_for(start) if start is not None else None
+        high = self.key_for(end) if end is not None else None
+        models = [
+            self.partition_model(key)
+            for key in reversed(self.existing_keys())
+            if (low is None or key >= low) and (high is None or key <= high)
+        ]
+        if self._has_legacy:
+            models.append(self.legacy_model())
+        return models
+
+    def select_range(self, start=None, end=None, build: Callable = None):
+        """查询 [start, end) 内的记录
+
+        Args:
+            start: 起始时间（含），None 表示不限
+            end: 结束时间（不含），None 表示不限
+            build: 接收模型类、返回该模型查询的函数，用于追加过滤条件或选择列；
+                默认 model.select()
+
+        Returns:
+            单个查询，或多个分区查询的 UNION ALL
+        """
+        query = None
+        for model in self.models_for_range(start, end):
+            part = build(model) if build else model.select()
+            field = getattr(model, self.time_field)
+            if start is not None:
+                part = part.where(field >= start)
+            if end is not None:
+                part = part.where(field < end)
+            query = part if query is None else (query + part)
+        return query
+
+    # ---- 写入 ----
+
+    def route_rows(self, model, rows: List[dict]) -> Dict[type, List[dict]]:
+        """按写入模型分组待写入的行（以字段名为键），按需创建分区"""
+        groups: Dict[type, List[dict]] = {}
+        for row in rows:
+            target = model
+            if model is self.model:
+                value = row.get(self.time_field)
+                if value is None:
+                    raise ValueError(f"写入分区表 {self.table_name} 时必须提供 {self.time_field}")
+                target = self.route(value)
+            groups.setdefault(target, []).append(row)
+        return groups
+
+    def next_id(self):
+        """单行写入时的 id 表达式：取共享序列的下一个值，写入后由分区触发器推进序列"""
+        return SQL(f'(SELECT "value" + 1 FROM "{self.sequence_table}")')
+
+    def assign_ids(self, rows: List[dict]):
+        """为缺少 id 的行从共享序列预留连续的 id，需在写入的事务中调用"""
+        pk = self.model._meta.primary_key.name
+        missing = [row for row in rows if row.get(pk) is None]
+        if not missing:
+            return
+        self.database.execute_sql(
+            f'UPDATE "{self.sequence_table}" SET "value" = "value" + ?', (len(missing),)
+        )
+        last = self.database.execute_sql(
+            f'SELECT "value" FROM "{self.sequence_table}"'
+        ).fetchone()[0]
+        for offset, row in enumerate(missing, start=last - len(missing) + 1):
+            row[pk] = offset
+
+    @property
+    def _column(self) -> str:
+        return getattr(self.model, self.time_field).column_name
+
+
+def _row_by_name(model, row) -> dict:
+    fields = model._meta.combined
+    return {
+        (key if isinstance(key, Field) else fields[key]).name: value for key, value in row.items()
+    }
+
+
+class _RoutedInsert:
+    """按分区拆分的 insert_many，执行时在一个事务内依次写入各分区
+
+    支持 on_conflict* / returning / as_rowcount 链式调用，应用到每个分区的语句上。
+    """
+
+    _CHAINABLE = ("on_conflict", "on_conflict_ignore", "on_conflict_replace", "returning", "as_rowcount")
+
+    def __init__(self, partitioner: MonthlyPartitioner, groups: Dict[type, List[dict]]):
+        self.partitioner = partitioner
+        self.groups = groups
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name not in self._CHAINABLE:
+            raise AttributeError(name)
+
+        def chain(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+
+        return chain
+
+    def execute(self, database=None):
+        database = database or self.partitioner.database
+        results = []
+        with database.atomic():
+            self.partitioner.assign_ids([row for rows in self.groups.values() for row in rows])
+            for model, rows in self.groups.items():
+                query = super(PartitionRoutingMixin, model).insert_many(rows)
+                for name, args, kwargs in self._calls:
+                    query = getattr(query, name)(*args, **kwargs)
+                results.append(query.execute(database))
+        if any(name == "returning" for name, _, _ in self._calls):
+            return [row for result in results for row in result]
+        if any(name == "as_rowcount" for name, _, _ in self._calls):
+            return sum(results)
+        return results[-1] if results else None
+
+
+class PartitionRoutingMixin:
+    """分区模型混入：新记录按时间写入所属分区
+
+    模型类需设置 partitioner 属性；未建立分区结构时行为与普通模型一致。
+    save()/create()/insert()/insert_many() 均按时间路由并按需创建分区，
+    save() 写入后实例的类型切换为对应分区的模型子类，后续更新写回同一分区。
+    """
+
+    partitioner: Optional[MonthlyPartitioner] = None
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        """配置了分区时由分区器建立分区结构，不再按普通表建表与建索引"""
+        partitioner = cls.partitioner
+        if partitioner is not None and cls is partitioner.model and partitioner.configured:
+            partitioner.create_parent()
+            if partitioner.enabled:
+                return
+        super().create_table(safe=safe, **options)
+
+    def save(self, force_insert=False, only=None):
+        partitioner = type(self).partitioner
+        if (
+            partitioner is not None
+            and type(self) is partitioner.model
+            and (force_insert or self._pk is None)
+            and partitioner.enabled
+        ):
+            value = getattr(self, partitioner.time_field)
+            if value is not None:
+                self.__class__ = partitioner.route(value)
+        return super().save(force_insert=force_insert, only=only)
+
+    @classmethod
+    def insert(cls, __data=None, **insert):
+        partitioner = cls.partitioner
+        if partitioner is None or not partitioner.enabled:
+            return super().insert(__data, **insert)
+        data = cls._normalize_data(__data, insert)
+        if not isinstance(data, Mapping):
+            raise ValueError(f"写入分区表 {partitioner.table_name} 时必须按字段提供数据")
+        row = _row_by_name(cls, data)
+        ((target, _),) = partitioner.route_rows(cls, [row]).items()
+        if not partitioner.native and row.get("id") is None:
+            row["id"] = partitioner.next_id()
+        return super(PartitionRoutingMixin, target).insert(row)
+
+    @classmethod
+    def insert_many(cls, rows, fields=None):
+        partitioner = cls.partitioner
+        if partitioner is None or not partitioner.enabled:
+            return super().insert_many(rows, fields)
+        if fields is not None:
+            names = [field if isinstance(field, str) else field.name for field in fields]
+        else:
+            defaults = cls._meta.sorted_fields
+            names = [field.name for field in (defaults[1:] if cls._meta.auto_increment else defaults)]
+        rows = [
+            _row_by_name(cls, row) if isinstance(row, Mapping) else dict(zip(names, row))
+            for row in rows
+        ]
+        groups = partitioner.route_rows(cls, rows)
+        if partitioner.native:
+            # 原生分区由数据库路由，只需确保各月分区已存在
+            return super().insert_many(rows)
+        return _RoutedInsert(partitioner, groups)
+
+
+__all__ = [
+    "MonthlyPartitioner",
+    "PartitionRoutingMixin",
+]
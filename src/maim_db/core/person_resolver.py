@@ -0,0 +1,150 @@
+"""
+人物信息解析
+每条入站消息都要按 (platform, user_id) 找到发送者的 person_info 记录。本模块按
+(agent_id, platform, user_id) 缓存查找结果（包括"不存在"），命中时不访问数据库；
+认识次数 know_times 与最近认识时间 last_know 通过计数器缓冲批量写入，不再每条消息写一次库。
+
+- 经 save()/delete_instance() 的写入（如修改昵称、印象）通过写入回调同步到缓存
+- 缓存条目在 ttl 秒后重新加载，know_times/last_know 的缓存值最多滞后 ttl 秒
+- 人物记录的 platform 与 user_id 创建后不应修改
+
+insert_many、update() 等批量语句不经过写入回调，之后需调用 clear()。
+"""
+
+import threading
+import time
+from typing import Optional, Tuple
+
+from .context_manager import get_current_agent_id
+from .counters import CounterBuffer, counter_buffer
+from .lru import LRUCache
+from .models.maimbot_models import PersonInfo
+from .settings import settings
+
+
+class PersonResolver:
+    """(agent_id, platform, user_id) → PersonInfo 的读穿透缓存
+
+    Args:
+        max_entries: 缓存条目上限（含不存在的结果），默认 settings.person_cache_max_entries
+        ttl: 条目缓存秒数，默认 settings.person_cache_ttl
+        counters: know_times 所用的计数器缓冲，默认全局 counter_buffer
+    """
+
+    def __init__(self, *, max_entries: int = None, ttl: float = None, counters: CounterBuffer = None):
+        self._entries = LRUCache(settings.person_cache_max_entries if max_entries is None else max_entries)
+        self.ttl = settings.person_cache_ttl if ttl is None else ttl
+        self.counters = counter_buffer if counters is None else counters
+        self.counters.register(PersonInfo.know_times)
+        # 正在加载的键，值表示加载期间是否有写入
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._enabled = False
+
+    def enable(self):
+        """开始随 PersonInfo 写入维护缓存，可重复调用；resolve 会自动启用"""
+        if self._enabled:
+            return
+        PersonInfo.add_listener("post_save", self._on_post_save)
+        PersonInfo.add_listener("pre_delete", self._on_pre_delete)
+        self._enabled = True
+
+    def disable(self):
+        PersonInfo.remove_listener("post_save", self._on_post_save)
+        PersonInfo.remove_listener("pre_delete", self._on_pre_delete)
+        self._enabled = False
+        self.clear()
+
+    def clear(self):
+        self._entries.clear()
+
+    # ---- 查询 ----
+
+    def resolve(self, platform: str, user_id: str, *, agent_id: str = None) -> Optional[PersonInfo]:
+        """返回 Agent 中该平台用户的人物记录，不存在时返回 None
+
+        返回的记录由缓存共享，修改后需通过 update() 或 save() 写回。
+        """
+        self.enable()
+        key = self._key(agent_id, platform, user_id)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        with self._lock:
+            self._loading[key] = False
+        try:
+            person = (
+                PersonInfo.select_unscoped()
+                .where(
+                    (PersonInfo.agent_id == key[0])
+                    & (PersonInfo.platform == platform)
+                    & (PersonInfo.user_id == user_id)
+                )
+                .first()
+            )
+        except BaseException:
+            with self._lock:
+                self._loading.pop(key, None)
+            raise
+        with self._lock:
+            # 加载期间有写入时结果可能已过期（如刚创建的记录被缓存为不存在），本次不缓存
+            if not self._loading.pop(key, True):
+                self._entries.put(key, (person, now + self.ttl))
+        return person
+
+    # ---- 写入 ----
+
+    def update(self, person: PersonInfo, **fields) -> PersonInfo:
+        """只写回给定字段（如 nickname、memory_points）并更新缓存
+
+        只保存给定字段，不会用缓存中可能滞后的 know_times/last_know 覆盖库中的值。
+        """
+        if not fields:
+            return person
+        for name, value in fields.items():
+            setattr(person, name, value)
+        person.save(only=[PersonInfo._meta.fields[name] for name in fields])
+        return person
+
+    def record_interaction(self, person: PersonInfo, now: float = None):
+        """记录一次交互：know_times 加一、last_know 取最新时间，由计数器缓冲批量写入"""
+        now = time.time() if now is None else now
+        self.counters.increment(PersonInfo.know_times, person.id, touch={PersonInfo.last_know: now})
+
+    @staticmethod
+    def _key(agent_id, platform, user_id) -> Tuple[str, str, str]:
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("查找人物信息时必须设置 agent_id")
+        return agent_id, platform, user_id
+
+    def _on_post_save(self, person, created):
+        key = (person.agent_id, person.platform, person.user_id)
+        with self._lock:
+            if key in self._loading:
+                self._loading[key] = True
+            self._entries.put(key, (person, time.monotonic() + self.ttl))
+
+    def _on_pre_delete(self, person):
+        key = (person.agent_id, person.platform, person.user_id)
+        with self._lock:
+            if key in self._loading:
+                self._loading[key] = True
+            self._entries.pop(key)
+
+
+# 全局人物信息缓存
+person_resolver = PersonResolver()
+
+
+def resolve_person(platform: str, user_id: str, *, agent_id: str = None) -> Optional[PersonInfo]:
+    """按平台用户查找当前 Agent 的人物记录，见 PersonResolver.resolve"""
+    return person_resolver.resolve(platform, user_id, agent_id=agent_id)
+
+
+__all__ = [
+    "PersonResolver",
+    "person_resolver",
+    "resolve_person",
+]
@@ -0,0 +1,309 @@
+"""
+感知哈希近似去重索引
+重新编码、缩放过的表情包 emoji_hash 不同，但 64 位 pHash 的汉明距离很小。每个 Agent
+在内存中维护一棵 BK 树，按汉明距离查找已登记的相似图片，命中且已有描述时可跳过 VLM 识别。
+
+- 首次查询某个 Agent 时从数据库加载该 Agent 所有带 perceptual_hash 的记录
+- 之后通过写入回调随 save()/delete_instance() 增量维护
+- pHash 由调用方计算，以 16 位十六进制字符串写入 perceptual_hash 字段
+
+insert_many 等批量写入不经过写入回调，批量导入后需调用 forget_agent() 或 clear()。
+"""
+
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from .context_manager import get_current_agent_id
+from .lru import LRUCache
+from .models.maimbot_models import Emoji, Images
+
+DEFAULT_MAX_DISTANCE = 6
+HASH_BITS = 64
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+
+    def _popcount(value: int) -> int:
+        return bin(value).count("1")
+
+
+def parse_hash(value: Union[int, str]) -> int:
+    """把十六进制字符串或整数形式的 pHash 统一为整数"""
+    if isinstance(value, int):
+        number = value
+    else:
+        try:
+            number = int(value, 16)
+        except (TypeError, ValueError):
+            raise ValueError(f"无效的感知哈希: {value!r}") from None
+    if not 0 <= number < (1 << HASH_BITS):
+        raise ValueError(f"感知哈希超出 {HASH_BITS} 位: {value!r}")
+    return number
+
+
+def format_hash(value: Union[int, str]) -> str:
+    """格式化为写入 perceptual_hash 字段的 16 位十六进制字符串"""
+    return f"{parse_hash(value):016x}"
+
+
+def hamming(a: int, b: int) -> int:
+    return _popcount(a ^ b)
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树，节点为 [哈希, 记录ID集合, {距离: 子节点}]
+
+    删除只从节点移除记录ID，空节点保留用于路由；空节点过多时整体重建。
+    """
+
+    def __init__(self):
+        self._root: Optional[list] = None
+        self._nodes: Dict[int, list] = {}
+        self._hashes: Dict[int, int] = {}
+        self._empty = 0
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, item_id: int, value: int):
+        current = self._hashes.get(item_id)
+        if current == value:
+            return
+        if current is not None:
+            self.remove(item_id)
+        self._hashes[item_id] = value
+        node = self._nodes.get(value)
+        if node is not None:
+            if not node[1]:
+                self._empty -= 1
+            node[1].add(item_id)
+            return
+        node = self._nodes[value] = [value, {item_id}, {}]
+        if self._root is None:
+            self._root = node
+            return
+        parent = self._root
+        while True:
+            distance = hamming(value, parent[0])
+            child = parent[2].get(distance)
+            if child is None:
+                parent[2][distance] = node
+                return
+            parent = child
+
+    def remove(self, item_id: int):
+        value = self._hashes.pop(item_id, None)
+        if value is None:
+            return
+        node = self._nodes[value]
+        node[1].discard(item_id)
+        if not node[1]:
+            self._empty += 1
+            if self._empty > 1024 and self._empty * 2 > len(self._nodes):
+                self._rebuild()
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """返回距离不超过 max_distance 的 (距离, 记录ID)，按距离升序"""
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, item_id) for item_id in node[1])
+            # 三角不等式：只有与当前节点距离在 [d - r, d + r] 内的子树可能命中
+            low, high = distance - max_distance, distance + max_distance
+            for edge, child in node[2].items():
+                if low <= edge <= high:
+                    stack.append(child)
+        matches.sort()
+        return matches
+
+    def _rebuild(self):
+        hashes = self._hashes
+        self._root, self._nodes, self._hashes, self._empty = None, {}, {}, 0
+        for item_id, value in hashes.items():
+            self.add(item_id, value)
+
+
+class SimilarMatch(NamedTuple):
+    """近似匹配结果"""
+
+    item: object
+    distance: int
+
+
+class PerceptualHashIndex:
+    """模型 perceptual_hash 字段的按 Agent 近似索引
+
+    Args:
+        model: 带 perceptual_hash 字段的业务模型
+        max_agents: 同时保留索引的 Agent 数，按最近使用淘汰
+    """
+
+    def __init__(self, model, *, max_agents: int = 256):
+        self.model = model
+        self._trees = LRUCache(max_agents)
+        # 正在加载的 Agent，值表示加载期间是否有写入
+        self._loading: Dict[str, bool] = {}
+        self._lock = threading.RLock()
+        self._enabled = False
+
+    def enable(self):
+        """开始随模型写入维护索引，可重复调用"""
+        if self._enabled:
+            return
+        self.model.add_listener("post_save", self._on_post_save)
+        self.model.add_listener("pre_delete", self._on_pre_delete)
+        self._enabled = True
+
+    def disable(self):
+        self.model.remove_listener("post_save", self._on_post_save)
+        self.model.remove_listener("pre_delete", self._on_pre_delete)
+        self._enabled = False
+        self.clear()
+
+    def forget_agent(self, agent_id: str):
+        with self._lock:
+            self._trees.pop(agent_id)
+
+    def clear(self):
+        with self._lock:
+            self._trees.clear()
+
+    # ---- 查询 ----
+
+    def find_similar(
+        self,
+        value: Union[int, str],
+        max_distance: int = DEFAULT_MAX_DISTANCE,
+        *,
+        agent_id: str = None,
+        limit: int = None,
+    ) -> List[SimilarMatch]:
+        """查找 pHash 汉明距离不超过 max_distance 的记录，按距离升序
+
+        Args:
+            value: pHash，整数或十六进制字符串
+            max_distance: 最大汉明距离（0-64）
+            agent_id: 未指定时使用当前上下文中的 agent_id
+            limit: 最多返回条数，None 表示不限
+        """
+        if not 0 <= max_distance <= HASH_BITS:
+            raise ValueError(f"max_distance 必须在 0 到 {HASH_BITS} 之间")
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("查询相似图片时必须设置 agent_id")
+        value = parse_hash(value)
+        tree = self._tree(agent_id)
+        with self._lock:
+            matches = tree.search(value, max_distance)
+        if limit is not None:
+            matches = matches[:limit]
+        if not matches:
+            return []
+        model = self.model
+        ids = [item_id for _, item_id in matches]
+        items = {
+            item.id: item
+            for item in model.select_unscoped().where((model.agent_id == agent_id) & model.id.in_(ids))
+        }
+        return [
+            SimilarMatch(items[item_id], distance)
+            for distance, item_id in matches
+            if item_id in items
+        ]
+
+    def reusable_description(
+        self,
+        value: Union[int, str],
+        max_distance: int = DEFAULT_MAX_DISTANCE,
+        *,
+        agent_id: str = None,
+    ) -> Optional[SimilarMatch]:
+        """最相近且已有描述的记录，存在时可直接复用其描述而不调用 VLM"""
+        for match in self.find_similar(value, max_distance, agent_id=agent_id):
+            if match.item.description:
+                return match
+        return None
+
+    # ---- 加载与维护 ----
+
+    def _tree(self, agent_id: str) -> BKTree:
+        with self._lock:
+            tree = self._trees.get(agent_id)
+            if tree is not None:
+                return tree
+            self._loading[agent_id] = False
+        model = self.model
+        tree = BKTree()
+        try:
+            rows = (
+                model.select_unscoped(model.id, model.perceptual_hash)
+                .where((model.agent_id == agent_id) & model.perceptual_hash.is_null(False))
+                .tuples()
+            )
+            for item_id, value in rows.iterator():
+                try:
+                    tree.add(item_id, parse_hash(value))
+                except ValueError:
+                    continue
+        except BaseException:
+            with self._lock:
+                self._loading.pop(agent_id, None)
+            raise
+        with self._lock:
+            # 加载期间有写入时结果可能已过期，本次不缓存
+            if not self._loading.pop(agent_id, True):
+                self._trees.put(agent_id, tree)
+        return tree
+
+    def _on_post_save(self, item, created):
+        with self._lock:
+            if item.agent_id in self._loading:
+                self._loading[item.agent_id] = True
+            tree = self._trees.get(item.agent_id)
+            if tree is None:
+                return
+            try:
+                value = parse_hash(item.perceptual_hash) if item.perceptual_hash else None
+            except ValueError:
+                value = None
+            if value is None:
+                tree.remove(item.id)
+            else:
+                tree.add(item.id, value)
+
+    def _on_pre_delete(self, item):
+        with self._lock:
+            if item.agent_id in self._loading:
+                self._loading[item.agent_id] = True
+            tree = self._trees.get(item.agent_id)
+            if tree is not None:
+                tree.remove(item.id)
+
+
+# 全局索引
+emoji_phash_index = PerceptualHashIndex(Emoji)
+image_phash_index = PerceptualHashIndex(Images)
+
+
+def enable_phash_indexes():
+    """启用表情包与图片的感知哈希索引"""
+    emoji_phash_index.enable()
+    image_phash_index.enable()
+
+
+__all__ = [
+    "BKTree",
+    "SimilarMatch",
+    "PerceptualHashIndex",
+    "emoji_phash_index",
+    "image_phash_index",
+    "enable_phash_indexes",
+    "format_hash",
+    "parse_hash",
+]
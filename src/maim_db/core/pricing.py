@@ -0,0 +1,256 @@
+"""
+模型计价
+缓存每个 Agent 的模型价格表 (model_info_configs 的 price_in/price_out，单位为每百万 token)，
+调用方记录 LLMUsage 时不必再逐次查询价格。
+
+- AgentConfigManager 更新模型配置后调用 invalidate() 使该 Agent 的价格表失效
+- 其他进程修改的价格不会触发本进程的 invalidate()，价格表缓存 ttl 秒后重新加载
+- 价格变化后可用 reprice_usage() 按主键分段重算历史 llm_usage.cost，并重算用量汇总
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from peewee import Case, Value, fn
+
+from .background import run_sync
+from .lru import LRUCache
+from .models.agent_config import ModelInfoModel
+from .models.maimbot_models import LLMUsage
+from .settings import settings
+from .usage_rollup import usage_rollup
+
+TOKENS_PER_PRICE_UNIT = 1_000_000
+
+
+class ModelPrice(NamedTuple):
+    """模型价格，price_in/price_out 为每百万 token 的价格"""
+
+    name: str
+    model_identifier: str
+    price_in: float
+    price_out: float
+    provider: str
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (
+            (prompt_tokens or 0) * self.price_in + (completion_tokens or 0) * self.price_out
+        ) / TOKENS_PER_PRICE_UNIT
+
+
+class _PriceTable:
+    """一个 Agent 的全部模型价格，按模型代号与实际模型ID两种方式索引"""
+
+    __slots__ = ("by_name", "by_identifier")
+
+    def __init__(self, prices: List[ModelPrice]):
+        self.by_name = {price.name: price for price in prices}
+        self.by_identifier: Dict[str, ModelPrice] = {}
+        for price in prices:
+            self.by_identifier.setdefault(price.model_identifier, price)
+
+
+class PricingResolver:
+    """(agent_id, model_name) → 价格 的进程内缓存
+
+    model_name 先按模型代号（LLMUsage.model_assign_name）匹配，再按实际模型ID
+    （LLMUsage.model_name）匹配。每个 Agent 的价格表一次查询整体加载。
+
+    Args:
+        max_agents: 同时缓存价格表的 Agent 数，按最近使用淘汰
+        ttl: 价格表缓存秒数，默认 settings.pricing_cache_ttl
+    """
+
+    def __init__(self, max_agents: int = 1024, *, ttl: float = None):
+        self._tables = LRUCache(max_agents)
+        self.ttl = settings.pricing_cache_ttl if ttl is None else ttl
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, agent_id: str, model_name: str) -> Optional[ModelPrice]:
+        """返回模型价格，未配置该模型时返回 None"""
+        table = self._table(agent_id)
+        return table.by_name.get(model_name) or table.by_identifier.get(model_name)
+
+    def compute_cost(
+        self,
+        agent_id: str,
+        model_name: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+    ) -> float:
+        """按当前价格计算一次调用的成本，未配置价格的模型记为 0"""
+        price = self.resolve(agent_id, model_name)
+        if price is None:
+            return 0.0
+        return price.cost(prompt_tokens, completion_tokens)
+
+    def invalidate(self, agent_id: str = None):
+        """丢弃 Agent 的价格表，agent_id 为 None 时清空全部"""
+        with self._lock:
+            self._generation += 1
+            if agent_id is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(agent_id)
+
+    def _table(self, agent_id: str) -> _PriceTable:
+        entry = self._tables.get(agent_id)
+        now = time.monotonic()
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        with self._lock:
+            generation = self._generation
+        table = _PriceTable(load_prices(agent_id))
+        with self._lock:
+            # 加载期间价格被修改时本次结果不缓存
+            if generation == self._generation:
+                self._tables.put(agent_id, (table, now + self.ttl))
+        return table
+
+
+def load_prices(agent_id: str) -> List[ModelPrice]:
+    """从 model_info_configs 读取 Agent 的全部模型价格"""
+    query = ModelInfoModel.select(
+        ModelInfoModel.name,
+        ModelInfoModel.model_identifier,
+        ModelInfoModel.price_in,
+        ModelInfoModel.price_out,
+        ModelInfoModel.provider_name,
+    ).where(ModelInfoModel.agent_id == agent_id)
+    return [
+        ModelPrice(name, identifier, price_in or 0.0, price_out or 0.0, provider)
+        for name, identifier, price_in, price_out, provider in query.tuples()
+    ]
+
+
+# ---- 历史用量重算 ----
+
+
+def _usage_match(model, price: ModelPrice):
+    """匹配按该价格计费的用量记录：优先按模型代号，无代号的旧记录按实际模型ID"""
+    return (model.model_assign_name == price.name) | (
+        model.model_assign_name.is_null() & (model.model_name == price.model_identifier)
+    )
+
+
+def _repriced_cost(model, prices: List[ModelPrice]):
+    """按匹配到的价格计算成本的 CASE 表达式，及匹配任一价格的条件"""
+    cases = []
+    for price in prices:
+        # 单价不经字段转换传入，否则会按 IntegerField 取整并在 SQLite 上做整数除法
+        cost = model.prompt_tokens * Value(
+            price.price_in / TOKENS_PER_PRICE_UNIT, converter=False
+        ) + model.completion_tokens * Value(price.price_out / TOKENS_PER_PRICE_UNIT, converter=False)
+        cases.append((_usage_match(model, price), cost))
+    matched = model.model_assign_name.in_([price.name for price in prices]) | (
+        model.model_assign_name.is_null()
+        & model.model_name.in_([price.model_identifier for price in prices])
+    )
+    return Case(None, cases, model.cost), matched
+
+
+def _reprice_batches(
+    agent_id: str,
+    model_names: Optional[List[str]],
+    start: datetime,
+    end: datetime,
+    batch_size: int,
+) -> Iterator:
+    """生成重算批次，每个批次是一个执行一条 UPDATE 并返回更新行数的函数"""
+    prices = load_prices(agent_id)
+    if model_names is not None:
+        prices = [price for price in prices if price.name in model_names]
+    if not prices:
+        return
+    for model in LLMUsage.partitioner.models_for_range(start, end):
+        scope = model.agent_id == agent_id
+        if start is not None:
+            scope &= model.timestamp >= start
+        if end is not None:
+            scope &= model.timestamp < end
+        low, high = model.select_unscoped(fn.MIN(model.id), fn.MAX(model.id)).where(scope).scalar(
+            as_tuple=True
+        )
+        if low is None:
+            continue
+        # 每段一条 UPDATE，按 CASE 为各行选择对应的价格
+        new_cost, matched = _repriced_cost(model, prices)
+        for offset in range(low, high + 1, batch_size):
+            query = model.update(cost=new_cost).where(
+                scope & matched & (model.id >= offset) & (model.id < offset + batch_size)
+            )
+            yield query.execute
+
+
+def reprice_usage(
+    agent_id: str,
+    *,
+    model_names: List[str] = None,
+    start: datetime = None,
+    end: datetime = None,
+    batch_size: int = 5000,
+    rebuild_rollups: bool = True,
+) -> int:
+    """按当前价格重算 Agent 在 [start, end) 内的 llm_usage.cost
+
+    按主键区间分段执行 UPDATE，每段是一个独立的短事务，不会长时间锁表；
+    成本完全在数据库内计算，不读取明细行。
+
+    Args:
+        agent_id: Agent ID
+        model_names: 只重算这些模型代号，None 表示全部已配置价格的模型
+        start: 起始时间（含），None 表示不限
+        end: 结束时间（不含），None 表示不限
+        batch_size: 每段覆盖的主键区间长度
+        rebuild_rollups: 完成后重算该区间的用量汇总表
+
+    Returns:
+        更新的行数
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size 必须为正数")
+    updated = 0
+    for batch in _reprice_batches(agent_id, model_names, start, end, batch_size):
+        updated += batch()
+    if rebuild_rollups and updated:
+        usage_rollup.rebuild(start, end, agent_id=agent_id)
+    return updated
+
+
+async def areprice_usage(
+    agent_id: str,
+    *,
+    model_names: List[str] = None,
+    start: datetime = None,
+    end: datetime = None,
+    batch_size: int = 5000,
+    rebuild_rollups: bool = True,
+) -> int:
+    """reprice_usage 的异步版本，每段在线程池中执行并在段之间让出事件循环"""
+    if batch_size <= 0:
+        raise ValueError("batch_size 必须为正数")
+    batches = await run_sync(lambda: list(_reprice_batches(agent_id, model_names, start, end, batch_size)))
+    updated = 0
+    for batch in batches:
+        updated += await run_sync(batch)
+        await asyncio.sleep(0)
+    if rebuild_rollups and updated:
+        await run_sync(usage_rollup.rebuild, start, end, agent_id=agent_id)
+    return updated
+
+
+# 全局价格缓存
+pricing_resolver = PricingResolver()
+
+
+__all__ = [
+    "ModelPrice",
+    "PricingResolver",
+    "pricing_resolver",
+    "reprice_usage",
+    "areprice_usage",
+]
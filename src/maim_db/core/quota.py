@@ -0,0 +1,529 @@
+"""
+租户与 Agent 配额
+在每次 LLM 调用前按滑动窗口检查 token 与成本预算，请求路径上只做内存运算。
+
+- 每个作用域（租户或 Agent）在内存中维护按小时分桶的窗口，首次使用时从
+  quota_counters 与 llm_usage_hourly 汇总表加载
+- check_and_reserve() 预留额度，调用结束后 commit() 按实际用量入账或 release() 归还
+- 已提交用量由 QuotaFlushWorker 定期累加到 quota_counters
+- reconcile_agent() / reconcile_tenant() 以 llm_usage 明细为准校正窗口
+
+多进程部署时各进程只看到自己提交的增量，需定期调用 reconcile_* 对齐。
+窗口按 UTC 划分小时桶（不带时区的 datetime），llm_usage.timestamp 需按 UTC 写入；
+current_time 参数同样为 UTC。
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from peewee import fn
+
+from .background import PeriodicWorker, run_sync
+from .database import conflict_target, excluded
+from .models.maimbot_models import LLMUsageHourly
+from .models.system_v2 import Agent, QuotaCounter
+from .settings import settings
+from .usage_rollup import HOUR, truncate, usage_rollup
+
+SCOPE_TENANT = "tenant"
+SCOPE_AGENT = "agent"
+
+
+def _utcnow() -> datetime:
+    """当前 UTC 时间，去掉时区信息以便与数据库中的 DateTimeField 比较"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class QuotaLimit(NamedTuple):
+    """窗口内的预算上限，None 表示不限"""
+
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+
+
+class Reservation(NamedTuple):
+    """一次预留，commit() 或 release() 前占用额度"""
+
+    id: str
+    agent_id: str
+    tenant_id: Optional[str]
+    tokens: int
+    cost: float
+    expires_at: float
+
+
+class QuotaExceededError(Exception):
+    """预留会使某个作用域超出预算"""
+
+    def __init__(self, scope: str, scope_id: str, limit: QuotaLimit, tokens: int, cost: float):
+        self.scope = scope
+        self.scope_id = scope_id
+        self.limit = limit
+        self.tokens = tokens
+        self.cost = cost
+        super().__init__(
+            f"{scope} {scope_id} 超出配额: tokens {tokens}/{limit.max_tokens}, cost {cost:.6f}/{limit.max_cost}"
+        )
+
+
+class _Bucket:
+    __slots__ = ("tokens", "cost", "pending_tokens", "pending_cost", "stored")
+
+    def __init__(self, tokens: int = 0, cost: float = 0.0, stored: bool = False):
+        self.tokens = tokens
+        self.cost = cost
+        # 尚未写入 quota_counters 的增量
+        self.pending_tokens = 0
+        self.pending_cost = 0.0
+        # quota_counters 中已有该桶的行
+        self.stored = stored
+
+
+class _Window:
+    """一个作用域的滑动窗口，buckets 按时间升序，tokens/cost 为窗口内已提交总量"""
+
+    __slots__ = ("buckets", "tokens", "cost", "reserved_tokens", "reserved_cost")
+
+    def __init__(self, buckets: Dict[datetime, _Bucket]):
+        self.buckets: OrderedDict[datetime, _Bucket] = OrderedDict(sorted(buckets.items()))
+        self.tokens = sum(bucket.tokens for bucket in self.buckets.values())
+        self.cost = sum(bucket.cost for bucket in self.buckets.values())
+        self.reserved_tokens = 0
+        self.reserved_cost = 0.0
+
+    def advance(self, oldest: datetime, evicted: list, key):
+        """移出早于 oldest 的桶，仍有未落库增量的桶放入 evicted"""
+        while self.buckets:
+            bucket_start = next(iter(self.buckets))
+            if bucket_start >= oldest:
+                return
+            bucket = self.buckets.pop(bucket_start)
+            self.tokens -= bucket.tokens
+            self.cost -= bucket.cost
+            if bucket.pending_tokens or bucket.pending_cost or not bucket.stored:
+                evicted.append((key, bucket_start, bucket))
+
+    def add(self, bucket_start: datetime, tokens: int, cost: float):
+        bucket = self.buckets.get(bucket_start)
+        if bucket is None:
+            bucket = self.buckets[bucket_start] = _Bucket()
+        bucket.tokens += tokens
+        bucket.cost += cost
+        bucket.pending_tokens += tokens
+        bucket.pending_cost += cost
+        self.tokens += tokens
+        self.cost += cost
+
+
+class QuotaManager:
+    """按租户与 Agent 的滑动窗口配额
+
+    Args:
+        window_hours: 窗口长度（小时），默认 settings.quota_window_hours
+        reservation_ttl: 预留未提交时的过期秒数，默认 settings.quota_reservation_ttl
+    """
+
+    def __init__(self, *, window_hours: int = None, reservation_ttl: float = None):
+        if window_hours is None:
+            window_hours = settings.quota_window_hours
+        if reservation_ttl is None:
+            reservation_ttl = settings.quota_reservation_ttl
+        if window_hours <= 0:
+            raise ValueError("window_hours 必须为正数")
+        if reservation_ttl <= 0:
+            raise ValueError("reservation_ttl 必须为正数")
+        self.window_hours = window_hours
+        self.reservation_ttl = reservation_ttl
+        self._limits: Dict[Tuple[str, str], QuotaLimit] = {}
+        self._windows: Dict[Tuple[str, str], _Window] = {}
+        self._reservations: Dict[str, Reservation] = {}
+        self._tenants: Dict[str, Optional[str]] = {}
+        # 已移出窗口但尚未落库的桶
+        self._evicted: List[Tuple[Tuple[str, str], datetime, _Bucket]] = []
+        self._lock = threading.Lock()
+
+    # ---- 预算 ----
+
+    def set_limit(self, scope: str, scope_id: str, *, max_tokens: int = None, max_cost: float = None):
+        """设置作用域的预算，两项都为 None 时取消限制"""
+        self._check_scope(scope)
+        with self._lock:
+            if max_tokens is None and max_cost is None:
+                self._limits.pop((scope, scope_id), None)
+            else:
+                self._limits[(scope, scope_id)] = QuotaLimit(max_tokens, max_cost)
+
+    def get_limit(self, scope: str, scope_id: str) -> Optional[QuotaLimit]:
+        return self._limits.get((scope, scope_id))
+
+    def usage(self, scope: str, scope_id: str, *, current_time: datetime = None) -> Dict:
+        """作用域窗口内的已提交与预留用量"""
+        self._check_scope(scope)
+        bucket_start = truncate(current_time or _utcnow(), HOUR)
+        window = self._window((scope, scope_id), bucket_start)
+        with self._lock:
+            window.advance(self._oldest(bucket_start), self._evicted, (scope, scope_id))
+            return {
+                "tokens": window.tokens,
+                "cost": window.cost,
+                "reserved_tokens": window.reserved_tokens,
+                "reserved_cost": window.reserved_cost,
+            }
+
+    # ---- 预留与提交 ----
+
+    def check_and_reserve(
+        self,
+        agent_id: str,
+        tokens: int,
+        cost: float = 0.0,
+        *,
+        tenant_id: str = None,
+        current_time: datetime = None,
+    ) -> Reservation:
+        """检查 Agent 及其租户的预算并预留额度
+
+        窗口首次使用时会查询数据库加载，之后只做内存运算。
+
+        Raises:
+            QuotaExceededError: 任一作用域的已提交 + 已预留 + 本次用量超出预算
+        """
+        bucket_start = truncate(current_time or _utcnow(), HOUR)
+        tenant_id = tenant_id or self._tenant_of(agent_id)
+        keys = self._keys(agent_id, tenant_id)
+        windows = [(key, self._window(key, bucket_start)) for key in keys]
+        oldest = self._oldest(bucket_start)
+        with self._lock:
+            for key, window in windows:
+                window.advance(oldest, self._evicted, key)
+                limit = self._limits.get(key)
+                if limit is None:
+                    continue
+                used_tokens = window.tokens + window.reserved_tokens + tokens
+                used_cost = window.cost + window.reserved_cost + cost
+                if (limit.max_tokens is not None and used_tokens > limit.max_tokens) or (
+                    limit.max_cost is not None and used_cost > limit.max_cost
+                ):
+                    raise QuotaExceededError(key[0], key[1], limit, used_tokens, used_cost)
+            for _, window in windows:
+                window.reserved_tokens += tokens
+                window.reserved_cost += cost
+            reservation = Reservation(
+                uuid.uuid4().hex, agent_id, tenant_id, tokens, cost,
+                time.monotonic() + self.reservation_ttl,
+            )
+            self._reservations[reservation.id] = reservation
+        return reservation
+
+    def commit(
+        self,
+        reservation: Reservation,
+        tokens: int = None,
+        cost: float = None,
+        *,
+        current_time: datetime = None,
+    ):
+        """按实际用量入账并归还预留，tokens/cost 未给出时按预留量入账
+
+        预留已过期时仍会入账：调用已经发生。
+        """
+        tokens = reservation.tokens if tokens is None else tokens
+        cost = reservation.cost if cost is None else cost
+        bucket_start = truncate(current_time or _utcnow(), HOUR)
+        keys = self._keys(reservation.agent_id, reservation.tenant_id)
+        windows = [(key, self._window(key, bucket_start)) for key in keys]
+        with self._lock:
+            live = self._reservations.pop(reservation.id, None) is not None
+            for _, window in windows:
+                if live:
+                    window.reserved_tokens -= reservation.tokens
+                    window.reserved_cost -= reservation.cost
+                window.add(bucket_start, tokens, cost)
+
+    def release(self, reservation: Reservation):
+        """调用未发生时归还预留"""
+        with self._lock:
+            self._release(reservation)
+
+    def expire_reservations(self) -> int:
+        """归还已过期的预留，返回归还数"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [r for r in self._reservations.values() if r.expires_at <= now]
+            for reservation in expired:
+                self._release(reservation)
+        return len(expired)
+
+    def _release(self, reservation: Reservation):
+        if self._reservations.pop(reservation.id, None) is None:
+            return
+        for key in self._keys(reservation.agent_id, reservation.tenant_id):
+            window = self._windows.get(key)
+            if window is not None:
+                window.reserved_tokens -= reservation.tokens
+                window.reserved_cost -= reservation.cost
+
+    # ---- 落库 ----
+
+    def flush(self) -> int:
+        """把已提交的增量累加到 quota_counters，返回写入的行数"""
+        with self._lock:
+            entries = self._evicted
+            self._evicted = []
+            for key, window in self._windows.items():
+                for bucket_start, bucket in window.buckets.items():
+                    if bucket.pending_tokens or bucket.pending_cost or not bucket.stored:
+                        entries.append((key, bucket_start, bucket))
+            # 快照增量后清零，写入失败时加回
+            snapshot = []
+            for key, bucket_start, bucket in entries:
+                snapshot.append(
+                    (key, bucket_start, bucket, bucket.pending_tokens, bucket.pending_cost, bucket.stored)
+                )
+                bucket.pending_tokens = 0
+                bucket.pending_cost = 0.0
+                bucket.stored = True
+        if not snapshot:
+            return 0
+        try:
+            self._write(snapshot)
+        except Exception:
+            with self._lock:
+                for key, bucket_start, bucket, tokens, cost, stored in snapshot:
+                    bucket.pending_tokens += tokens
+                    bucket.pending_cost += cost
+                    bucket.stored = bucket.stored and stored
+                    window = self._windows.get(key)
+                    if window is None or window.buckets.get(bucket_start) is not bucket:
+                        self._evicted.append((key, bucket_start, bucket))
+            raise
+        return len(snapshot)
+
+    @staticmethod
+    def _write(snapshot):
+        db = QuotaCounter._meta.database
+        target = conflict_target(db, QuotaCounter.scope, QuotaCounter.scope_id, QuotaCounter.bucket_start)
+        now = _utcnow()
+        increments = []
+        with db.atomic():
+            for (scope, scope_id), bucket_start, bucket, tokens, cost, stored in snapshot:
+                row = {
+                    "scope": scope,
+                    "scope_id": scope_id,
+                    "bucket_start": bucket_start,
+                    "tokens": tokens,
+                    "cost": cost,
+                    "updated_at": now,
+                }
+                if stored:
+                    increments.append(row)
+                    continue
+                # 桶首次落库：插入窗口中的完整值（含从汇总表加载的部分），已有行时只累加增量
+                row.update(tokens=bucket.tokens, cost=bucket.cost)
+                QuotaCounter.insert(row).on_conflict(
+                    conflict_target=target,
+                    update={
+                        QuotaCounter.tokens: QuotaCounter.tokens + tokens,
+                        QuotaCounter.cost: QuotaCounter.cost + cost,
+                        QuotaCounter.updated_at: now,
+                    },
+                ).execute()
+            for offset in range(0, len(increments), 500):
+                QuotaCounter.insert_many(increments[offset:offset + 500]).on_conflict(
+                    conflict_target=target,
+                    update={
+                        QuotaCounter.tokens: QuotaCounter.tokens + excluded(db, QuotaCounter.tokens),
+                        QuotaCounter.cost: QuotaCounter.cost + excluded(db, QuotaCounter.cost),
+                        QuotaCounter.updated_at: excluded(db, QuotaCounter.updated_at),
+                    },
+                ).execute()
+
+    def purge(self, *, current_time: datetime = None) -> int:
+        """删除 quota_counters 中已滑出窗口的桶，返回删除的行数"""
+        oldest = self._oldest(truncate(current_time or _utcnow(), HOUR))
+        return QuotaCounter.delete().where(QuotaCounter.bucket_start < oldest).execute()
+
+    # ---- 对账 ----
+
+    def reconcile_agent(self, agent_id: str, *, current_time: datetime = None) -> Dict[str, float]:
+        """以 llm_usage 明细为准重算 Agent 窗口内的已提交用量
+
+        先重算 Agent 窗口覆盖日期的汇总表，再用小时汇总覆盖内存窗口与 quota_counters。
+
+        Returns:
+            {"tokens": 校正量, "cost": 校正量}，正数表示内存中少计
+        """
+        bucket_start = truncate(current_time or _utcnow(), HOUR)
+        oldest = self._oldest(bucket_start)
+        usage_rollup.rebuild(oldest, agent_id=agent_id)
+        return self._reset((SCOPE_AGENT, agent_id), [agent_id], oldest)
+
+    def reconcile_tenant(self, tenant_id: str, *, current_time: datetime = None) -> Dict[str, float]:
+        """对账租户下所有 Agent，再以其合计校正租户窗口"""
+        bucket_start = truncate(current_time or _utcnow(), HOUR)
+        agent_ids = self._agents_of(tenant_id)
+        for agent_id in agent_ids:
+            self.reconcile_agent(agent_id, current_time=current_time)
+        return self._reset((SCOPE_TENANT, tenant_id), agent_ids, self._oldest(bucket_start))
+
+    def _reset(self, key, agent_ids: List[str], oldest: datetime) -> Dict[str, float]:
+        truth = self._rollup_buckets(agent_ids, oldest)
+        scope, scope_id = key
+        db = QuotaCounter._meta.database
+        now = _utcnow()
+        with db.atomic():
+            QuotaCounter.delete().where(
+                (QuotaCounter.scope == scope)
+                & (QuotaCounter.scope_id == scope_id)
+                & (QuotaCounter.bucket_start >= oldest)
+            ).execute()
+            rows = [
+                {"scope": scope, "scope_id": scope_id, "bucket_start": bucket_start,
+                 "tokens": tokens, "cost": cost, "updated_at": now}
+                for bucket_start, (tokens, cost) in truth.items()
+            ]
+            for offset in range(0, len(rows), 500):
+                QuotaCounter.insert_many(rows[offset:offset + 500]).execute()
+
+        window = _Window({
+            bucket_start: _Bucket(tokens, cost, stored=True)
+            for bucket_start, (tokens, cost) in truth.items()
+        })
+        with self._lock:
+            previous = self._windows.get(key)
+            if previous is not None:
+                window.reserved_tokens = previous.reserved_tokens
+                window.reserved_cost = previous.reserved_cost
+                previous.advance(oldest, [], key)
+            self._windows[key] = window
+            self._evicted = [entry for entry in self._evicted if entry[0] != key]
+        old_tokens = previous.tokens if previous is not None else 0
+        old_cost = previous.cost if previous is not None else 0.0
+        return {"tokens": window.tokens - old_tokens, "cost": window.cost - old_cost}
+
+    # ---- 窗口加载 ----
+
+    def forget(self, scope: str, scope_id: str):
+        """丢弃作用域的内存窗口，下次使用时重新加载（未落库的增量会一并丢弃）"""
+        with self._lock:
+            self._windows.pop((scope, scope_id), None)
+
+    def _oldest(self, bucket_start: datetime) -> datetime:
+        return bucket_start - timedelta(hours=self.window_hours - 1)
+
+    @staticmethod
+    def _keys(agent_id: str, tenant_id: Optional[str]) -> List[Tuple[str, str]]:
+        keys = [(SCOPE_AGENT, agent_id)]
+        if tenant_id:
+            keys.append((SCOPE_TENANT, tenant_id))
+        return keys
+
+    def _window(self, key, bucket_start: datetime) -> _Window:
+        window = self._windows.get(key)
+        if window is not None:
+            return window
+        # 在锁外查询数据库，并发加载时以先写入的为准
+        loaded = self._load(key, self._oldest(bucket_start))
+        with self._lock:
+            return self._windows.setdefault(key, loaded)
+
+    def _load(self, key, oldest: datetime) -> _Window:
+        """从 quota_counters 加载已落库的桶，其余桶由小时汇总补齐"""
+        scope, scope_id = key
+        buckets = {
+            bucket_start: _Bucket(tokens, cost, stored=True)
+            for bucket_start, tokens, cost in QuotaCounter.select(
+                QuotaCounter.bucket_start, QuotaCounter.tokens, QuotaCounter.cost
+            )
+            .where(
+                (QuotaCounter.scope == scope)
+                & (QuotaCounter.scope_id == scope_id)
+                & (QuotaCounter.bucket_start >= oldest)
+            )
+            .tuples()
+        }
+        agent_ids = [scope_id] if scope == SCOPE_AGENT else self._agents_of(scope_id)
+        for bucket_start, (tokens, cost) in self._rollup_buckets(agent_ids, oldest).items():
+            if bucket_start not in buckets:
+                buckets[bucket_start] = _Bucket(tokens, cost)
+        return _Window(buckets)
+
+    @staticmethod
+    def _rollup_buckets(agent_ids: Iterable[str], oldest: datetime) -> Dict[datetime, Tuple[int, float]]:
+        agent_ids = list(agent_ids)
+        if not agent_ids:
+            return {}
+        query = (
+            LLMUsageHourly.select_unscoped(
+                LLMUsageHourly.bucket_start,
+                fn.SUM(LLMUsageHourly.total_tokens),
+                fn.SUM(LLMUsageHourly.cost),
+            )
+            .where(LLMUsageHourly.agent_id.in_(agent_ids) & (LLMUsageHourly.bucket_start >= oldest))
+            .group_by(LLMUsageHourly.bucket_start)
+        )
+        return {bucket_start: (int(tokens or 0), float(cost or 0)) for bucket_start, tokens, cost in query.tuples()}
+
+    def _tenant_of(self, agent_id: str) -> Optional[str]:
+        if agent_id not in self._tenants:
+            agent = Agent.select(Agent.tenant_id).where(Agent.id == agent_id).first()
+            self._tenants[agent_id] = agent.tenant_id if agent else None
+        return self._tenants[agent_id]
+
+    @staticmethod
+    def _agents_of(tenant_id: str) -> List[str]:
+        return [agent_id for (agent_id,) in Agent.select(Agent.id).where(Agent.tenant_id == tenant_id).tuples()]
+
+    @staticmethod
+    def _check_scope(scope: str):
+        if scope not in (SCOPE_TENANT, SCOPE_AGENT):
+            raise ValueError(f"不支持的配额作用域: {scope}")
+
+
+class QuotaFlushWorker(PeriodicWorker):
+    """定期归还过期预留并把配额增量写入 quota_counters，停止时再写一次
+
+    每隔 purge_interval 秒删除一次已滑出窗口的桶。
+    """
+
+    def __init__(
+        self,
+        manager: QuotaManager = None,
+        *,
+        interval: float = 10.0,
+        purge_interval: float = 3600.0,
+    ):
+        super().__init__(interval)
+        self.manager = manager or quota_manager
+        self.purge_interval = purge_interval
+        self.last_flushed = 0
+        self.last_purged = 0
+        self._next_purge = 0.0
+
+    async def run_once(self):
+        self.manager.expire_reservations()
+        self.last_flushed = await run_sync(self.manager.flush)
+        if time.monotonic() >= self._next_purge:
+            self.last_purged = await run_sync(self.manager.purge)
+            self._next_purge = time.monotonic() + self.purge_interval
+
+    async def on_stop(self):
+        self.last_flushed = await run_sync(self.manager.flush)
+
+
+# 全局配额管理器
+quota_manager = QuotaManager()
+
+
+__all__ = [
+    "QuotaLimit",
+    "Reservation",
+    "QuotaExceededError",
+    "QuotaManager",
+    "QuotaFlushWorker",
+    "quota_manager",
+]
@@ -55,6 +55,45 @@ class Settings:
         self.db_connection_timeout = int(os.getenv('DB_CONNECTION_TIMEOUT', "30"))
         self.db_timezone = os.getenv('DB_TIMEZONE', "UTC")
 
+        # 活跃状态保留配置：过期超过该时长（秒）的心跳记录会被清理
+        self.agent_state_retention_seconds = int(os.getenv('AGENT_STATE_RETENTION_SECONDS', "604800"))
+
+        # 聊天流缓存：缓存秒数，经 update() 等批量语句的修改最多滞后该时长
+        self.chat_stream_cache_ttl = float(os.getenv('CHAT_STREAM_CACHE_TTL', "60"))
+
+        # 按月时间分区：messages、llm_usage 按月分表（SQLite）或使用原生分区（PostgreSQL）
+        self.time_partitioning = os.getenv('TIME_PARTITIONING', "False").lower() == "true"
+
+        # 消息归档：早于该时长（秒）的消息移入冷存储分段文件
+        self.message_archive_dir = os.getenv('MESSAGE_ARCHIVE_DIR', "data/archive")
+        self.message_archive_after_seconds = int(os.getenv('MESSAGE_ARCHIVE_AFTER_SECONDS', "2592000"))
+
+        # 最近消息缓存：所有聊天缓冲区的估算内存上限（字节）
+        self.message_cache_max_bytes = int(os.getenv('MESSAGE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+        # 配额：滑动窗口长度（小时）与未提交预留的过期时间（秒）
+        self.quota_window_hours = int(os.getenv('QUOTA_WINDOW_HOURS', "24"))
+        self.quota_reservation_ttl = int(os.getenv('QUOTA_RESERVATION_TTL', "300"))
+
+        # 模型价格缓存：缓存秒数，其他进程修改的价格最多滞后该时长
+        self.pricing_cache_ttl = float(os.getenv('PRICING_CACHE_TTL', "60"))
+
+        # 表情包标签索引：重新加载间隔（秒），其他进程的封禁、删除最多滞后该时长
+        self.emoji_index_ttl = float(os.getenv('EMOJI_INDEX_TTL', "300"))
+
+        # 描述缓存：条目上限、未命中结果的缓存秒数、是否回退到其他 Agent 的描述
+        self.description_cache_max_entries = int(os.getenv('DESCRIPTION_CACHE_MAX_ENTRIES', "100000"))
+        self.description_cache_negative_ttl = float(os.getenv('DESCRIPTION_CACHE_NEGATIVE_TTL', "60"))
+        self.description_cache_shared = os.getenv('DESCRIPTION_CACHE_SHARED', "False").lower() == "true"
+
+        # 内容寻址图片存储：文件根目录，失去全部引用的文件保留多久（秒）后回收
+        self.image_store_dir = os.getenv('IMAGE_STORE_DIR', "data/images")
+        self.image_store_gc_grace_seconds = int(os.getenv('IMAGE_STORE_GC_GRACE_SECONDS', "86400"))
+
+        # 人物信息缓存：条目上限与缓存秒数（know_times/last_know 批量写入，缓存值最多滞后该时长）
+        self.person_cache_max_entries = int(os.getenv('PERSON_CACHE_MAX_ENTRIES', "50000"))
+        self.person_cache_ttl = float(os.getenv('PERSON_CACHE_TTL', "300"))
+
 
 # 创建全局配置实例
 settings = Settings()
\ No newline at end of file
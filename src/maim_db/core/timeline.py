@@ -0,0 +1,109 @@
+"""
+聊天时间线
+用一条 UNION ALL 查询把聊天中的消息与动作记录按时间交错合并，
+两侧分别走 (agent_id, chat_id, time) 复合索引。
+"""
+
+from typing import List, NamedTuple, Optional
+
+from peewee import Entity, Value
+
+from .context_manager import get_current_agent_id
+from .models.maimbot_models import ActionRecords, Messages
+
+KIND_MESSAGE = "message"
+KIND_ACTION = "action"
+
+
+class TimelineEntry(NamedTuple):
+    """时间线中的一项
+
+    kind 为 "message" 时 ref_id 为 message_id、actor 为发送者昵称、content 为消息正文；
+    kind 为 "action" 时 ref_id 为 action_id、actor 为动作名、content 为动作的提示词展示文本。
+    """
+
+    kind: str
+    id: int
+    time: float
+    ref_id: str
+    actor: Optional[str]
+    content: Optional[str]
+
+
+def _message_query(model, agent_id, chat_id, start, end):
+    query = model.select_unscoped(
+        Value(KIND_MESSAGE).alias("kind"),
+        model.id.alias("id"),
+        model.time.alias("time"),
+        model.message_id.alias("ref_id"),
+        model.user_nickname.alias("actor"),
+        model.processed_plain_text.alias("content"),
+    ).where((model.agent_id == agent_id) & (model.chat_id == chat_id))
+    if start is not None:
+        query = query.where(model.time >= start)
+    if end is not None:
+        query = query.where(model.time < end)
+    return query
+
+
+def chat_timeline(
+    chat_id: str,
+    start: float = None,
+    end: float = None,
+    limit: int = None,
+    *,
+    agent_id: str = None,
+    newest: bool = True,
+) -> List[TimelineEntry]:
+    """读取聊天在 [start, end) 内的消息与动作，按时间正序交错返回
+
+    Args:
+        chat_id: 聊天ID
+        start: 起始时间（含），None 表示不限
+        end: 结束时间（不含），None 表示不限
+        limit: 最多返回条数，None 表示不限
+        agent_id: 未指定时使用当前上下文中的 agent_id
+        newest: 有 limit 时取窗口内最新的 limit 条，否则取最早的 limit 条
+    """
+    agent_id = agent_id or get_current_agent_id()
+    if not agent_id:
+        raise ValueError("查询聊天时间线时必须设置 agent_id")
+
+    query = None
+    for model in Messages.partitioner.models_for_range(start, end):
+        part = _message_query(model, agent_id, chat_id, start, end)
+        query = part if query is None else (query + part)
+
+    actions = ActionRecords.select_unscoped(
+        Value(KIND_ACTION).alias("kind"),
+        ActionRecords.id.alias("id"),
+        ActionRecords.time.alias("time"),
+        ActionRecords.action_id.alias("ref_id"),
+        ActionRecords.action_name.alias("actor"),
+        ActionRecords.action_prompt_display.alias("content"),
+    ).where((ActionRecords.agent_id == agent_id) & (ActionRecords.chat_id == chat_id))
+    if start is not None:
+        actions = actions.where(ActionRecords.time >= start)
+    if end is not None:
+        actions = actions.where(ActionRecords.time < end)
+    query = query + actions
+
+    descending = newest and limit is not None
+    time_column, kind_column = Entity("time"), Entity("kind")
+    # 同一时刻消息排在动作之前（"message" > "action"）
+    if descending:
+        query = query.order_by(time_column.desc(), kind_column.asc())
+    else:
+        query = query.order_by(time_column.asc(), kind_column.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    entries = [TimelineEntry(*row) for row in query.tuples()]
+    if descending:
+        entries.reverse()
+    return entries
+
+
+__all__ = [
+    "TimelineEntry",
+    "chat_timeline",
+]
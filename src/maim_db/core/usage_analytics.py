@@ -0,0 +1,257 @@
+"""
+LLM 用量分析
+按列读取 llm_usage 明细（.tuples() 分块拉取，不构造模型实例），用 NumPy 计算
+耗时分位数、各模型成本、token 分布与各状态错误率。
+
+NumPy 为可选依赖：pip install maim_db[analytics]
+"""
+
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Sequence
+
+from peewee import PostgresqlDatabase
+
+from .context_manager import get_current_agent_id
+from .export import iter_rows
+from .models.maimbot_models import LLMUsage
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+SUCCESS_STATUS = "success"
+
+
+def _require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise ImportError("用量分析需要 NumPy，请安装: pip install maim_db[analytics]")
+
+
+class _Interner:
+    """把字符串映射为连续整数编码，供 np.bincount 分组使用"""
+
+    __slots__ = ("codes", "values")
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def encode(self, items) -> "np.ndarray":
+        codes, values = self.codes, self.values
+        # dict.fromkeys 在 C 层去重并保持首次出现顺序，逐元素查表交给 map
+        for item in dict.fromkeys(items):
+            if item not in codes:
+                codes[item] = len(values)
+                values.append(item)
+        return np.fromiter(map(codes.__getitem__, items), dtype=np.int32, count=len(items))
+
+
+class UsageColumns:
+    """llm_usage 明细的列式表示
+
+    model 与 status 为整数编码（model_names / statuses 为对应的取值表），
+    其余为数值数组；time_cost 缺失记为 NaN。
+    """
+
+    def __init__(self, model, model_names, status, statuses, prompt_tokens,
+                 completion_tokens, total_tokens, cost, time_cost):
+        self.model = model
+        self.model_names = model_names
+        self.status = status
+        self.statuses = statuses
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = total_tokens
+        self.cost = cost
+        self.time_cost = time_cost
+
+    def __len__(self) -> int:
+        return len(self.model)
+
+    @classmethod
+    def from_rows(cls, chunks) -> "UsageColumns":
+        """由 (model_name, status, prompt, completion, total, cost, time_cost) 行块构造"""
+        _require_numpy()
+        models, statuses = _Interner(), _Interner()
+        parts = {name: [] for name in ("model", "status", "prompt", "completion", "total", "cost", "time")}
+        for rows in chunks:
+            if not rows:
+                continue
+            model_col, status_col, prompt, completion, total, cost, time_cost = zip(*rows)
+            parts["model"].append(models.encode(model_col))
+            parts["status"].append(statuses.encode(status_col))
+            parts["prompt"].append(np.array(prompt, dtype=np.int64))
+            parts["completion"].append(np.array(completion, dtype=np.int64))
+            parts["total"].append(np.array(total, dtype=np.int64))
+            parts["cost"].append(np.array(cost, dtype=np.float64))
+            # None 转为 NaN
+            parts["time"].append(np.array(time_cost, dtype=np.float64))
+
+        def join(name, dtype):
+            chunks_ = parts[name]
+            return np.concatenate(chunks_) if chunks_ else np.empty(0, dtype=dtype)
+
+        return cls(
+            join("model", np.int32), models.values,
+            join("status", np.int32), statuses.values,
+            join("prompt", np.int64), join("completion", np.int64), join("total", np.int64),
+            join("cost", np.float64), join("time", np.float64),
+        )
+
+
+def load_usage_columns(
+    start: datetime = None,
+    end: datetime = None,
+    *,
+    agent_id: str = None,
+    chunk_size: int = 50000,
+) -> UsageColumns:
+    """按列读取 Agent 在 [start, end) 内的用量明细，启用分区时逐个分区读取"""
+    _require_numpy()
+    agent_id = agent_id or get_current_agent_id()
+    if not agent_id:
+        raise ValueError("用量分析时必须设置 agent_id")
+
+    def chunks():
+        for model in LLMUsage.partitioner.models_for_range(start, end):
+            query = model.select_unscoped(
+                model.model_name, model.status, model.prompt_tokens, model.completion_tokens,
+                model.total_tokens, model.cost, model.time_cost,
+            ).where(model.agent_id == agent_id)
+            if start is not None:
+                query = query.where(model.timestamp >= start)
+            if end is not None:
+                query = query.where(model.timestamp < end)
+            yield from _fetch_chunks(query, chunk_size)
+
+    return UsageColumns.from_rows(chunks())
+
+
+def _fetch_chunks(query, chunk_size: int):
+    database = query.model._meta.database
+    if isinstance(database, PostgresqlDatabase):
+        # 服务端游标分批拉取
+        rows = iter_rows(query, row_type="tuple", chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+    # 所选列都是字符串与数值，直接从游标取元组，跳过 peewee 的逐行结果包装
+    cursor = database.execute(query)
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _grouped_percentiles(codes, values, groups: int, percentiles) -> List[List[float]]:
+    """各组的分位数：按编码排序后切分，组内用 nanpercentile"""
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(groups + 1))
+    sorted_values = values[order]
+    result = []
+    for group in range(groups):
+        part = sorted_values[bounds[group]:bounds[group + 1]]
+        if part.size == 0 or np.isnan(part).all():
+            result.append([None] * len(percentiles))
+        else:
+            result.append([float(x) for x in np.nanpercentile(part, percentiles)])
+    return result
+
+
+def usage_report(
+    columns: UsageColumns,
+    *,
+    percentiles: Sequence[float] = (50, 90, 99),
+    bins: int = 20,
+    success_status: str = SUCCESS_STATUS,
+) -> Dict:
+    """计算用量报告
+
+    Returns:
+        字典，包含：
+        - requests / cost: 总请求数与总成本
+        - time_cost_percentiles: 全部请求耗时的分位数
+        - by_model: 各模型的请求数、token 与成本之和、错误率、耗时分位数
+        - by_status: 各状态的请求数与占比
+        - token_histogram: total_tokens 的直方图（counts 与 edges）
+    """
+    _require_numpy()
+    n = len(columns)
+    percentiles = list(percentiles)
+    models = len(columns.model_names)
+    report = {
+        "requests": n,
+        "cost": float(columns.cost.sum()) if n else 0.0,
+        "time_cost_percentiles": dict(zip(percentiles, [None] * len(percentiles))),
+        "by_model": {},
+        "by_status": {},
+        "token_histogram": {"counts": [], "edges": []},
+    }
+    if n == 0:
+        return report
+
+    if not np.isnan(columns.time_cost).all():
+        report["time_cost_percentiles"] = dict(
+            zip(percentiles, [float(x) for x in np.nanpercentile(columns.time_cost, percentiles)])
+        )
+
+    counts = np.bincount(columns.model, minlength=models)
+    cost = np.bincount(columns.model, weights=columns.cost, minlength=models)
+    prompt = np.bincount(columns.model, weights=columns.prompt_tokens, minlength=models)
+    completion = np.bincount(columns.model, weights=columns.completion_tokens, minlength=models)
+    total = np.bincount(columns.model, weights=columns.total_tokens, minlength=models)
+    success_code = columns.statuses.index(success_status) if success_status in columns.statuses else -1
+    errors = np.bincount(columns.model[columns.status != success_code], minlength=models)
+    latency = _grouped_percentiles(columns.model, columns.time_cost, models, percentiles)
+    for code, name in enumerate(columns.model_names):
+        report["by_model"][name] = {
+            "requests": int(counts[code]),
+            "cost": float(cost[code]),
+            "prompt_tokens": int(prompt[code]),
+            "completion_tokens": int(completion[code]),
+            "total_tokens": int(total[code]),
+            "error_rate": float(errors[code] / counts[code]) if counts[code] else 0.0,
+            "time_cost_percentiles": dict(zip(percentiles, latency[code])),
+        }
+
+    status_counts = np.bincount(columns.status, minlength=len(columns.statuses))
+    for code, name in enumerate(columns.statuses):
+        report["by_status"][name] = {
+            "requests": int(status_counts[code]),
+            "ratio": float(status_counts[code] / n),
+        }
+
+    hist_counts, edges = np.histogram(columns.total_tokens, bins=bins)
+    report["token_histogram"] = {
+        "counts": hist_counts.tolist(),
+        "edges": edges.tolist(),
+    }
+    return report
+
+
+def agent_usage_report(
+    start: datetime = None,
+    end: datetime = None,
+    *,
+    agent_id: str = None,
+    **kwargs,
+) -> Dict:
+    """读取 Agent 在 [start, end) 内的明细并计算用量报告，其余参数同 usage_report"""
+    return usage_report(load_usage_columns(start, end, agent_id=agent_id), **kwargs)
+
+
+__all__ = [
+    "NUMPY_AVAILABLE",
+    "UsageColumns",
+    "load_usage_columns",
+    "usage_report",
+    "agent_usage_report",
+]
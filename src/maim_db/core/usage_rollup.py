@@ -0,0 +1,399 @@
+"""
+LLM 用量汇总
+llm_usage 明细之上维护按小时、按天两级汇总表，仪表盘与账单查询不再扫描明细。
+
+- 逐条写入的 LLMUsage 通过写入回调在同一事务内累加到两级汇总表
+- insert_many 等批量写入不经过回调，由 rebuild() 或 UsageRollupWorker 按天重算补齐
+- usage_summary() 把查询区间拆成整天、整小时与零头三段，分别读取日表、小时表与明细
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from peewee import SQL, MySQLDatabase, PostgresqlDatabase, fn
+
+from .background import PeriodicWorker, run_sync
+from .context_manager import get_current_agent_id
+from .database import conflict_target, excluded
+from .models.maimbot_models import LLMUsage, LLMUsageDaily, LLMUsageHourly
+
+HOUR = "hour"
+DAY = "day"
+ROLLUP_MODELS = {HOUR: LLMUsageHourly, DAY: LLMUsageDaily}
+
+KEY_FIELDS = ("model_name", "request_type", "status")
+VALUE_FIELDS = (
+    "request_count",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "cost",
+    "time_cost",
+)
+
+
+def truncate(value: datetime, granularity: str) -> datetime:
+    """截断到所在小时或当天的起点"""
+    if granularity == HOUR:
+        return value.replace(minute=0, second=0, microsecond=0)
+    if granularity == DAY:
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"不支持的汇总粒度: {granularity}")
+
+
+def _ceil(value: datetime, granularity: str) -> datetime:
+    floor = truncate(value, granularity)
+    if floor == value:
+        return value
+    return floor + (timedelta(hours=1) if granularity == HOUR else timedelta(days=1))
+
+
+def _parse_bucket(value) -> datetime:
+    # SQLite/MySQL 的格式化函数返回字符串，PostgreSQL 的 date_trunc 返回时间
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _hour_bucket(db, field):
+    if isinstance(db, PostgresqlDatabase):
+        return fn.date_trunc("hour", field)
+    if isinstance(db, MySQLDatabase):
+        return fn.DATE_FORMAT(field, "%Y-%m-%d %H:00:00")
+    return fn.strftime("%Y-%m-%d %H:00:00", field)
+
+
+def _value_sums(model) -> list:
+    """明细表上的聚合列，顺序与 VALUE_FIELDS 一致"""
+    return [
+        fn.COUNT(model.id),
+        fn.COALESCE(fn.SUM(model.prompt_tokens), 0),
+        fn.COALESCE(fn.SUM(model.completion_tokens), 0),
+        fn.COALESCE(fn.SUM(model.total_tokens), 0),
+        fn.COALESCE(fn.SUM(model.cost), 0),
+        fn.COALESCE(fn.SUM(model.time_cost), 0),
+    ]
+
+
+class UsageRollup:
+    """LLMUsage 两级汇总的维护与查询
+
+    Args:
+        batch_size: 重算时每批写入汇总表的行数
+    """
+
+    def __init__(self, *, batch_size: int = 500):
+        if batch_size <= 0:
+            raise ValueError("batch_size 必须为正数")
+        self.batch_size = batch_size
+        self._enabled = False
+
+    # ---- 增量维护 ----
+
+    def enable(self):
+        """开始随 LLMUsage 写入增量更新汇总表，可重复调用"""
+        if self._enabled:
+            return
+        LLMUsage.add_listener("post_save", self._on_post_save)
+        self._enabled = True
+
+    def disable(self):
+        LLMUsage.remove_listener("post_save", self._on_post_save)
+        self._enabled = False
+
+    def _on_post_save(self, usage, created):
+        # 修改已有明细不会反映到汇总表，需对相应日期调用 rebuild()
+        if not created:
+            return
+        row = {
+            "agent_id": usage.agent_id,
+            "model_name": usage.model_name,
+            "request_type": usage.request_type,
+            "status": usage.status,
+            "request_count": 1,
+            "prompt_tokens": usage.prompt_tokens or 0,
+            "completion_tokens": usage.completion_tokens or 0,
+            "total_tokens": usage.total_tokens or 0,
+            "cost": usage.cost or 0,
+            "time_cost": usage.time_cost or 0,
+        }
+        for granularity, model in ROLLUP_MODELS.items():
+            self._accumulate(
+                model, [dict(row, bucket_start=truncate(usage.timestamp, granularity))]
+            )
+
+    @staticmethod
+    def _accumulate(model, rows: List[Dict]):
+        """把 rows 累加到汇总表，桶不存在时插入"""
+        db = model._meta.database
+        update = {
+            getattr(model, name): getattr(model, name) + excluded(db, getattr(model, name))
+            for name in VALUE_FIELDS
+        }
+        target = conflict_target(
+            db, model.agent_id, *(getattr(model, name) for name in KEY_FIELDS), model.bucket_start
+        )
+        model.insert_many(rows).on_conflict(conflict_target=target, update=update).execute()
+
+    # ---- 重算 ----
+
+    def rebuild(self, start: datetime = None, end: datetime = None, *, agent_id: str = None) -> int:
+        """从明细重算 [start, end) 覆盖的整天，返回写入的小时桶数
+
+        start 向前、end 向后对齐到整天；agent_id 为 None 时重算所有 Agent。
+        删除与重写在同一事务内完成，读取方不会看到中间状态。
+        """
+        if start is not None:
+            start = truncate(start, DAY)
+        if end is not None:
+            end = _ceil(end, DAY)
+
+        hourly: Dict[Tuple, List] = {}
+        for key, values in self._aggregate_hours(start, end, agent_id):
+            # 原表与分区表中的同一小时合并
+            current = hourly.get(key)
+            hourly[key] = values if current is None else [a + b for a, b in zip(current, values)]
+
+        daily: Dict[Tuple, List] = {}
+        for key, values in hourly.items():
+            day_key = key[:-1] + (truncate(key[-1], DAY),)
+            current = daily.get(day_key)
+            daily[day_key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+
+        db = LLMUsage._meta.database
+        with db.atomic():
+            for granularity, model in ROLLUP_MODELS.items():
+                query = model.delete()
+                if agent_id is not None:
+                    query = query.where(model.agent_id == agent_id)
+                if start is not None:
+                    query = query.where(model.bucket_start >= start)
+                if end is not None:
+                    query = query.where(model.bucket_start < end)
+                query.execute()
+                buckets = hourly if granularity == HOUR else daily
+                self._write_buckets(model, buckets.items())
+        return len(hourly)
+
+    def _aggregate_hours(self, start, end, agent_id) -> Iterable[Tuple[Tuple, List]]:
+        """按 (agent_id, model_name, request_type, status, 小时) 聚合明细
+
+        每个分区单独 GROUP BY：分区按月划分，同一小时不会跨分区。
+        """
+        for model in LLMUsage.partitioner.models_for_range(start, end):
+            bucket = _hour_bucket(model._meta.database, model.timestamp)
+            query = model.select_unscoped(
+                model.agent_id, model.model_name, model.request_type, model.status,
+                bucket.alias("bucket_start"), *_value_sums(model),
+            )
+            if agent_id is not None:
+                query = query.where(model.agent_id == agent_id)
+            if start is not None:
+                query = query.where(model.timestamp >= start)
+            if end is not None:
+                query = query.where(model.timestamp < end)
+            # 按列序号分组：时间桶表达式带参数，重复写在 GROUP BY 中 PostgreSQL 不认为是同一表达式
+            query = query.group_by(
+                model.agent_id, model.model_name, model.request_type, model.status, SQL("5")
+            )
+            for row in query.tuples().iterator():
+                key = row[:4] + (_parse_bucket(row[4]),)
+                yield key, list(row[5:])
+
+    def _write_buckets(self, model, buckets: Iterable[Tuple[Tuple, List]]):
+        names = ("agent_id",) + KEY_FIELDS + ("bucket_start",)
+        batch = []
+        for key, values in buckets:
+            batch.append(dict(zip(names, key), **dict(zip(VALUE_FIELDS, values))))
+            if len(batch) >= self.batch_size:
+                self._accumulate(model, batch)
+                batch = []
+        if batch:
+            self._accumulate(model, batch)
+
+    # ---- 查询 ----
+
+    @staticmethod
+    def plan(start: datetime = None, end: datetime = None) -> List[Tuple[str, datetime, datetime]]:
+        """把 [start, end) 拆成 (来源, 起, 止) 段，来源为 "day"、"hour" 或 "raw"
+
+        整天部分读日表，两端不足一天的整小时读小时表，剩余零头读明细。
+        None 表示不限，视为已对齐。
+        """
+        if start is not None and end is not None and start >= end:
+            return []
+        hour_start = _ceil(start, HOUR) if start is not None else None
+        day_start = _ceil(start, DAY) if start is not None else None
+        hour_end = truncate(end, HOUR) if end is not None else None
+        day_end = truncate(end, DAY) if end is not None else None
+
+        def ordered(a, b):
+            return a is None or b is None or a <= b
+
+        if ordered(day_start, day_end):
+            cuts = [("raw", start, hour_start), ("hour", hour_start, day_start),
+                    ("day", day_start, day_end), ("hour", day_end, hour_end), ("raw", hour_end, end)]
+        elif ordered(hour_start, hour_end):
+            cuts = [("raw", start, hour_start), ("hour", hour_start, hour_end), ("raw", hour_end, end)]
+        else:
+            cuts = [("raw", start, end)]
+        # 只有 "day" 段可能一端或两端不限，其余段两端都确定，空段跳过
+        return [
+            (source, low, high)
+            for source, low, high in cuts
+            if (source == DAY and (low is None or high is None))
+            or (low is not None and high is not None and low < high)
+        ]
+
+    def usage_summary(
+        self,
+        start: datetime = None,
+        end: datetime = None,
+        *,
+        agent_id: str = None,
+        group_by: Sequence[str] = ("model_name",),
+    ) -> List[Dict]:
+        """汇总 [start, end) 内的用量
+
+        Args:
+            start: 起始时间（含），None 表示不限
+            end: 结束时间（不含），None 表示不限
+            agent_id: 未指定时使用当前上下文中的 agent_id
+            group_by: 分组字段，取自 model_name、request_type、status，为空时返回一行总计
+
+        Returns:
+            每组一个字典，包含分组字段与 request_count、各 token 数、cost、time_cost 之和
+        """
+        agent_id = self._require_agent(agent_id)
+        group_by = self._check_group_by(group_by)
+        totals: Dict[Tuple, List] = {}
+        for source, low, high in self.plan(start, end):
+            for row in self._segment(source, low, high, agent_id, group_by):
+                key, values = tuple(row[: len(group_by)]), row[len(group_by):]
+                current = totals.get(key)
+                totals[key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+        return [
+            dict(zip(group_by, key), **dict(zip(VALUE_FIELDS, values)))
+            for key, values in totals.items()
+        ]
+
+    def usage_series(
+        self,
+        start: datetime,
+        end: datetime,
+        *,
+        granularity: str = DAY,
+        agent_id: str = None,
+        group_by: Sequence[str] = (),
+    ) -> List[Dict]:
+        """按小时或按天返回 [start, end) 内各时间桶的用量，start 与 end 按粒度对齐"""
+        agent_id = self._require_agent(agent_id)
+        group_by = self._check_group_by(group_by)
+        model = ROLLUP_MODELS.get(granularity)
+        if model is None:
+            raise ValueError(f"不支持的汇总粒度: {granularity}")
+        columns = [getattr(model, name) for name in group_by]
+        query = (
+            model.select_unscoped(
+                model.bucket_start, *columns,
+                *(fn.SUM(getattr(model, name)) for name in VALUE_FIELDS),
+            )
+            .where(
+                (model.agent_id == agent_id)
+                & (model.bucket_start >= truncate(start, granularity))
+                & (model.bucket_start < _ceil(end, granularity))
+            )
+            .group_by(model.bucket_start, *columns)
+            .order_by(model.bucket_start)
+        )
+        names = ("bucket_start",) + tuple(group_by) + VALUE_FIELDS
+        return [dict(zip(names, row)) for row in query.tuples()]
+
+    def _segment(self, source, low, high, agent_id, group_by) -> Iterable[tuple]:
+        if source == "raw":
+            for model in LLMUsage.partitioner.models_for_range(low, high):
+                columns = [getattr(model, name) for name in group_by]
+                query = model.select_unscoped(*columns, *_value_sums(model)).where(
+                    (model.agent_id == agent_id) & (model.timestamp >= low) & (model.timestamp < high)
+                )
+                if columns:
+                    query = query.group_by(*columns)
+                yield from query.tuples()
+            return
+        model = ROLLUP_MODELS[source]
+        columns = [getattr(model, name) for name in group_by]
+        query = model.select_unscoped(
+            *columns, *(fn.COALESCE(fn.SUM(getattr(model, name)), 0) for name in VALUE_FIELDS)
+        ).where(model.agent_id == agent_id)
+        if low is not None:
+            query = query.where(model.bucket_start >= low)
+        if high is not None:
+            query = query.where(model.bucket_start < high)
+        if columns:
+            query = query.group_by(*columns)
+        yield from query.tuples()
+
+    @staticmethod
+    def _require_agent(agent_id):
+        agent_id = agent_id or get_current_agent_id()
+        if not agent_id:
+            raise ValueError("查询用量汇总时必须设置 agent_id")
+        return agent_id
+
+    @staticmethod
+    def _check_group_by(group_by) -> Tuple[str, ...]:
+        group_by = tuple(group_by)
+        for name in group_by:
+            if name not in KEY_FIELDS:
+                raise ValueError(f"不支持的分组字段: {name}")
+        return group_by
+
+
+class UsageRollupWorker(PeriodicWorker):
+    """定期重算最近几天的汇总，补齐批量导入等未经写入回调的明细
+
+    每个 Agent 单独重算并在 Agent 之间让出事件循环。
+    """
+
+    def __init__(self, rollup: UsageRollup = None, *, interval: float = 3600.0, lookback_days: int = 1):
+        super().__init__(interval)
+        if lookback_days < 0:
+            raise ValueError("lookback_days 不能为负数")
+        self.rollup = rollup or usage_rollup
+        self.lookback = timedelta(days=lookback_days)
+        self.last_rebuilt = 0
+
+    async def run_once(self):
+        start = truncate(datetime.now() - self.lookback, DAY)
+        agent_ids = await run_sync(self._agents_since, start)
+        rebuilt = 0
+        for agent_id in agent_ids:
+            rebuilt += await run_sync(self.rollup.rebuild, start, agent_id=agent_id)
+            await asyncio.sleep(0)
+        self.last_rebuilt = rebuilt
+
+    @staticmethod
+    def _agents_since(start: datetime) -> List[str]:
+        agent_ids = set()
+        for model in LLMUsage.partitioner.models_for_range(start):
+            query = model.select_unscoped(model.agent_id).where(model.timestamp >= start).distinct()
+            agent_ids.update(agent_id for (agent_id,) in query.tuples())
+        return sorted(agent_ids)
+
+
+# 全局用量汇总
+usage_rollup = UsageRollup()
+
+
+def usage_summary(start: datetime = None, end: datetime = None, **kwargs) -> List[Dict]:
+    """使用全局汇总查询用量，参数同 UsageRollup.usage_summary"""
+    return usage_rollup.usage_summary(start, end, **kwargs)
+
+
+__all__ = [
+    "UsageRollup",
+    "UsageRollupWorker",
+    "usage_rollup",
+    "usage_summary",
+]
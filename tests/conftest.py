@@ -0,0 +1,107 @@
+"""
+测试公共夹具
+每个测试使用独立的 SQLite 临时数据库，导入 maim_db 前先固定连接配置
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+# 数据库单例在导入时按 DATABASE_URL 创建，之后每个测试再切换到各自的数据库文件
+_BOOTSTRAP_DIR = tempfile.mkdtemp(prefix="maim_db_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{_BOOTSTRAP_DIR}/bootstrap.db"
+os.environ["TIME_PARTITIONING"] = "false"
+
+import pytest  # noqa: E402
+
+from maim_db.core.database import get_database  # noqa: E402
+from maim_db.core.models import (  # noqa: E402
+    ALL_MODELS,
+    ChatStreams,
+    LLMUsage,
+    Messages,
+)
+from maim_db.core.models.maimbot_models import _chat_stream_cache  # noqa: E402
+from maim_db.core.settings import settings  # noqa: E402
+
+PARTITIONED_MODELS = (Messages, LLMUsage)
+
+
+def reset_partitioner(model):
+    """丢弃分区结构的探测结果，切换数据库或配置后重新探测"""
+    partitioner = model.partitioner
+    partitioner._active = None
+    partitioner._known = None
+    partitioner._has_legacy = False
+    partitioner._scanned_at = 0.0
+
+
+@pytest.fixture
+def db(tmp_path):
+    """空白的临时数据库，已建好全部表"""
+    database = get_database()
+    database.close()
+    database.init(str(tmp_path / "test.db"), pragmas=database._pragmas)
+    for model in PARTITIONED_MODELS:
+        reset_partitioner(model)
+    _chat_stream_cache.clear()
+    database.connect()
+    database.create_tables(ALL_MODELS)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def partitioned(monkeypatch):
+    """启用按月分区；需在 db 夹具之前声明，使建表时即建立分区结构"""
+    monkeypatch.setattr(settings, "time_partitioning", True)
+
+
+def make_stream(agent_id="ag1", stream_id="s1", **fields):
+    """创建一个聊天流，字段可按需覆盖"""
+    values = {
+        "agent_id": agent_id,
+        "stream_id": stream_id,
+        "create_time": 1.0,
+        "last_active_time": 2.0,
+        "platform": "qq",
+        "user_platform": "qq",
+        "user_id": "u1",
+        "user_nickname": "nick",
+        "group_platform": "qq",
+        "group_id": "g1",
+        "group_name": "grp",
+    }
+    values.update(fields)
+    return ChatStreams.create(**values)
+
+
+def message_data(i, agent_id="ag1", stream_id="s1", timestamp=None, **fields):
+    """第 i 条测试消息的字段，message_id 为 m{i}"""
+    values = {
+        "agent_id": agent_id,
+        "message_id": f"m{i}",
+        "time": time.time() if timestamp is None else timestamp,
+        "chat_id": stream_id,
+        "chat_info_stream_id": stream_id,
+        "chat_info_platform": "qq",
+        "chat_info_user_platform": "qq",
+        "chat_info_user_id": "u1",
+        "chat_info_user_nickname": "nick",
+        "chat_info_group_platform": "qq",
+        "chat_info_group_id": "g1",
+        "chat_info_group_name": "grp",
+        "chat_info_create_time": 1.0,
+        "chat_info_last_active_time": 2.0,
+        "processed_plain_text": f"hello {i}",
+    }
+    values.update(fields)
+    return values
+
+
+def make_message(i, **kwargs):
+    return Messages.create(**message_data(i, **kwargs))
@@ -0,0 +1,58 @@
+"""AgentActiveState 心跳写入"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from maim_db.core.models import AgentActiveState
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def test_touch_returns_stored_row(db):
+    state = AgentActiveState.touch("t1", "a1", 60, current_time=NOW)
+
+    assert state.id is not None
+    assert state.expires_at == NOW + timedelta(seconds=60)
+    # 返回的记录带主键，save() 更新原行而不是再次插入
+    state.ttl_seconds = 120
+    state.save()
+    assert AgentActiveState.select().count() == 1
+    assert AgentActiveState.get_by_id(state.id).ttl_seconds == 120
+
+
+def test_touch_updates_existing_row(db):
+    first = AgentActiveState.touch("t1", "a1", 60, current_time=NOW)
+    later = NOW + timedelta(seconds=30)
+    second = AgentActiveState.touch("t1", "a1", 90, current_time=later)
+
+    assert second.id == first.id
+    assert second.last_seen_at == later
+    assert second.expires_at == later + timedelta(seconds=90)
+    assert AgentActiveState.select().count() == 1
+
+
+def test_touch_rejects_non_positive_ttl(db):
+    with pytest.raises(ValueError):
+        AgentActiveState.touch("t1", "a1", 0)
+
+
+def test_touch_many_keeps_latest_heartbeat_per_agent(db):
+    heartbeats = [
+        ("t1", "a1", 60, NOW + timedelta(seconds=10)),
+        ("t1", "a1", 60, NOW),
+        ("t1", "a2", 30, NOW),
+        ("t2", "a1", 60, NOW + timedelta(seconds=5)),
+    ]
+    assert AgentActiveState.touch_many(heartbeats, batch_size=2) == 3
+
+    states = {(s.tenant_id, s.agent_id): s for s in AgentActiveState.select()}
+    assert len(states) == 3
+    assert states[("t1", "a1")].last_seen_at == NOW + timedelta(seconds=10)
+    assert states[("t1", "a2")].expires_at == NOW + timedelta(seconds=30)
+
+
+def test_touch_many_uses_current_time_and_skips_empty(db):
+    assert AgentActiveState.touch_many([]) == 0
+    AgentActiveState.touch_many([("t1", "a1", 60)], current_time=NOW)
+    assert AgentActiveState.get().last_seen_at == NOW
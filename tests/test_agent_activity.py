@@ -0,0 +1,159 @@
+"""活跃 Agent 变更流、过期调度与过期记录清理"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from maim_db.core.agent_activity import (
+    ActiveAgentFeed,
+    ActiveStateRetention,
+    AgentExpiryScheduler,
+    ExpiryHeap,
+)
+from maim_db.core.models import AgentActiveState
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def _at(seconds):
+    return NOW + timedelta(seconds=seconds)
+
+
+# ---- 过期堆与增量变更流（user-028） ----
+
+
+def test_expiry_heap_keeps_latest_deadline():
+    heap = ExpiryHeap()
+    heap.set("a", _at(10))
+    heap.set("b", _at(20))
+    heap.set("a", _at(30))
+
+    assert heap.peek() == _at(20)
+    assert heap.pop_expired(_at(25)) == ["b"]
+    assert heap.pop_expired(_at(25)) == []
+    assert heap.get("a") == _at(30)
+    heap.discard("a")
+    assert len(heap) == 0 and heap.peek() is None
+
+
+def test_feed_reports_only_changes(db):
+    AgentActiveState.touch("t1", "a1", 60, current_time=NOW)
+    AgentActiveState.touch("t1", "a2", 20, current_time=NOW)
+    feed = ActiveAgentFeed(lookback_seconds=0)
+
+    first = feed.poll(current_time=_at(1))
+    assert sorted(first.became_active) == [("t1", "a1"), ("t1", "a2")]
+    assert first.became_inactive == []
+
+    AgentActiveState.touch("t1", "a3", 60, current_time=_at(5))
+    second = feed.poll(first.cursor, current_time=_at(10))
+    assert second.became_active == [("t1", "a3")]
+    assert second.became_inactive == []
+
+    # a2 在 NOW+20 过期；a1 续期后不会下线
+    AgentActiveState.touch("t1", "a1", 60, current_time=_at(15))
+    third = feed.poll(second.cursor, current_time=_at(25))
+    assert third.became_active == []
+    assert third.became_inactive == [("t1", "a2")]
+    assert sorted(feed.active_agents()) == [("t1", "a1"), ("t1", "a3")]
+
+
+def test_feed_resyncs_without_cursor(db):
+    AgentActiveState.touch("t1", "a1", 10, current_time=NOW)
+    feed = ActiveAgentFeed()
+    feed.poll(current_time=_at(1))
+
+    AgentActiveState.touch("t1", "a2", 60, current_time=_at(2))
+    changes = feed.poll(current_time=_at(30))
+    assert changes.became_active == [("t1", "a2")]
+    assert changes.became_inactive == [("t1", "a1")]
+
+
+# ---- 过期调度（user-029） ----
+
+
+def test_scheduler_fires_when_ttl_runs_out(db):
+    expired = []
+
+    async def scenario():
+        scheduler = AgentExpiryScheduler(lambda tenant_id, agent_id: expired.append(agent_id))
+        # 启动前已存在的记录由 reconcile() 载入
+        AgentActiveState.touch("t1", "a1", 60, current_time=datetime.utcnow() - timedelta(seconds=59.8))
+        await scheduler.start()
+        try:
+            # 运行中的 touch 通过监听器直接进入调度，不再读取数据库
+            AgentActiveState.touch("t1", "a2", 60, current_time=datetime.utcnow() - timedelta(seconds=59.9))
+            AgentActiveState.touch("t1", "a3", 60)
+            await asyncio.sleep(0.5)
+            assert scheduler.expires_at("t1", "a3") is not None
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(scenario())
+    assert sorted(expired) == ["a1", "a2"]
+
+
+def test_scheduler_renewal_postpones_expiry(db):
+    expired = []
+
+    async def on_expire(tenant_id, agent_id):
+        expired.append(agent_id)
+
+    async def scenario():
+        scheduler = AgentExpiryScheduler(on_expire)
+        await scheduler.start()
+        try:
+            AgentActiveState.touch("t1", "a1", 60, current_time=datetime.utcnow() - timedelta(seconds=59.8))
+            AgentActiveState.touch("t1", "a1", 60)
+            await asyncio.sleep(0.4)
+        finally:
+            await scheduler.stop()
+        assert scheduler.expires_at("t1", "a1") > datetime.utcnow()
+
+    asyncio.run(scenario())
+    assert expired == []
+
+
+# ---- 过期记录清理（user-030） ----
+
+
+def test_purge_expired_respects_grace_period(db):
+    AgentActiveState.touch("t1", "old", 10, current_time=NOW)
+    AgentActiveState.touch("t1", "recent", 10, current_time=_at(50))
+    AgentActiveState.touch("t1", "live", 600, current_time=NOW)
+
+    # old 在 NOW+10 过期，recent 在 NOW+60 过期；宽限 30 秒
+    assert AgentActiveState.purge_expired(30, current_time=_at(80)) == 1
+    remaining = sorted(s.agent_id for s in AgentActiveState.select())
+    assert remaining == ["live", "recent"]
+
+
+def test_purge_expired_runs_in_batches(db):
+    AgentActiveState.touch_many(
+        [("t1", f"a{i}", 10, NOW) for i in range(5)]
+    )
+    assert AgentActiveState.purge_expired_batch(_at(60), batch_size=2) == 2
+    assert AgentActiveState.purge_expired(0, batch_size=2, current_time=_at(60)) == 3
+    assert AgentActiveState.select().count() == 0
+
+
+def test_retention_worker_tracks_reclaimed_rows(db):
+    AgentActiveState.touch_many(
+        [("t1", f"a{i}", 10, NOW) for i in range(3)]
+        + [("t1", "live", 3600, NOW)]
+    )
+    retention = ActiveStateRetention(grace_seconds=60, batch_size=2)
+
+    assert asyncio.run(retention.purge(current_time=_at(30))) == 0
+    assert asyncio.run(retention.purge(current_time=_at(120))) == 3
+    assert retention.last_reclaimed == 3
+    assert retention.total_reclaimed == 3
+    assert [s.agent_id for s in AgentActiveState.select()] == ["live"]
+
+
+def test_retention_rejects_bad_arguments():
+    with pytest.raises(ValueError):
+        ActiveStateRetention(grace_seconds=-1)
+    with pytest.raises(ValueError):
+        ActiveStateRetention(grace_seconds=0, batch_size=0)
@@ -0,0 +1,62 @@
+"""消息冷存储归档"""
+
+import pytest
+from conftest import make_message
+
+from maim_db.core.archive import MessageArchive
+from maim_db.core.models import Messages
+
+DAY = 86400.0
+NOW = 1704067200.0 + 40 * DAY  # 2024-02-10
+
+
+@pytest.fixture
+def archive(db, tmp_path):
+    return MessageArchive(str(tmp_path / "archive"), retention_seconds=30 * DAY, batch_size=3)
+
+
+def test_archive_round_trip(archive):
+    # 1 月 1 日起每天一条，早于 1 月 11 日的 10 条超过保留期
+    for i in range(20):
+        make_message(i, timestamp=1704067200.0 + i * DAY, processed_plain_text=f"text {i}")
+    make_message(100, agent_id="ag2", timestamp=1704067200.0)
+
+    assert archive.expired_agents(NOW) == ["ag1", "ag2"]
+    assert archive.archive_all(current_time=NOW) == {"ag1": 10, "ag2": 1}
+    assert Messages.select_unscoped().where(Messages.agent_id == "ag1").count() == 10
+
+    index = archive.load_index("ag1")
+    assert list(index) == ["202401"]
+    assert index["202401"]["chats"] == ["s1"]
+
+    archived = list(archive.iter_archived("ag1", "s1"))
+    assert [row["message_id"] for row in archived] == [f"m{i}" for i in range(10)]
+    assert archived[3]["processed_plain_text"] == "text 3"
+    assert archived[3]["chat_info_group_name"] == "grp"
+    assert archive.archive_all(current_time=NOW) == {}
+
+
+def test_recent_messages_and_history_fall_back_to_archive(archive):
+    for i in range(20):
+        make_message(i, timestamp=1704067200.0 + i * DAY)
+    archive.archive_agent("ag1", current_time=NOW)
+
+    recent = archive.recent_messages("s1", limit=13, agent_id="ag1")
+    assert [m.message_id for m in recent] == [f"m{i}" for i in range(7, 20)]
+    assert isinstance(recent[0], Messages)
+
+    history = archive.history(
+        "s1", 1704067200.0 + 8 * DAY, 1704067200.0 + 12 * DAY, agent_id="ag1"
+    )
+    assert [m.message_id for m in history] == ["m8", "m9", "m10", "m11"]
+
+
+def test_repeated_segments_are_deduplicated(archive):
+    message = make_message(1, timestamp=1704067200.0)
+    row = Messages.select_unscoped().where(Messages.id == message.id).dicts().get()
+    # 模拟写入分段后删除失败、下一轮再次归档同一批记录
+    archive._append("ag1", "202401", [row])
+    archive.archive_agent("ag1", current_time=NOW)
+
+    assert [r["message_id"] for r in archive.iter_archived("ag1")] == ["m1"]
+    assert archive.load_index("ag1")["202401"]["count"] == 2
@@ -0,0 +1,99 @@
+"""计数器缓冲与批量刷写"""
+
+import asyncio
+
+import pytest
+
+from maim_db.core.counters import CounterBuffer, CounterFlushWorker
+from maim_db.core.models import Emoji, Images
+
+
+def _emoji(i, **fields):
+    values = {
+        "agent_id": "ag1",
+        "full_path": f"/emoji/{i}.png",
+        "format": "png",
+        "emoji_hash": f"h{i}",
+        "description": "d",
+        "record_time": 1.0,
+    }
+    values.update(fields)
+    return Emoji.create(**values)
+
+
+@pytest.fixture
+def counters():
+    buffer = CounterBuffer()
+    buffer.register(Emoji.usage_count, Emoji.query_count, Images.count)
+    return buffer
+
+
+def test_increments_accumulate_until_flush(db, counters):
+    first, second = _emoji(0), _emoji(1, usage_count=10)
+    for _ in range(3):
+        counters.increment(Emoji.usage_count, first.id)
+    counters.increment(Emoji.usage_count, second.id, 3)
+    counters.increment(Emoji.query_count, second.id, 2)
+
+    assert counters.pending(Emoji.usage_count, first.id) == 3
+    assert Emoji.get_by_id(first.id).usage_count == 0
+    assert len(counters) == 2
+
+    assert counters.flush() == 2
+    assert len(counters) == 0
+    assert counters.pending(Emoji.usage_count, first.id) == 0
+    assert Emoji.get_by_id(first.id).usage_count == 3
+    second = Emoji.get_by_id(second.id)
+    assert (second.usage_count, second.query_count) == (13, 2)
+    assert counters.flush() == 0
+
+
+def test_flush_keeps_latest_touch_value(db, counters):
+    fresh, stale = _emoji(0), _emoji(1, last_used_time=100.0)
+    for used_at in (30.0, 50.0, 40.0):
+        counters.increment(Emoji.usage_count, fresh.id, touch={Emoji.last_used_time: used_at})
+    counters.increment(Emoji.usage_count, stale.id, touch={Emoji.last_used_time: 60.0})
+    counters.flush()
+
+    # 原值为空时取新值，否则保留较大者
+    assert Emoji.get_by_id(fresh.id).last_used_time == 50.0
+    assert Emoji.get_by_id(stale.id).last_used_time == 100.0
+
+
+def test_failed_flush_restores_deltas(db, counters, monkeypatch):
+    emoji = _emoji(0)
+    counters.increment(Emoji.usage_count, emoji.id, 2)
+
+    def fail(*args):
+        counters.increment(Emoji.usage_count, emoji.id)
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(CounterBuffer, "_update", staticmethod(fail))
+    with pytest.raises(RuntimeError):
+        counters.flush()
+    monkeypatch.undo()
+
+    assert counters.pending(Emoji.usage_count, emoji.id) == 3
+    counters.flush()
+    assert Emoji.get_by_id(emoji.id).usage_count == 3
+
+
+def test_only_numeric_registered_fields(counters):
+    with pytest.raises(ValueError):
+        counters.register(Emoji.description)
+    with pytest.raises(ValueError):
+        counters.increment(Emoji.record_time, 1)
+
+
+def test_worker_flushes_on_stop(db, counters):
+    emoji = _emoji(0)
+
+    async def scenario():
+        worker = CounterFlushWorker(counters, interval=60)
+        worker.start()
+        counters.increment(Emoji.usage_count, emoji.id, 4)
+        await worker.stop()
+        return worker.last_flushed
+
+    assert asyncio.run(scenario()) == 1
+    assert Emoji.get_by_id(emoji.id).usage_count == 4
@@ -0,0 +1,100 @@
+"""图片与表情包描述缓存"""
+
+import pytest
+
+from maim_db.core.description_cache import DescriptionCache
+from maim_db.core.models import EmojiDescriptionCache, ImageDescriptions
+
+
+@pytest.fixture
+def descriptions(db):
+    cache = DescriptionCache(
+        ImageDescriptions,
+        ImageDescriptions.image_description_hash,
+        type_field=ImageDescriptions.type,
+        negative_ttl=60,
+        shared=False,
+    )
+    cache.enable()
+    yield cache
+    cache.disable()
+
+
+def _emoji_cache(shared):
+    cache = DescriptionCache(
+        EmojiDescriptionCache,
+        EmojiDescriptionCache.emoji_hash,
+        tags_field=EmojiDescriptionCache.emotion_tags,
+        negative_ttl=60,
+        shared=shared,
+    )
+    cache.enable()
+    return cache
+
+
+def test_description_put_and_get(descriptions):
+    assert descriptions.get("h1", "image", agent_id="ag1") is None
+    descriptions.put("h1", "a cat", "image", agent_id="ag1")
+
+    assert descriptions.get("h1", "image", agent_id="ag1").description == "a cat"
+    assert descriptions.get("h1", "emoji", agent_id="ag1") is None
+
+
+def test_negative_entries_skip_the_database(descriptions, monkeypatch):
+    assert descriptions.get("h1", "image", agent_id="ag1") is None
+
+    def fail(*args):
+        raise AssertionError("不应再次查询")
+
+    monkeypatch.setattr(descriptions, "_load", fail)
+    assert descriptions.get("h1", "image", agent_id="ag1") is None
+
+
+def test_description_cache_follows_saves_and_deletes(descriptions):
+    assert descriptions.get("h1", "image", agent_id="ag1") is None
+    row = ImageDescriptions.create(
+        agent_id="ag1", type="image", image_description_hash="h1", description="a cat", timestamp=1.0
+    )
+    assert descriptions.get("h1", "image", agent_id="ag1").description == "a cat"
+
+    row.description = "a dog"
+    row.save()
+    assert descriptions.get("h1", "image", agent_id="ag1").description == "a dog"
+
+    row.delete_instance()
+    assert descriptions.get("h1", "image", agent_id="ag1") is None
+
+
+def test_description_shared_between_agents(descriptions):
+    descriptions.put("h1", "a cat", "image", agent_id="ag2")
+    assert descriptions.get("h1", "image", agent_id="ag1") is None
+    shared = descriptions.get("h1", "image", agent_id="ag1", shared=True)
+    assert shared.description == "a cat" and shared.agent_id == "ag2"
+
+
+def test_description_requires_type(descriptions):
+    with pytest.raises(ValueError):
+        descriptions.put("h1", "a cat", agent_id="ag1")
+
+
+def test_unique_hash_owned_by_other_agent_without_sharing(db):
+    cache = _emoji_cache(shared=False)
+    try:
+        cache.put("e1", "smile", emotion_tags="开心", agent_id="ag2")
+        # 哈希已属于 ag2，未开启共享时不把 ag2 的描述返回给 ag1
+        assert cache.put("e1", "grin", emotion_tags="高兴", agent_id="ag1") is None
+        assert cache.get("e1", agent_id="ag1") is None
+        row = EmojiDescriptionCache.select_unscoped().get()
+        assert (row.agent_id, row.description) == ("ag2", "smile")
+    finally:
+        cache.disable()
+
+
+def test_unique_hash_owned_by_other_agent_with_sharing(db):
+    cache = _emoji_cache(shared=True)
+    try:
+        cache.put("e1", "smile", emotion_tags="开心", agent_id="ag2")
+        existing = cache.put("e1", "grin", agent_id="ag1")
+        assert (existing.agent_id, existing.description, existing.emotion_tags) == ("ag2", "smile", "开心")
+    finally:
+        cache.disable()
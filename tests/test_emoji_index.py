@@ -0,0 +1,66 @@
+"""表情包情感标签索引"""
+
+import time
+
+import pytest
+
+from maim_db.core.emoji_index import EmojiTagIndex
+from maim_db.core.models import Emoji
+
+
+def _emoji(i, **fields):
+    values = {
+        "agent_id": "ag1",
+        "full_path": f"/emoji/{i}.png",
+        "format": "png",
+        "emoji_hash": f"h{i}",
+        "description": "d",
+        "is_registered": True,
+        "emotion": "开心",
+        "record_time": 1.0,
+    }
+    values.update(fields)
+    return Emoji.create(**values)
+
+
+@pytest.fixture
+def emoji_index(db):
+    index = EmojiTagIndex(ttl=60)
+    yield index
+    index.disable()
+
+
+def test_emoji_index_tracks_saves(emoji_index):
+    emojis = [_emoji(i) for i in range(3)]
+    assert sorted(emoji_index.select_ids("开心", 5, agent_id="ag1")) == [e.id for e in emojis]
+
+    emojis[0].is_banned = True
+    emojis[0].save()
+    added = _emoji(3, emotion="难过")
+    assert sorted(emoji_index.select_ids("开心", 5, agent_id="ag1")) == [e.id for e in emojis[1:]]
+    assert emoji_index.select_ids("难过", 5, agent_id="ag1") == [added.id]
+
+    emojis[1].delete_instance()
+    assert emoji_index.select_ids("开心", 5, agent_id="ag1") == [emojis[2].id]
+
+
+def test_emoji_select_drops_rows_changed_elsewhere(emoji_index):
+    emojis = [_emoji(i) for i in range(2)]
+    emoji_index.select_ids("开心", 5, agent_id="ag1")
+    Emoji.update(is_banned=True).where(Emoji.id == emojis[0].id).execute()
+
+    assert [e.id for e in emoji_index.select("开心", 5, agent_id="ag1")] == [emojis[1].id]
+    assert emoji_index.select_ids("开心", 5, agent_id="ag1") == [emojis[1].id]
+
+
+def test_emoji_index_reloads_after_ttl(db):
+    index = EmojiTagIndex(ttl=0.05)
+    try:
+        emoji = _emoji(0)
+        assert index.select_ids("开心", agent_id="ag1") == [emoji.id]
+        Emoji.update(emotion="难过").execute()
+        time.sleep(0.1)
+        assert index.select_ids("开心", agent_id="ag1") == []
+        assert index.select_ids("难过", agent_id="ag1") == [emoji.id]
+    finally:
+        index.disable()
@@ -0,0 +1,72 @@
+"""流式数据导出"""
+
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+from conftest import make_message
+
+from maim_db.core.export import (
+    agent_export_query,
+    aiter_export,
+    iter_rows,
+    write_export,
+)
+from maim_db.core.models import Messages
+
+
+def test_agent_export_query_is_scoped_by_agent(db):
+    for i in range(3):
+        make_message(i)
+    make_message(9, agent_id="ag2")
+
+    rows = list(iter_rows(agent_export_query(Messages, "ag1")))
+    assert [row["message_id"] for row in rows] == ["m0", "m1", "m2"]
+    assert rows[0]["chat_info_platform"] == "qq"
+
+    tuples = list(iter_rows(agent_export_query(Messages, "ag2"), row_type="tuple"))
+    assert len(tuples) == 1 and isinstance(tuples[0], tuple)
+
+
+def test_write_jsonl_and_csv(db):
+    for i in range(3):
+        make_message(i, processed_plain_text=f"你好 {i}")
+    query = agent_export_query(Messages, "ag1")
+
+    out = io.StringIO()
+    assert write_export(query, out, "jsonl") == 3
+    lines = out.getvalue().splitlines()
+    assert json.loads(lines[1])["processed_plain_text"] == "你好 1"
+
+    out = io.StringIO()
+    assert write_export(query, out, "csv") == 3
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [row["message_id"] for row in rows] == ["m0", "m1", "m2"]
+
+
+def test_aiter_export_streams_through_bounded_queue(db):
+    for i in range(20):
+        make_message(i)
+    query = agent_export_query(Messages, "ag1")
+
+    async def collect(limit=None):
+        lines = []
+        async for line in aiter_export(query, max_pending=2):
+            lines.append(line)
+            if limit and len(lines) >= limit:
+                break
+        return lines
+
+    assert len(asyncio.run(collect())) == 20
+    # 消费端提前退出时读取线程随之停止
+    assert len(asyncio.run(collect(limit=3))) == 3
+
+
+def test_unknown_format_and_row_type(db):
+    query = agent_export_query(Messages, "ag1")
+    with pytest.raises(ValueError):
+        write_export(query, io.StringIO(), "xml")
+    with pytest.raises(ValueError):
+        list(iter_rows(query, row_type="object"))
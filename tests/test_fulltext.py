@@ -0,0 +1,74 @@
+"""全文检索：中日韩切词与 FTS5 查询"""
+
+import pytest
+from conftest import make_message
+
+from maim_db.core.fulltext import message_index, segment
+from maim_db.core.models import Messages
+
+
+@pytest.fixture
+def index(db):
+    message_index.enable()
+    yield message_index
+    message_index.disable()
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("我喜欢猫", "我喜 喜欢 欢猫 猫"),
+        ("猫", "猫"),
+        ("Hello 世界!", "hello 世界 界"),
+        ("", ""),
+        (None, ""),
+    ],
+)
+def test_segment(text, expected):
+    assert segment(text) == expected
+
+
+def _hits(index, query, agent_id="ag1"):
+    return sorted(hit.item.message_id for hit in index.search(query, agent_id=agent_id))
+
+
+def test_single_character_matches_anywhere_in_run(index):
+    make_message(1, processed_plain_text="我喜欢猫")
+    make_message(2, processed_plain_text="猫很可爱")
+    make_message(3, processed_plain_text="我喜欢狗")
+
+    assert _hits(index, "猫") == ["m1", "m2"]
+    assert _hits(index, "喜欢") == ["m1", "m3"]
+    assert _hits(index, "喜欢猫") == ["m1"]
+
+
+def test_search_is_scoped_by_agent_and_follows_writes(index):
+    message = make_message(1, processed_plain_text="今天天气不错")
+    make_message(1, agent_id="ag2", processed_plain_text="今天天气不错")
+    assert _hits(index, "天气") == ["m1"]
+
+    message.processed_plain_text = "明天下雨"
+    message.save()
+    assert _hits(index, "天气") == []
+    assert _hits(index, "下雨") == ["m1"]
+
+    message.delete_instance()
+    assert _hits(index, "下雨") == []
+
+
+def test_search_requires_agent(index):
+    with pytest.raises(ValueError):
+        index.search("猫")
+
+
+def test_bulk_writes_need_explicit_index_maintenance(index):
+    message = make_message(1, processed_plain_text="我喜欢猫")
+    Messages.update(processed_plain_text="我喜欢狗").execute()
+    # Model.update() 不触发回调，重建后索引才与原表一致
+    assert _hits(index, "狗") == []
+    index.rebuild()
+    assert _hits(index, "狗") == ["m1"]
+
+    index.remove_rows([message.id])
+    Messages.delete().execute()
+    assert _hits(index, "狗") == []
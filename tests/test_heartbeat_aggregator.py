@@ -0,0 +1,73 @@
+"""心跳聚合与批量刷写"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from maim_db.core.agent_activity import HeartbeatAggregator, heartbeat_aggregator
+from maim_db.core.async_models import AsyncAgentActiveState
+from maim_db.core.models import AgentActiveState
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def test_heartbeats_are_coalesced_per_agent(db):
+    aggregator = HeartbeatAggregator(flush_interval=5.0)
+    for second in range(10):
+        aggregator.record("t1", "a1", 60, current_time=NOW + timedelta(seconds=second))
+    aggregator.record("t1", "a2", 60, current_time=NOW)
+    assert aggregator.pending_count == 2
+    assert AgentActiveState.select().count() == 0
+
+    assert aggregator.flush_sync() == 2
+    assert aggregator.pending_count == 0
+    state = AgentActiveState.get(AgentActiveState.agent_id == "a1")
+    # expires_at 按最后一次心跳的时间计算，而不是刷写时间
+    assert state.expires_at == NOW + timedelta(seconds=69)
+    assert aggregator.flush_sync() == 0
+
+
+def test_ttl_must_exceed_flush_interval(db):
+    aggregator = HeartbeatAggregator(flush_interval=5.0)
+    with pytest.raises(ValueError):
+        aggregator.record("t1", "a1", 5)
+
+
+def test_failed_flush_keeps_newer_heartbeats(db, monkeypatch):
+    aggregator = HeartbeatAggregator(flush_interval=5.0)
+    aggregator.record("t1", "a1", 60, current_time=NOW)
+
+    def fail(heartbeats):
+        aggregator.record("t1", "a1", 60, current_time=NOW + timedelta(seconds=3))
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(AgentActiveState, "touch_many", fail)
+    with pytest.raises(RuntimeError):
+        aggregator.flush_sync()
+    monkeypatch.undo()
+
+    assert aggregator.flush_sync() == 1
+    assert AgentActiveState.get().last_seen_at == NOW + timedelta(seconds=3)
+
+
+def test_async_upsert_goes_through_running_aggregator(db):
+    async def scenario():
+        heartbeat_aggregator.start()
+        try:
+            state = await AsyncAgentActiveState.upsert("t1", "a1", 60)
+            assert state.expires_at == state.last_seen_at + timedelta(seconds=60)
+            assert heartbeat_aggregator.pending_count == 1
+            assert AgentActiveState.select().count() == 0
+        finally:
+            await heartbeat_aggregator.stop()
+
+    asyncio.run(scenario())
+    # stop() 时刷写剩余心跳
+    assert AgentActiveState.get().agent_id == "a1"
+
+
+def test_async_upsert_writes_directly_without_aggregator(db):
+    assert not heartbeat_aggregator.running
+    state = asyncio.run(AsyncAgentActiveState.upsert("t1", "a1", 60))
+    assert AgentActiveState.get().id == state._record.id
@@ -0,0 +1,94 @@
+"""内容寻址图片存储的引用计数与回收"""
+
+import os
+
+import pytest
+
+from maim_db.core.counters import CounterBuffer
+from maim_db.core.image_store import ImageStore, content_hash
+from maim_db.core.models import ImageBlob, Images
+
+PNG = b"\x89PNG fake image"
+
+
+@pytest.fixture
+def store(db, tmp_path):
+    image_store = ImageStore(str(tmp_path / "blobs"), grace_seconds=60, counters=CounterBuffer())
+    yield image_store
+    image_store.disable()
+
+
+def _blob():
+    return ImageBlob.get(ImageBlob.content_hash == content_hash(PNG))
+
+
+def test_same_content_stored_once_across_agents(store):
+    first = store.add_image(PNG, type="image", format="PNG", agent_id="ag1")
+    second = store.add_image(PNG, type="image", format="png", agent_id="ag2")
+
+    assert first.created and second.created
+    assert first.image.path == second.image.path == store.blob_path(first.blob)
+    assert os.path.exists(first.image.path)
+    assert ImageBlob.select().count() == 1
+    store.counters.flush()
+    assert _blob().ref_count == 2
+
+
+def test_repeated_image_increments_count(store):
+    first = store.add_image(PNG, type="image", format="png", agent_id="ag1")
+    again = store.add_image(PNG, type="image", format="png", agent_id="ag1")
+
+    assert not again.created and again.image.id == first.image.id
+    store.counters.flush()
+    assert Images.select_unscoped().get().count == 2
+    assert _blob().ref_count == 1
+
+
+def test_description_reused_from_other_agent(store):
+    store.add_image(PNG, type="image", format="png", agent_id="ag1", description="a cat")
+    reused = store.add_image(PNG, type="image", format="png", agent_id="ag2")
+    fresh = store.add_image(PNG, type="image", format="png", agent_id="ag3", reuse_description=False)
+
+    assert reused.image.description == "a cat" and reused.image.vlm_processed
+    assert fresh.image.description is None and not fresh.image.vlm_processed
+
+
+def test_gc_removes_unreferenced_after_grace(store):
+    stored = store.add_image(PNG, type="image", format="png", agent_id="ag1")
+    path = stored.image.path
+    stored.image.delete_instance()
+    store.counters.flush()
+    assert _blob().ref_count == 0
+
+    # 宽限期内保留
+    assert store.collect_garbage() == 0
+    assert os.path.exists(path)
+
+    assert store.collect_garbage(now=_blob().last_referenced_at + 61) == 1
+    assert ImageBlob.select().count() == 0
+    assert not os.path.exists(path)
+
+
+def test_gc_keeps_blob_referenced_despite_stale_count(store):
+    stored = store.add_image(PNG, type="image", format="png", agent_id="ag1")
+    store.counters.flush()
+    # 引用计数偏差不会导致误删，是否被引用以 images 表为准
+    ImageBlob.update(ref_count=0, last_referenced_at=0).execute()
+
+    assert store.collect_garbage() == 0
+    assert os.path.exists(stored.image.path)
+    assert store.reconcile_refcounts() == 1
+    assert _blob().ref_count == 1
+
+
+def test_reregistering_collected_content_rewrites_file(store):
+    stored = store.add_image(PNG, type="image", format="png", agent_id="ag1")
+    path = stored.image.path
+    stored.image.delete_instance()
+    store.collect_garbage(now=10 ** 12)
+    assert not os.path.exists(path)
+
+    again = store.add_image(PNG, type="image", format="png", agent_id="ag1")
+    assert again.image.path == path
+    with open(path, "rb") as f:
+        assert f.read() == PNG
@@ -0,0 +1,112 @@
+"""聊天最近消息缓存"""
+
+import pytest
+from conftest import make_message, message_data
+
+from maim_db.core.message_cache import RecentMessageCache
+from maim_db.core.models import Messages
+
+
+@pytest.fixture
+def message_cache(db):
+    cache = RecentMessageCache(max_bytes=1 << 20)
+    cache.enable()
+    yield cache
+    cache.disable()
+
+
+def _ids(messages):
+    return [message.message_id for message in messages]
+
+
+def test_recent_messages_served_from_cache(message_cache):
+    for i in range(3):
+        make_message(i, timestamp=float(i))
+
+    first = message_cache.get_recent("s1", 2, agent_id="ag1")
+    assert _ids(first) == ["m1", "m2"]
+    assert message_cache.misses == 1
+
+    make_message(3, timestamp=3.0)
+    second = message_cache.get_recent("s1", 2, agent_id="ag1")
+    assert _ids(second) == ["m2", "m3"]
+    assert message_cache.hits == 1
+    assert message_cache.misses == 1
+
+
+def test_create_if_absent_is_appended_after_commit(message_cache):
+    make_message(0, timestamp=0.0)
+    message_cache.get_recent("s1", agent_id="ag1")
+
+    Messages.create_if_absent(**message_data(1, timestamp=1.0))
+    assert _ids(message_cache.get_recent("s1", agent_id="ag1")) == ["m0", "m1"]
+    assert message_cache.misses == 1
+
+
+def test_rolled_back_write_is_not_cached(message_cache, db):
+    make_message(0, timestamp=0.0)
+    message_cache.get_recent("s1", agent_id="ag1")
+
+    with pytest.raises(RuntimeError):
+        with db.atomic():
+            make_message(1, timestamp=1.0)
+            # 事务中的读取不写入缓存
+            assert _ids(message_cache.get_recent("s1", agent_id="ag1")) == ["m0", "m1"]
+            raise RuntimeError("rollback")
+
+    assert _ids(message_cache.get_recent("s1", agent_id="ag1")) == ["m0"]
+
+
+def test_write_inside_caller_transaction_is_refilled_after_commit(message_cache, db):
+    make_message(0, timestamp=0.0)
+    message_cache.get_recent("s1", agent_id="ag1")
+
+    with db.atomic():
+        make_message(1, timestamp=1.0)
+    assert len(message_cache) == 0
+    assert _ids(message_cache.get_recent("s1", agent_id="ag1")) == ["m0", "m1"]
+    assert message_cache.misses == 2
+
+
+def test_returned_messages_are_copies(message_cache):
+    make_message(0, timestamp=0.0)
+    message_cache.get_recent("s1", agent_id="ag1")[0].processed_plain_text = "mutated"
+    make_message(1, timestamp=1.0)
+    cached = message_cache.get_recent("s1", agent_id="ag1")
+    assert [m.processed_plain_text for m in cached] == ["hello 0", "hello 1"]
+    cached[1].processed_plain_text = "mutated"
+    assert message_cache.get_recent("s1", agent_id="ag1")[1].processed_plain_text == "hello 1"
+
+
+def test_recent_messages_follow_updates_and_deletes(message_cache):
+    for i in range(3):
+        make_message(i, timestamp=float(i))
+    message_cache.get_recent("s1", agent_id="ag1")
+
+    newest = Messages.get(Messages.message_id == "m2")
+    newest.processed_plain_text = "edited"
+    newest.save()
+    assert message_cache.get_recent("s1", 1, agent_id="ag1")[0].processed_plain_text == "edited"
+
+    newest.delete_instance()
+    assert _ids(message_cache.get_recent("s1", agent_id="ag1")) == ["m0", "m1"]
+
+
+def test_recent_messages_before_and_out_of_order_writes(message_cache):
+    for i in (0, 2):
+        make_message(i, timestamp=float(i))
+    message_cache.get_recent("s1", agent_id="ag1")
+    make_message(1, timestamp=1.0)
+
+    recent = message_cache.get_recent("s1", agent_id="ag1")
+    assert [message.time for message in recent] == [0.0, 1.0, 2.0]
+    before = message_cache.get_recent("s1", before=2.0, agent_id="ag1")
+    assert [message.time for message in before] == [0.0, 1.0]
+
+
+def test_recent_messages_beyond_capacity_fall_back_to_database(message_cache):
+    for i in range(25):
+        make_message(i, timestamp=float(i))
+    assert message_cache.capacity_for("ag1") == 18
+    assert len(message_cache.get_recent("s1", 25, agent_id="ag1")) == 25
+    assert message_cache.nbytes == 0
@@ -0,0 +1,71 @@
+"""消息按 (agent_id, message_id) 去重"""
+
+import pytest
+from conftest import make_message, message_data
+from peewee import IntegrityError
+
+from maim_db.core.dedup import MessageIngestor
+from maim_db.core.models import ALL_MODELS, Messages
+
+
+def test_create_if_absent_ignores_duplicates(db):
+    first = Messages.create_if_absent(**message_data(1))
+    assert first is not None and first.id
+    assert Messages.create_if_absent(**message_data(1, processed_plain_text="again")) is None
+    assert Messages.select_unscoped().count() == 1
+
+
+def test_same_message_id_in_another_agent_is_kept(db):
+    Messages.create_if_absent(**message_data(1))
+    assert Messages.create_if_absent(**message_data(1, agent_id="ag2")) is not None
+    assert Messages.select_unscoped().count() == 2
+
+
+def test_save_rejects_redelivered_message(db):
+    make_message(1)
+    with pytest.raises(IntegrityError):
+        make_message(1, processed_plain_text="again")
+    assert Messages.select_unscoped().count() == 1
+
+
+def test_ingest_returns_existing_row_for_redelivery(db):
+    ingestor = MessageIngestor()
+    original, created = ingestor.ingest(**message_data(1))
+    assert created
+
+    again, created = ingestor.ingest(**message_data(1, processed_plain_text="again"))
+    assert not created
+    assert again.id == original.id
+    assert again.processed_plain_text == "hello 1"
+    assert (ingestor.inserted, ingestor.duplicates) == (1, 1)
+
+    # 由其他写入方先写入的消息同样识别为重复
+    make_message(2)
+    assert ingestor.ingest(**message_data(2))[1] is False
+    assert Messages.select_unscoped().count() == 2
+
+
+def test_startup_refuses_to_index_duplicates(db):
+    db.execute_sql("DROP INDEX messages_agent_id_message_id")
+    make_message(1)
+    make_message(1, processed_plain_text="duplicate")
+
+    with pytest.raises(RuntimeError, match="migrate_unique_message_ids.py"):
+        db.create_tables(ALL_MODELS)
+    # 建表时不删除任何数据
+    assert Messages.select_unscoped().count() == 2
+
+    Messages.remove_duplicate_messages()
+    db.create_tables(ALL_MODELS)
+    assert "messages_agent_id_message_id" in {index.name for index in db.get_indexes("messages")}
+
+
+def test_remove_duplicate_messages_in_batches(db):
+    db.execute_sql("DROP INDEX messages_agent_id_message_id")
+    keep = make_message(0)
+    for i in range(3):
+        make_message(i)
+        make_message(i)
+    assert Messages.remove_duplicate_messages(batch_size=2) == 4
+    assert Messages.select_unscoped().count() == 3
+    assert Messages.select_unscoped().where(Messages.message_id == "m0").get().id == keep.id
@@ -0,0 +1,88 @@
+"""消息存储、聊天流关联与最近消息查询"""
+
+import time
+
+import pytest
+from conftest import make_message, make_stream
+
+from maim_db.core.models import ChatStreams, Messages
+from maim_db.core.settings import settings
+
+# ---- 聊天流关联与缓存（user-031） ----
+
+
+def test_chat_stream_cache_invalidated_by_save(db):
+    stream = make_stream()
+    assert ChatStreams.get_cached(stream.id).group_name == "grp"
+
+    stream.group_name = "renamed"
+    stream.save()
+    assert ChatStreams.get_cached(stream.id).group_name == "renamed"
+    assert ChatStreams.get_cached_by_stream_id("s1").group_name == "renamed"
+
+
+def test_chat_stream_cache_expires(db, monkeypatch):
+    monkeypatch.setattr(settings, "chat_stream_cache_ttl", 0.05)
+    stream = make_stream()
+    assert ChatStreams.get_cached(stream.id).platform == "qq"
+    ChatStreams.update(platform="other").execute()
+    assert ChatStreams.get_cached(stream.id).platform == "qq"
+
+    time.sleep(0.1)
+    assert ChatStreams.get_cached(stream.id).platform == "other"
+
+
+def test_message_is_linked_to_its_stream(db):
+    stream = make_stream()
+    message = make_message(1)
+    orphan = make_message(2, stream_id="unknown")
+
+    loaded = Messages.get_by_id(message.id)
+    assert loaded.stream_ref == stream.id
+    assert loaded.chat_stream.stream_id == "s1"
+    assert Messages.get_by_id(orphan.id).stream_ref is None
+
+
+def test_stream_of_another_agent_is_not_linked(db):
+    make_stream(agent_id="ag2")
+    message = make_message(1)
+    assert Messages.get_by_id(message.id).stream_ref is None
+
+
+def test_chat_info_columns_are_stored_per_row(db):
+    stream = make_stream()
+    make_message(1)
+    stream.group_name = "renamed"
+    stream.save()
+
+    # 过滤与 .dicts() 直接读取列值，不依赖聊天流
+    rows = list(
+        Messages.select_unscoped()
+        .where((Messages.chat_info_platform == "qq") & (Messages.chat_info_group_id == "g1"))
+        .dicts()
+    )
+    assert len(rows) == 1
+    assert rows[0]["chat_info_stream_id"] == "s1"
+    assert rows[0]["chat_info_group_name"] == "grp"
+    assert rows[0]["chat_info_create_time"] == 1.0
+
+
+# ---- 最近消息查询（user-032） ----
+
+
+def test_recent_messages_returns_latest_in_time_order(db):
+    for i in range(10):
+        make_message(i, timestamp=1000.0 + i)
+    make_message(100, stream_id="s2", timestamp=2000.0)
+    make_message(101, agent_id="ag2", timestamp=2000.0)
+
+    recent = Messages.recent_messages("s1", limit=3, agent_id="ag1")
+    assert [m.message_id for m in recent] == ["m7", "m8", "m9"]
+
+    before = Messages.recent_messages("s1", before=1005.0, limit=3, agent_id="ag1")
+    assert [m.message_id for m in before] == ["m2", "m3", "m4"]
+
+
+def test_recent_messages_requires_agent(db):
+    with pytest.raises(ValueError):
+        Messages.recent_messages("s1")
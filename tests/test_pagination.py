@@ -0,0 +1,73 @@
+"""键集分页"""
+
+import pytest
+from conftest import make_message
+
+from maim_db.core.models import Messages
+from maim_db.core.pagination import decode_cursor, encode_cursor, keyset_paginate
+
+
+def _walk(limit, descending):
+    seen, cursor, pages = [], None, 0
+    while True:
+        items, cursor = Messages.keyset_paginate(
+            cursor,
+            limit,
+            order_by=("time", "id"),
+            descending=descending,
+            query=Messages.select_unscoped(),
+        )
+        seen.extend((message.time, message.id) for message in items)
+        pages += 1
+        if cursor is None:
+            return seen, pages
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_walk_with_ties_visits_every_row_once(db, descending):
+    # 每 4 条共用一个时间，翻页边界落在相同时间的记录之间
+    for i in range(30):
+        make_message(i, timestamp=1000.0 + i // 4)
+
+    seen, pages = _walk(7, descending)
+
+    assert len(seen) == 30
+    assert seen == sorted(seen, reverse=descending)
+    assert pages == 5
+
+
+def test_default_order_is_ascending_primary_key(db):
+    for i in range(3):
+        make_message(i)
+    items, cursor = Messages.keyset_paginate(limit=5, query=Messages.select_unscoped())
+    assert [message.id for message in items] == sorted(message.id for message in items)
+    assert cursor is None
+
+
+def test_dicts_query(db):
+    for i in range(3):
+        make_message(i, timestamp=float(i))
+    query = Messages.select_unscoped(Messages.id, Messages.time).dicts()
+    items, cursor = keyset_paginate(query, (Messages.time, Messages.id), limit=2)
+    assert [row["time"] for row in items] == [0.0, 1.0]
+    items, cursor = keyset_paginate(query, (Messages.time, Messages.id), cursor, limit=2)
+    assert [row["time"] for row in items] == [2.0]
+    assert cursor is None
+
+
+def test_cursor_round_trip():
+    fields = (Messages.time, Messages.id)
+    assert decode_cursor(encode_cursor([1.5, 7]), fields) == [1.5, 7]
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor!", encode_cursor([1.0])])
+def test_invalid_cursor(db, cursor):
+    with pytest.raises(ValueError):
+        keyset_paginate(Messages.select_unscoped(), (Messages.time, Messages.id), cursor)
+
+
+def test_invalid_arguments(db):
+    with pytest.raises(ValueError):
+        keyset_paginate(Messages.select_unscoped(), (Messages.id,), limit=0)
+    with pytest.raises(ValueError):
+        keyset_paginate(Messages.select_unscoped(), ())
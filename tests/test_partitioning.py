@@ -0,0 +1,107 @@
+"""按月分区：合并视图读写、共享 id 序列与存量表转换"""
+
+import pytest
+from conftest import make_message, make_stream, message_data, reset_partitioner
+
+from maim_db.core.models import ALL_MODELS, Messages
+from maim_db.core.settings import settings
+
+JAN = 1704100000.0  # 2024-01
+FEB = 1706800000.0  # 2024-02
+MAR = 1709300000.0  # 2024-03
+
+
+def test_base_model_reads_every_partition(partitioned, db):
+    assert Messages.partitioner.enabled
+    make_stream()
+    first = make_message(1, timestamp=JAN)
+    second = make_message(2, timestamp=FEB)
+
+    assert type(first).__name__ == "Messages_202401"
+    assert type(second).__name__ == "Messages_202402"
+    assert first.id != second.id
+    assert Messages.select_unscoped().count() == 2
+    assert Messages.get_by_id(second.id).message_id == "m2"
+
+
+def test_insert_many_routes_rows_and_assigns_unique_ids(partitioned, db):
+    rows = [message_data(i, timestamp=timestamp) for i, timestamp in enumerate((JAN, FEB, MAR, FEB))]
+    Messages.insert_many(rows).execute()
+    make_message(9, timestamp=MAR)
+
+    partitioner = Messages.partitioner
+    assert {202401, 202402, 202403} <= set(partitioner.existing_keys())
+    ids = [message.id for message in Messages.select_unscoped()]
+    assert len(ids) == 5
+    assert len(set(ids)) == 5
+
+
+def test_insert_many_on_conflict_ignore_skips_duplicates(partitioned, db):
+    make_message(1, timestamp=JAN)
+    query = Messages.insert_many(
+        [message_data(1, timestamp=JAN), message_data(2, timestamp=JAN)]
+    ).on_conflict_ignore()
+    assert query.as_rowcount().execute() == 1
+    assert Messages.select_unscoped().count() == 2
+
+
+def test_keyset_pagination_spans_partitions(partitioned, db):
+    for i, timestamp in enumerate((MAR, JAN, FEB, JAN + 1, FEB + 1)):
+        make_message(i, timestamp=timestamp)
+
+    seen, cursor = [], None
+    while True:
+        items, cursor = Messages.keyset_paginate(
+            cursor, 2, order_by=("time", "id"), query=Messages.select_unscoped()
+        )
+        seen.extend(message.time for message in items)
+        if cursor is None:
+            break
+    assert seen == sorted([MAR, JAN, FEB, JAN + 1, FEB + 1])
+
+
+def test_update_and_delete_through_view(partitioned, db):
+    message = make_message(1, timestamp=JAN)
+    loaded = Messages.get_by_id(message.id)
+    loaded.processed_plain_text = "changed"
+    loaded.save()
+    assert Messages.get_by_id(message.id).processed_plain_text == "changed"
+
+    Messages.get_by_id(message.id).delete_instance()
+    assert Messages.select_unscoped().count() == 0
+
+
+def test_recent_messages_and_drop_partitions(partitioned, db):
+    for i, timestamp in enumerate((JAN, FEB, MAR)):
+        make_message(i, timestamp=timestamp)
+    recent = Messages.recent_messages("s1", limit=2, agent_id="ag1")
+    assert [message.message_id for message in recent] == ["m1", "m2"]
+
+    dropped = Messages.partitioner.drop_partitions_before(1706745600.0)  # 2024-02-01
+    assert dropped == ["messages_202401"]
+    assert Messages.select_unscoped().count() == 2
+
+
+def test_existing_table_is_kept_as_legacy(db, monkeypatch):
+    make_stream()
+    make_message(1, timestamp=1600000000.0)
+    assert not Messages.partitioner.enabled
+
+    monkeypatch.setattr(settings, "time_partitioning", True)
+    reset_partitioner(Messages)
+    db.create_tables(ALL_MODELS)
+
+    partitioner = Messages.partitioner
+    assert partitioner.enabled
+    assert db.table_exists("messages_legacy")
+    new = make_message(2, timestamp=JAN)
+    assert new.id > 1
+    assert Messages.select_unscoped().count() == 2
+    assert partitioner.models_for_range()[-1] is partitioner.legacy_model()
+
+
+def test_partition_requires_time(partitioned, db):
+    rows = [message_data(1, timestamp=JAN)]
+    rows[0]["time"] = None
+    with pytest.raises(ValueError):
+        Messages.insert_many(rows).execute()
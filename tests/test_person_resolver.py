@@ -0,0 +1,78 @@
+"""人物信息读穿透缓存"""
+
+import pytest
+
+from maim_db.core.counters import CounterBuffer, counter_buffer
+from maim_db.core.models import PersonInfo
+from maim_db.core.person_resolver import PersonResolver
+
+
+@pytest.fixture
+def resolver(db):
+    resolver = PersonResolver(max_entries=64, ttl=60, counters=CounterBuffer())
+    yield resolver
+    resolver.disable()
+
+
+def _person(**fields):
+    values = {
+        "agent_id": "ag1",
+        "person_id": "p1",
+        "platform": "qq",
+        "user_id": "u1",
+        "nickname": "nick",
+        "know_times": 0,
+    }
+    values.update(fields)
+    return PersonInfo.create(**values)
+
+
+def test_resolver_caches_missing_and_sees_new_rows(resolver):
+    assert resolver.resolve("qq", "u1", agent_id="ag1") is None
+    person = _person()
+    assert resolver.resolve("qq", "u1", agent_id="ag1").id == person.id
+    assert resolver.resolve("qq", "u1", agent_id="ag2") is None
+
+
+def test_resolver_hits_skip_the_database(resolver, monkeypatch):
+    _person()
+    assert resolver.resolve("qq", "u1", agent_id="ag1") is not None
+
+    def fail(*args, **kwargs):
+        raise AssertionError("不应再次查询")
+
+    monkeypatch.setattr(PersonInfo, "select_unscoped", fail)
+    assert resolver.resolve("qq", "u1", agent_id="ag1").nickname == "nick"
+
+
+def test_resolver_update_and_delete(resolver):
+    person = _person()
+    cached = resolver.resolve("qq", "u1", agent_id="ag1")
+    resolver.update(cached, nickname="renamed")
+    assert PersonInfo.get_by_id(person.id).nickname == "renamed"
+    assert resolver.resolve("qq", "u1", agent_id="ag1").nickname == "renamed"
+
+    PersonInfo.get_by_id(person.id).delete_instance()
+    assert resolver.resolve("qq", "u1", agent_id="ag1") is None
+
+
+def test_update_does_not_overwrite_buffered_counts(resolver):
+    person = _person()
+    cached = resolver.resolve("qq", "u1", agent_id="ag1")
+    PersonInfo.update(know_times=5).execute()
+    resolver.update(cached, nickname="renamed")
+    assert PersonInfo.get_by_id(person.id).know_times == 5
+
+
+def test_record_interaction_is_buffered(resolver):
+    person = _person()
+    resolver.record_interaction(person, now=100.0)
+    resolver.record_interaction(person, now=200.0)
+    assert PersonInfo.get_by_id(person.id).know_times == 0
+    # 使用传入的计数器缓冲而不是全局缓冲
+    assert counter_buffer.pending(PersonInfo.know_times, person.id) == 0
+
+    resolver.counters.flush()
+    stored = PersonInfo.get_by_id(person.id)
+    assert stored.know_times == 2
+    assert stored.last_know == 200.0
@@ -0,0 +1,110 @@
+"""感知哈希 BK 树与近似去重索引"""
+
+import random
+
+import pytest
+
+from maim_db.core.models import Emoji
+from maim_db.core.phash_index import (
+    BKTree,
+    PerceptualHashIndex,
+    format_hash,
+    parse_hash,
+)
+
+
+def _emoji(i, phash, **fields):
+    values = {
+        "agent_id": "ag1",
+        "full_path": f"/emoji/{i}.png",
+        "format": "png",
+        "emoji_hash": f"h{i}",
+        "perceptual_hash": phash,
+        "description": f"desc {i}",
+        "record_time": 1.0,
+    }
+    values.update(fields)
+    return Emoji.create(**values)
+
+
+@pytest.fixture
+def phash_index(db):
+    index = PerceptualHashIndex(Emoji)
+    index.enable()
+    yield index
+    index.disable()
+
+
+def test_parse_and_format_hash():
+    assert parse_hash("ff") == 255
+    assert format_hash(255) == "00000000000000ff"
+    with pytest.raises(ValueError):
+        parse_hash("not-hex")
+    with pytest.raises(ValueError):
+        parse_hash(1 << 64)
+
+
+def test_bk_tree_radius_search_matches_brute_force():
+    rng = random.Random(7)
+    base = rng.getrandbits(64)
+    hashes = {}
+    for item_id in range(300):
+        value = base
+        # 一半为基准哈希的轻微变体，一半为随机值
+        if item_id % 2:
+            value = rng.getrandbits(64)
+        else:
+            for bit in rng.sample(range(64), rng.randint(0, 10)):
+                value ^= 1 << bit
+        hashes[item_id] = value
+    tree = BKTree()
+    for item_id, value in hashes.items():
+        tree.add(item_id, value)
+
+    for radius in (0, 3, 6, 12):
+        expected = sorted(
+            (bin(value ^ base).count("1"), item_id)
+            for item_id, value in hashes.items()
+            if bin(value ^ base).count("1") <= radius
+        )
+        assert tree.search(base, radius) == expected
+
+
+def test_bk_tree_remove_and_readd():
+    tree = BKTree()
+    tree.add(1, 0b1111)
+    tree.add(2, 0b1111)
+    tree.add(3, 0b0111)
+    tree.remove(1)
+    assert tree.search(0b1111, 0) == [(0, 2)]
+    tree.add(3, 0b1111)
+    assert tree.search(0b1111, 0) == [(0, 2), (0, 3)]
+    assert tree.search(0b0111, 0) == []
+    assert len(tree) == 2
+
+
+def test_index_finds_near_duplicates(phash_index):
+    near = _emoji(0, format_hash(0b1111))
+    far = _emoji(1, format_hash(0xFFFF0000))
+    _emoji(2, format_hash(0b1111), agent_id="ag2")
+
+    matches = phash_index.find_similar(0b0111, 2, agent_id="ag1")
+    assert [(m.item.id, m.distance) for m in matches] == [(near.id, 1)]
+    assert phash_index.find_similar(0xFFFF0000, 0, agent_id="ag1")[0].item.id == far.id
+    with pytest.raises(ValueError):
+        phash_index.find_similar(0, 65, agent_id="ag1")
+
+
+def test_index_follows_writes_after_load(phash_index):
+    first = _emoji(0, format_hash(1))
+    assert len(phash_index.find_similar(1, 0, agent_id="ag1")) == 1
+
+    second = _emoji(1, format_hash(3), description="")
+    first.perceptual_hash = format_hash(0xFF00)
+    first.save()
+    assert [m.item.id for m in phash_index.find_similar(1, 1, agent_id="ag1")] == [second.id]
+    # 最相近的记录没有描述时，复用次近且有描述的记录
+    assert phash_index.reusable_description(3, 16, agent_id="ag1").item.id == first.id
+
+    first.delete_instance()
+    assert phash_index.find_similar(0xFF00, 0, agent_id="ag1") == []
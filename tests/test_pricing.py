@@ -0,0 +1,112 @@
+"""模型价格缓存与历史成本重算"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from maim_db.core.models import LLMUsage, LLMUsageDaily, ModelInfoModel
+from maim_db.core.pricing import PricingResolver, areprice_usage, reprice_usage
+
+START = datetime(2024, 1, 1, 0, 0, 0)
+
+
+def _price(name, identifier, price_in, price_out, agent_id="ag1"):
+    return ModelInfoModel.create(
+        id=f"{agent_id}-{name}",
+        agent_id=agent_id,
+        name=name,
+        model_identifier=identifier,
+        provider_name="openai",
+        price_in=price_in,
+        price_out=price_out,
+    )
+
+
+def _usage(model_name, assign_name=None, *, hours=0, agent_id="ag1"):
+    return {
+        "agent_id": agent_id,
+        "model_name": model_name,
+        "model_assign_name": assign_name,
+        "user_id": "u1",
+        "request_type": "chat",
+        "endpoint": "/v1/chat",
+        "prompt_tokens": 1000,
+        "completion_tokens": 500,
+        "total_tokens": 1500,
+        "cost": 0.0,
+        "status": "success",
+        "timestamp": START + timedelta(hours=hours),
+    }
+
+
+def _costs():
+    return [round(usage.cost, 9) for usage in LLMUsage.select_unscoped().order_by(LLMUsage.id)]
+
+
+def test_resolver_matches_name_then_identifier(db):
+    _price("main", "gpt-4o", 2.0, 8.0)
+    resolver = PricingResolver()
+    assert resolver.resolve("ag1", "main").model_identifier == "gpt-4o"
+    assert resolver.resolve("ag1", "gpt-4o").name == "main"
+    assert resolver.resolve("ag1", "unknown") is None
+    assert resolver.compute_cost("ag1", "main", 1_000_000, 500_000) == pytest.approx(6.0)
+    assert resolver.compute_cost("ag1", "unknown", 10, 10) == 0.0
+
+
+def test_resolver_caches_until_invalidated(db):
+    price = _price("main", "gpt-4o", 2.0, 8.0)
+    resolver = PricingResolver(ttl=3600)
+    assert resolver.resolve("ag1", "main").price_in == 2.0
+
+    ModelInfoModel.update(price_in=3.0).where(ModelInfoModel.id == price.id).execute()
+    assert resolver.resolve("ag1", "main").price_in == 2.0
+    resolver.invalidate("ag1")
+    assert resolver.resolve("ag1", "main").price_in == 3.0
+
+    expiring = PricingResolver(ttl=0)
+    ModelInfoModel.update(price_in=4.0).where(ModelInfoModel.id == price.id).execute()
+    assert expiring.resolve("ag1", "main").price_in == 4.0
+
+
+def test_reprice_updates_matching_rows_with_case(db):
+    _price("main", "gpt-4o", 2.0, 8.0)
+    _price("cheap", "gpt-4o-mini", 0.2, 0.8)
+    _price("main", "gpt-4o", 9.0, 9.0, agent_id="ag2")
+    LLMUsage.insert_many([
+        _usage("gpt-4o", "main"),
+        _usage("gpt-4o-mini", "cheap"),
+        _usage("gpt-4o"),  # 没有模型代号的旧记录按实际模型ID匹配
+        _usage("claude", "other"),  # 未配置价格，保持原值
+        _usage("gpt-4o", "main", agent_id="ag2"),
+    ]).execute()
+
+    assert reprice_usage("ag1", batch_size=2, rebuild_rollups=False) == 3
+    assert _costs() == [0.006, 0.0006, 0.006, 0.0, 0.0]
+
+
+def test_reprice_filters_models_and_time_and_rebuilds_rollups(db):
+    _price("main", "gpt-4o", 2.0, 8.0)
+    _price("cheap", "gpt-4o-mini", 0.2, 0.8)
+    LLMUsage.insert_many([
+        _usage("gpt-4o", "main", hours=1),
+        _usage("gpt-4o", "main", hours=30),
+        _usage("gpt-4o-mini", "cheap", hours=1),
+    ]).execute()
+
+    updated = reprice_usage(
+        "ag1", model_names=["main"], start=START, end=START + timedelta(days=1)
+    )
+    assert updated == 1
+    assert _costs() == [0.006, 0.0, 0.0]
+    daily = LLMUsageDaily.select_unscoped().where(LLMUsageDaily.bucket_start == START)
+    assert sum(row.cost for row in daily) == pytest.approx(0.006)
+
+
+def test_async_reprice(db):
+    _price("main", "gpt-4o", 2.0, 8.0)
+    LLMUsage.insert_many([_usage("gpt-4o", "main", hours=h) for h in range(5)]).execute()
+    assert asyncio.run(areprice_usage("ag1", batch_size=2, rebuild_rollups=False)) == 5
+    assert _costs() == [0.006] * 5
+    with pytest.raises(ValueError):
+        reprice_usage("ag1", batch_size=0)
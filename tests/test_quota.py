@@ -0,0 +1,116 @@
+"""租户与 Agent 滑动窗口配额"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from maim_db.core.models import LLMUsage, QuotaCounter
+from maim_db.core.quota import QuotaExceededError, QuotaManager
+
+NOW = datetime(2024, 1, 2, 12, 30, 0)
+
+
+def _at(hours):
+    return NOW + timedelta(hours=hours)
+
+
+@pytest.fixture
+def quota(db):
+    manager = QuotaManager(window_hours=3, reservation_ttl=60)
+    manager.set_limit("agent", "ag1", max_tokens=100)
+    manager.set_limit("tenant", "t1", max_cost=1.0)
+    return manager
+
+
+def _spend(manager, tokens, cost=0.0, current_time=NOW, agent_id="ag1"):
+    reservation = manager.check_and_reserve(
+        agent_id, tokens, cost, tenant_id="t1", current_time=current_time
+    )
+    manager.commit(reservation, current_time=current_time)
+
+
+def test_reservations_count_against_the_budget(quota):
+    reservation = quota.check_and_reserve("ag1", 60, tenant_id="t1", current_time=NOW)
+    with pytest.raises(QuotaExceededError) as excinfo:
+        quota.check_and_reserve("ag1", 50, tenant_id="t1", current_time=NOW)
+    assert excinfo.value.scope == "agent"
+
+    # 实际用量少于预留时按实际入账
+    quota.commit(reservation, 30, current_time=NOW)
+    assert quota.usage("agent", "ag1", current_time=NOW)["tokens"] == 30
+    quota.release(quota.check_and_reserve("ag1", 70, tenant_id="t1", current_time=NOW))
+    assert quota.usage("agent", "ag1", current_time=NOW)["reserved_tokens"] == 0
+
+
+def test_tenant_budget_spans_agents(quota):
+    _spend(quota, 10, 0.6)
+    with pytest.raises(QuotaExceededError) as excinfo:
+        _spend(quota, 10, 0.6, agent_id="ag2")
+    assert (excinfo.value.scope, excinfo.value.scope_id) == ("tenant", "t1")
+
+
+def test_window_slides_by_hour(quota):
+    _spend(quota, 80)
+    with pytest.raises(QuotaExceededError):
+        _spend(quota, 30, current_time=_at(2))
+    # 三小时窗口：NOW 所在小时在 NOW+3h 时滑出
+    _spend(quota, 30, current_time=_at(3))
+    assert quota.usage("agent", "ag1", current_time=_at(3))["tokens"] == 30
+
+
+def test_expired_reservations_are_returned(quota, monkeypatch):
+    quota.check_and_reserve("ag1", 90, tenant_id="t1", current_time=NOW)
+    assert quota.expire_reservations() == 0
+    monkeypatch.setattr("maim_db.core.quota.time.monotonic", lambda: 10 ** 9)
+    assert quota.expire_reservations() == 1
+    assert quota.usage("agent", "ag1", current_time=NOW)["reserved_tokens"] == 0
+
+
+def test_flush_persists_and_reloads_counters(quota):
+    _spend(quota, 20, 0.1)
+    _spend(quota, 5, 0.1, current_time=_at(1))
+    assert quota.flush() == 4
+    assert quota.flush() == 0
+    _spend(quota, 7, current_time=_at(1))
+    assert quota.flush() == 2
+
+    counters = {
+        (row.scope, row.bucket_start): row.tokens for row in QuotaCounter.select()
+    }
+    assert counters[("agent", datetime(2024, 1, 2, 12))] == 20
+    assert counters[("agent", datetime(2024, 1, 2, 13))] == 12
+    assert counters[("tenant", datetime(2024, 1, 2, 13))] == 12
+
+    # 新的管理器从 quota_counters 加载窗口
+    fresh = QuotaManager(window_hours=3)
+    assert fresh.usage("agent", "ag1", current_time=_at(1))["tokens"] == 32
+
+
+def test_purge_drops_buckets_outside_the_window(quota):
+    _spend(quota, 10)
+    _spend(quota, 10, current_time=_at(2))
+    quota.flush()
+    assert quota.purge(current_time=_at(3)) == 2
+    assert {row.bucket_start for row in QuotaCounter.select()} == {datetime(2024, 1, 2, 14)}
+
+
+def test_reconcile_uses_usage_rows(quota):
+    _spend(quota, 5)
+    # 其他进程写入的明细不经过本进程的配额提交
+    LLMUsage.insert_many([{
+        "agent_id": "ag1", "model_name": "gpt", "user_id": "u1", "request_type": "chat",
+        "endpoint": "/v1/chat", "prompt_tokens": 30, "completion_tokens": 10, "total_tokens": 40,
+        "cost": 0.2, "status": "success", "timestamp": NOW - timedelta(minutes=10),
+    }]).execute()
+
+    correction = quota.reconcile_agent("ag1", current_time=NOW)
+    assert correction["tokens"] == 35
+    assert quota.usage("agent", "ag1", current_time=NOW)["tokens"] == 40
+    assert [row.tokens for row in QuotaCounter.select().where(QuotaCounter.scope == "agent")] == [40]
+
+
+def test_invalid_arguments(db):
+    with pytest.raises(ValueError):
+        QuotaManager(window_hours=0)
+    with pytest.raises(ValueError):
+        QuotaManager(window_hours=1).usage("team", "x")
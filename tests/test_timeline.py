@@ -0,0 +1,56 @@
+"""聊天时间线：消息与动作按时间交错合并"""
+
+import pytest
+from conftest import make_message
+
+from maim_db.core.models import ActionRecords
+from maim_db.core.timeline import chat_timeline
+
+
+def _action(i, timestamp, agent_id="ag1", chat_id="s1"):
+    return ActionRecords.create(
+        agent_id=agent_id,
+        action_id=f"a{i}",
+        time=timestamp,
+        action_name="reply",
+        action_data="{}",
+        action_prompt_display=f"action {i}",
+        chat_id=chat_id,
+        chat_info_stream_id=chat_id,
+        chat_info_platform="qq",
+    )
+
+
+@pytest.fixture
+def timeline(db):
+    for i in range(4):
+        make_message(i, timestamp=10.0 * i, user_nickname="alice")
+    _action(1, 15.0)
+    _action(2, 20.0)  # 与 m2 同一时刻
+    _action(3, 15.0, agent_id="ag2")
+    _action(4, 15.0, chat_id="s2")
+    make_message(9, stream_id="s2", timestamp=5.0)
+
+
+def _refs(entries):
+    return [entry.ref_id for entry in entries]
+
+
+def test_messages_and_actions_are_interleaved(timeline):
+    entries = chat_timeline("s1", agent_id="ag1")
+    assert _refs(entries) == ["m0", "m1", "a1", "m2", "a2", "m3"]
+
+    message, action = entries[0], entries[2]
+    assert (message.kind, message.actor, message.content) == ("message", "alice", "hello 0")
+    assert (action.kind, action.actor, action.content) == ("action", "reply", "action 1")
+
+
+def test_time_window_and_limit(timeline):
+    assert _refs(chat_timeline("s1", 10.0, 30.0, agent_id="ag1")) == ["m1", "a1", "m2", "a2"]
+    assert _refs(chat_timeline("s1", limit=3, agent_id="ag1")) == ["m2", "a2", "m3"]
+    assert _refs(chat_timeline("s1", limit=3, agent_id="ag1", newest=False)) == ["m0", "m1", "a1"]
+
+
+def test_timeline_requires_agent(db):
+    with pytest.raises(ValueError):
+        chat_timeline("s1")
@@ -0,0 +1,85 @@
+"""LLM 用量列式分析"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from maim_db.core.models import LLMUsage
+from maim_db.core.usage_analytics import load_usage_columns, usage_report
+
+np = pytest.importorskip("numpy")
+
+START = datetime(2024, 1, 1, 0, 0, 0)
+
+
+def _rows():
+    rows = []
+    for i in range(60):
+        rows.append({
+            "agent_id": "ag1",
+            "model_name": ("gpt", "glm", "qwen")[i % 3],
+            "user_id": "u1",
+            "request_type": "chat",
+            "endpoint": "/v1/chat",
+            "prompt_tokens": i,
+            "completion_tokens": 2 * i,
+            "total_tokens": 3 * i,
+            "cost": 0.25 * i,
+            # 每 10 条有一条缺少耗时
+            "time_cost": None if i % 10 == 0 else float(i),
+            "status": "error" if i % 4 == 0 else "success",
+            "timestamp": START + timedelta(minutes=i),
+        })
+    return rows
+
+
+@pytest.fixture
+def usage(db):
+    rows = _rows()
+    LLMUsage.insert_many(rows).execute()
+    LLMUsage.insert_many([dict(rows[0], agent_id="ag2")]).execute()
+    return rows
+
+
+def test_columns_are_loaded_in_chunks(usage):
+    columns = load_usage_columns(agent_id="ag1", chunk_size=7)
+    assert len(columns) == 60
+    assert columns.model_names == ["gpt", "glm", "qwen"]
+    assert int(columns.total_tokens.sum()) == sum(row["total_tokens"] for row in usage)
+    assert int(np.isnan(columns.time_cost).sum()) == 6
+
+    window = load_usage_columns(START + timedelta(minutes=10), START + timedelta(minutes=20), agent_id="ag1")
+    assert len(window) == 10
+
+
+def test_report_matches_row_by_row_computation(usage):
+    report = usage_report(load_usage_columns(agent_id="ag1", chunk_size=16), bins=5)
+
+    assert report["requests"] == 60
+    assert report["cost"] == pytest.approx(sum(row["cost"] for row in usage))
+    latencies = [row["time_cost"] for row in usage if row["time_cost"] is not None]
+    assert report["time_cost_percentiles"][50] == pytest.approx(float(np.percentile(latencies, 50)))
+
+    for name in ("gpt", "glm", "qwen"):
+        rows = [row for row in usage if row["model_name"] == name]
+        stats = report["by_model"][name]
+        assert stats["requests"] == len(rows)
+        assert stats["total_tokens"] == sum(row["total_tokens"] for row in rows)
+        assert stats["cost"] == pytest.approx(sum(row["cost"] for row in rows))
+        errors = sum(1 for row in rows if row["status"] != "success")
+        assert stats["error_rate"] == pytest.approx(errors / len(rows))
+        model_latencies = [row["time_cost"] for row in rows if row["time_cost"] is not None]
+        assert stats["time_cost_percentiles"][90] == pytest.approx(
+            float(np.percentile(model_latencies, 90))
+        )
+
+    assert report["by_status"]["error"] == {"requests": 15, "ratio": 0.25}
+    assert sum(report["token_histogram"]["counts"]) == 60
+    assert len(report["token_histogram"]["edges"]) == 6
+
+
+def test_empty_report(db):
+    report = usage_report(load_usage_columns(agent_id="ag1"))
+    assert report["requests"] == 0
+    assert report["by_model"] == {}
+    assert report["time_cost_percentiles"] == {50: None, 90: None, 99: None}
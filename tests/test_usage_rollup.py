@@ -0,0 +1,118 @@
+"""LLM 用量两级汇总"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from maim_db.core.models import LLMUsage, LLMUsageDaily, LLMUsageHourly
+from maim_db.core.usage_rollup import UsageRollup
+
+START = datetime(2024, 1, 1, 0, 0, 0)
+
+
+def _usage_row(timestamp, model_name="gpt", agent_id="ag1"):
+    return {
+        "agent_id": agent_id,
+        "model_name": model_name,
+        "user_id": "u1",
+        "request_type": "chat",
+        "endpoint": "/v1/chat",
+        "prompt_tokens": 10,
+        "completion_tokens": 5,
+        "total_tokens": 15,
+        "cost": 0.5,
+        "time_cost": 1.0,
+        "status": "success",
+        "timestamp": timestamp,
+    }
+
+
+# 约 3 天内每 97 分钟一条，落在不同的小时与日期
+TIMESTAMPS = [START + timedelta(minutes=97 * i) for i in range(45)]
+
+
+@pytest.fixture
+def rollup(db):
+    rollup = UsageRollup(batch_size=7)
+    rollup.enable()
+    yield rollup
+    rollup.disable()
+
+
+def _bucket_rows(model):
+    return sorted(
+        (row.agent_id, row.model_name, row.bucket_start, row.request_count, row.total_tokens, row.cost)
+        for row in model.select_unscoped()
+    )
+
+
+def test_listener_matches_rebuild(rollup):
+    for i, timestamp in enumerate(TIMESTAMPS):
+        LLMUsage.create(**_usage_row(timestamp, model_name="gpt" if i % 3 else "glm"))
+    LLMUsage.create(**_usage_row(START, agent_id="ag2"))
+
+    hourly, daily = _bucket_rows(LLMUsageHourly), _bucket_rows(LLMUsageDaily)
+    assert sum(row[3] for row in daily) == 46
+
+    assert rollup.rebuild() == len(hourly)
+    assert _bucket_rows(LLMUsageHourly) == hourly
+    assert _bucket_rows(LLMUsageDaily) == daily
+
+
+def test_rebuild_fills_bulk_inserts_for_covered_days(rollup):
+    LLMUsage.insert_many([_usage_row(t) for t in TIMESTAMPS]).execute()
+    assert LLMUsageDaily.select_unscoped().count() == 0
+
+    # 只重算第二天：对齐到整天
+    rollup.rebuild(START + timedelta(days=1, hours=5), START + timedelta(days=1, hours=6))
+    days = {row.bucket_start: row.request_count for row in LLMUsageDaily.select_unscoped()}
+    assert list(days) == [START + timedelta(days=1)]
+    expected = sum(1 for t in TIMESTAMPS if t.date() == (START + timedelta(days=1)).date())
+    assert days[START + timedelta(days=1)] == expected
+
+
+def test_summary_combines_day_hour_and_raw_segments(rollup):
+    for i, timestamp in enumerate(TIMESTAMPS):
+        LLMUsage.create(**_usage_row(timestamp, model_name="gpt" if i % 3 else "glm"))
+
+    start = START + timedelta(hours=5, minutes=30)
+    end = START + timedelta(days=2, hours=7, minutes=10)
+    assert [source for source, _, _ in rollup.plan(start, end)] == ["raw", "hour", "day", "hour", "raw"]
+
+    summary = {row["model_name"]: row for row in rollup.usage_summary(start, end, agent_id="ag1")}
+    for name in ("gpt", "glm"):
+        expected = [
+            t for i, t in enumerate(TIMESTAMPS)
+            if start <= t < end and ("gpt" if i % 3 else "glm") == name
+        ]
+        assert summary[name]["request_count"] == len(expected)
+        assert summary[name]["total_tokens"] == 15 * len(expected)
+
+    total = rollup.usage_summary(agent_id="ag1", group_by=())
+    assert total == [
+        {
+            "request_count": 45,
+            "prompt_tokens": 450,
+            "completion_tokens": 225,
+            "total_tokens": 675,
+            "cost": 22.5,
+            "time_cost": 45.0,
+        }
+    ]
+
+
+def test_usage_series_by_day(rollup):
+    for timestamp in TIMESTAMPS:
+        LLMUsage.create(**_usage_row(timestamp))
+    series = rollup.usage_series(START, START + timedelta(days=3), agent_id="ag1")
+    assert [row["bucket_start"] for row in series] == [START + timedelta(days=d) for d in range(3)]
+    assert sum(row["request_count"] for row in series) == 45
+
+
+def test_invalid_arguments(rollup):
+    with pytest.raises(ValueError):
+        rollup.usage_summary(agent_id="ag1", group_by=("user_id",))
+    with pytest.raises(ValueError):
+        rollup.usage_series(START, START, granularity="week", agent_id="ag1")
+    with pytest.raises(ValueError):
+        rollup.usage_summary()